@@ -1,14 +1,99 @@
+import os
+import time
+import random
+import logging
 import numpy as np
+import torch
 from torch.utils.data import DataLoader
 from torch.utils.data.dataloader import default_collate
 from torch.utils.data.sampler import SubsetRandomSampler
+from torch.utils.data.distributed import DistributedSampler
+from utils.distributed import is_distributed
+
+# offset between the worker seeds of consecutive ranks
+_RANK_STRIDE = 1000003
+
+
+def seed_worker(worker_id):
+    """
+    worker_init_fn seeding python and numpy generators of a data loader worker. torch already seeds each worker with
+    base_seed + worker_id, the other generators would otherwise inherit the state of the parent process and every
+    worker would draw the same random crops, flips and color jitter. In distributed training, the seed is offset by
+    the rank since the workers of all ranks get the same torch seeds
+    """
+    seed = (torch.initial_seed() + _RANK_STRIDE * int(os.environ.get('RANK', 0))) % 2 ** 32
+    torch.manual_seed(seed)
+    random.seed(seed)
+    np.random.seed(seed)
+
+
+def tune_num_workers(dataset, batch_size, collate_fn=default_collate, candidates=None, num_batches=10, **kwargs):
+    """
+    Load a few batches with each number of workers and return the fastest one. The time until the first batch
+    (start-up of workers) isn't counted. Random generators are restored afterwards so that tuning doesn't change
+    the training run
+    :param candidates: list of int - numbers of workers to try (default: 0, 2, 4, ... up to the number of cpus)
+    :param num_batches: int - number of timed batches per candidate
+    :param kwargs: other arguments of DataLoader e.g. pin_memory
+    :return: int - fastest number of workers
+    """
+    if candidates is None:
+        candidates = [0] + list(range(2, (os.cpu_count() or 1) + 1, 2))
+    num_batches = min(num_batches, len(dataset) // batch_size - 1)
+    if num_batches < 1:
+        return candidates[0]
+
+    py_state, np_state = random.getstate(), np.random.get_state()
+    throughputs = {}
+    with torch.random.fork_rng(devices=[]):
+        for num_workers in candidates:
+            loader = DataLoader(dataset, batch_size, shuffle=True, collate_fn=collate_fn, num_workers=num_workers,
+                                worker_init_fn=seed_worker, **kwargs)
+            iterator = iter(loader)
+            next(iterator)
+            start = time.perf_counter()
+            for _ in range(num_batches):
+                next(iterator)
+            throughputs[num_workers] = num_batches * batch_size / (time.perf_counter() - start)
+            del iterator
+    random.setstate(py_state)
+    np.random.set_state(np_state)
+
+    best = max(throughputs, key=throughputs.get)
+    logging.getLogger(__name__).info(
+        'Data loader throughput (samples/sec) by num_workers: {}, using {} workers'.format(
+            ', '.join('{}: {:.1f}'.format(n, throughput) for n, throughput in throughputs.items()), best))
+    return best
+
+
+class EpochDistributedSampler(DistributedSampler):
+    """
+    DistributedSampler that moves to the next epoch at every pass, so that the shard of each rank is reshuffled
+    without set_epoch() being called e.g. by inf_loop. All ranks iterate as many times, they stay consistent
+    """
+    def __iter__(self):
+        indices = super().__iter__()
+        self.epoch += 1
+        return indices
 
 
 class BaseDataLoader(DataLoader):
     """
     Base class for all data loaders
     """
-    def __init__(self, dataset, batch_size, shuffle, validation_split, num_workers, collate_fn=default_collate):
+    def __init__(self, dataset, batch_size, shuffle, validation_split, num_workers, collate_fn=default_collate,
+                 pin_memory=False, persistent_workers=False, prefetch_factor=2, drop_last=False, seed=None,
+                 worker_candidates=None):
+        """
+        :param num_workers: int or 'auto' - 'auto' benchmarks worker_candidates at start-up and keeps the fastest
+        :param pin_memory: bool - return batches in pinned memory for faster (non-blocking) copies to the gpu
+        :param persistent_workers: bool - keep workers alive across epochs, only used if num_workers > 0
+        :param prefetch_factor: int - number of batches loaded ahead by each worker, only used if num_workers > 0
+        :param drop_last: bool - drop the last incomplete training batch, validation batches are never dropped
+        :param seed: int - seed of shuffling and of worker generators, random if None. In distributed training,
+            each rank gets a shard of the dataset shuffled with this seed (default: 0)
+        :param worker_candidates: list of int - numbers of workers tried if num_workers is 'auto'
+        """
         self.validation_split = validation_split
         self.shuffle = shuffle
 
@@ -16,14 +101,34 @@ class BaseDataLoader(DataLoader):
         self.n_samples = len(dataset)
 
         self.sampler, self.valid_sampler = self._split_sampler(self.validation_split)
+        if is_distributed():
+            if self.valid_sampler is not None:
+                raise ValueError('validation_split is not supported in distributed training, please use a separate '
+                                 'validation data loader')
+            # every rank loads its own shard of batch_size samples per step
+            self.sampler = EpochDistributedSampler(dataset, shuffle=self.shuffle, seed=0 if seed is None else seed,
+                                                   drop_last=drop_last)
+            self.shuffle = False
+
+        if num_workers == 'auto':
+            num_workers = tune_num_workers(dataset, batch_size, collate_fn, worker_candidates, pin_memory=pin_memory)
 
         self.init_kwargs = {
             'dataset': dataset,
             'batch_size': batch_size,
             'shuffle': self.shuffle,
             'collate_fn': collate_fn,
-            'num_workers': num_workers
+            'num_workers': num_workers,
+            'pin_memory': pin_memory,
+            'drop_last': drop_last,
+            'worker_init_fn': seed_worker,
         }
+        if seed is not None:
+            self.init_kwargs['generator'] = torch.Generator().manual_seed(seed)
+        # DataLoader rejects these options without workers
+        if num_workers > 0:
+            self.init_kwargs['persistent_workers'] = persistent_workers
+            self.init_kwargs['prefetch_factor'] = prefetch_factor
         super().__init__(sampler=self.sampler, **self.init_kwargs)
 
     def _split_sampler(self, split):
@@ -58,4 +163,4 @@ class BaseDataLoader(DataLoader):
         if self.valid_sampler is None:
             return None
         else:
-            return DataLoader(sampler=self.valid_sampler, **self.init_kwargs)
+            return DataLoader(sampler=self.valid_sampler, **dict(self.init_kwargs, drop_last=False))
@@ -2,6 +2,9 @@ import torch
 from abc import abstractmethod
 from numpy import inf
 from logger import TensorboardWriter
+from utils import MixedPrecision, StepTimer, TrainingProfiler, DevicePrefetcher
+from utils.distributed import is_distributed, is_main_process, get_local_rank
+from torch.nn.parallel import DistributedDataParallel
 from tensorboardX import SummaryWriter
 
 class BaseTrainer:
@@ -15,14 +18,45 @@ class BaseTrainer:
         # setup GPU device if available, move models into configured device
         self.device, device_ids = self._prepare_device(config['n_gpu'])
         self.model = model.to(self.device)
-        if len(device_ids) > 1:
+        cfg_trainer = config['trainer']
+        if is_distributed():
+            # one process per device (or per group of cpu cores) launched by torchrun, e.g.
+            # "distributed": {"find_unused_parameters": true}
+            ddp_args = dict(cfg_trainer.get('distributed', {}))
+            if self.device.type == 'cuda':
+                ddp_args['device_ids'] = [self.device.index]
+            if hasattr(self.model, 'distribute'):
+                # distillation models only synchronize the student, the teacher is frozen
+                self.model.distribute(**ddp_args)
+            else:
+                self.model = DistributedDataParallel(self.model, **ddp_args)
+        elif len(device_ids) > 1:
             self.model = torch.nn.DataParallel(model, device_ids=device_ids)
 
         self.criterion = criterion
         self.metric_ftns = metric_ftns
         self.optimizer = optimizer
 
-        cfg_trainer = config['trainer']
+        # mixed precision autocast and memory format of forward passes e.g. {"dtype": "bf16", "channels_last": true}
+        self.precision = MixedPrecision(device_type=self.device.type, **cfg_trainer.get('precision', {}))
+        self.precision.apply_memory_format(self.model)
+        # wall time of the phases of training steps e.g. "step_timer": true or {"synchronize": true}
+        step_timer_args = cfg_trainer.get('step_timer', False)
+        self.step_timer = StepTimer(enabled=bool(step_timer_args), device=self.device,
+                                    **(step_timer_args if isinstance(step_timer_args, dict) else {}))
+        # time teacher and student forwards of distillation models separately
+        for name in ('teacher', 'student'):
+            if hasattr(model, name):
+                self.step_timer.attach(getattr(model, name), name + '_forward')
+        # torch.profiler window of training steps e.g. "profile": {"epoch": 1, "wait": 1, "warmup": 1, "active": 3}
+        self.profiler = TrainingProfiler(config.log_dir, self.device, enabled='profile' in cfg_trainer,
+                                         **cfg_trainer.get('profile', {}))
+        self.step_timer.record_functions = self.profiler.enabled
+        # load and copy the next training batches to the device in the background e.g. "prefetch": true or
+        # {"queue_size": 2, "pin_memory": true}
+        prefetch_args = cfg_trainer.get('prefetch', False)
+        self.prefetcher = DevicePrefetcher(self.device, enabled=bool(prefetch_args),
+                                           **(prefetch_args if isinstance(prefetch_args, dict) else {}))
         self.accumulation_steps = cfg_trainer['accumulation_steps']
         self.epochs = cfg_trainer['epochs']
         self.save_period = cfg_trainer['save_period']
@@ -44,7 +78,7 @@ class BaseTrainer:
         self.checkpoint_dir = config.save_dir
 
         # setup visualization writer instance
-        self.writer = TensorboardWriter(config.log_dir, self.logger, cfg_trainer['tensorboard'])
+        self.writer = TensorboardWriter(config.log_dir, self.logger, cfg_trainer['tensorboard'] and is_main_process())
 
         if config.resume is not None:
             self._resume_checkpoint(config.resume)
@@ -58,6 +92,15 @@ class BaseTrainer:
         """
         raise NotImplementedError
 
+    def iterate_train(self, data_loader):
+        """
+        iterate over the training batches of an epoch. Batches are prefetched to the device if configured, the time
+        waiting for each batch is recorded by the step timer and the profiler schedule advances after each step
+        """
+        for batch in self.step_timer.iterate(self.prefetcher.iterate(data_loader)):
+            yield batch
+            self.profiler.step()
+
     @abstractmethod
     def _valid_epoch(self, epoch):
         """
@@ -82,7 +125,8 @@ class BaseTrainer:
         """
         not_improved_count = 0
         for epoch in range(self.start_epoch, self.epochs + 1):
-            result = self._train_epoch(epoch)
+            with self.profiler.profile_epoch(epoch):
+                result = self._train_epoch(epoch)
 
             # save logged informations into log dict
             log = {'epoch': epoch}
@@ -146,6 +190,11 @@ class BaseTrainer:
         """
         setup GPU device if available, move models into configured device
         """
+        if is_distributed():
+            # each process uses the device of its local rank
+            if n_gpu_use > 0 and torch.cuda.is_available():
+                return torch.device('cuda', get_local_rank()), [get_local_rank()]
+            return torch.device('cpu'), []
         n_gpu = torch.cuda.device_count()
         if n_gpu_use > 0 and n_gpu == 0:
             self.logger.warning("Warning: There\'s no GPU available on this machine,"
@@ -167,6 +216,9 @@ class BaseTrainer:
         :param log: logging information of the epoch
         :param save_best: if True, rename the saved checkpoint to 'model_best.pth'
         """
+        # every rank has the same weights, only rank 0 writes them
+        if not is_main_process():
+            return
         arch = type(self.model).__name__
         state = {
             'arch': arch,
@@ -0,0 +1,108 @@
+"""
+Activation memory per sample of a DeepWV3Plus distillation step with activation checkpointing of modN stages and
+the frozen prefix of the student run without autograd.
+
+Every mode runs in a fresh process so that the peak RSS of one mode does not leak into the next one:
+
+    python -m benchmarks.activation_memory --crop_size 512 --batch_size 4 --checkpoint_blocks mod5 mod6 mod7
+"""
+import argparse
+import json
+import time
+import torch
+from models import DeepWV3Plus
+from models.students import DepthwiseStudent
+from losses import KLDivergenceLoss
+from benchmarks.common import peak_rss_mb, run_in_process
+
+NUM_CLASSES = 19
+
+
+def _modes(args):
+    return [
+        {'name': 'baseline', 'checkpoint_blocks': [], 'no_grad_frozen': False},
+        {'name': 'no_grad_frozen', 'checkpoint_blocks': [], 'no_grad_frozen': True},
+        {'name': 'checkpoint', 'checkpoint_blocks': args.checkpoint_blocks, 'no_grad_frozen': False},
+        {'name': 'checkpoint+no_grad_frozen', 'checkpoint_blocks': args.checkpoint_blocks, 'no_grad_frozen': True},
+    ]
+
+
+def run_mode(mode, args):
+    torch.manual_seed(0)
+    torch.set_num_threads(args.threads)
+    model = DepthwiseStudent(DeepWV3Plus(NUM_CLASSES), {'teacher': {'share_memory': True}})
+    model.unfreeze(args.unfreeze)
+    if mode['checkpoint_blocks']:
+        model.enable_checkpointing(mode['checkpoint_blocks'])
+    if mode['no_grad_frozen']:
+        model.enable_no_grad_frozen()
+    model.train()
+    criterion = KLDivergenceLoss(temperature=4)
+    optimizer = torch.optim.SGD(filter(lambda p: p.requires_grad, model.student.parameters()), lr=0.01)
+    data = torch.randn(args.batch_size, 3, args.crop_size, args.crop_size)
+    # rss after the first step i.e. weights, gradients and optimizer state, the rest of the peak is activation memory
+    resident_mb = None
+
+    step_times = []
+    for step in range(args.warmup + args.steps):
+        start = time.perf_counter()
+        output_st, output_tc = model(data)
+        loss = criterion(output_st, output_tc)
+        loss.backward()
+        optimizer.step()
+        optimizer.zero_grad(set_to_none=False)
+        if step >= args.warmup:
+            step_times.append(time.perf_counter() - start)
+        if resident_mb is None:
+            del output_st, output_tc, loss
+            resident_mb = _current_rss_mb()
+
+    peak_mb = peak_rss_mb()
+    activation_mb = (peak_mb - resident_mb) / args.batch_size
+    return {
+        'mode': mode['name'],
+        'images_per_sec': args.batch_size * len(step_times) / sum(step_times),
+        'step_time_ms': 1000 * sum(step_times) / len(step_times),
+        'peak_rss_mb': peak_mb,
+        'activation_mb_per_sample': activation_mb,
+        # largest batch whose activations fit in the budget next to weights, gradients and optimizer state
+        'max_batch_size': int((args.memory_budget_mb - resident_mb) // activation_mb) if activation_mb > 0 else None,
+    }
+
+
+def _current_rss_mb():
+    with open('/proc/self/statm') as handle:
+        pages = int(handle.read().split()[1])
+    return pages * 4096 / 1024 ** 2
+
+
+def main(args):
+    results = [run_in_process(run_mode, mode, args) for mode in _modes(args)]
+
+    print('{:28s} {:>12s} {:>14s} {:>14s} {:>20s} {:>16s}'.format(
+        'mode', 'images/sec', 'step time(ms)', 'peak RSS(MB)', 'activations/sample(MB)',
+        'max batch@{:.0f}MB'.format(args.memory_budget_mb)))
+    for result in results:
+        print('{:28s} {:12.2f} {:14.1f} {:14.1f} {:20.1f} {:>16s}'.format(
+            result['mode'], result['images_per_sec'], result['step_time_ms'], result['peak_rss_mb'],
+            result['activation_mb_per_sample'], str(result['max_batch_size'])))
+    if args.output is not None:
+        with open(args.output, 'w') as handle:
+            json.dump(results, handle, indent=4)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark activation checkpointing of a DeepWV3Plus student on CPU')
+    parser.add_argument('--crop_size', default=256, type=int)
+    parser.add_argument('--batch_size', default=2, type=int)
+    parser.add_argument('--steps', default=3, type=int, help='number of measured steps')
+    parser.add_argument('--warmup', default=1, type=int, help='number of steps before measuring')
+    parser.add_argument('--threads', default=torch.get_num_threads(), type=int)
+    parser.add_argument('--unfreeze', default=['mod5', 'mod6', 'mod7', 'aspp', 'bot_aspp', 'bot_fine', 'final'],
+                        nargs='+', help='trainable blocks of the student, the blocks before form the frozen prefix')
+    parser.add_argument('--checkpoint_blocks', default=['mod5', 'mod6', 'mod7'], nargs='+',
+                        help='sequential stages run with activation checkpointing')
+    parser.add_argument('--memory_budget_mb', default=16384, type=float,
+                        help='memory available to a training process, used to report the largest batch size')
+    parser.add_argument('--output', default=None, type=str, help='path of json report (default: None)')
+    main(parser.parse_args())
@@ -0,0 +1,90 @@
+"""
+Time and agreement of the batched tensor canny of GSCNN against the previous per-image cv2.Canny path, on normalized
+random images as GSCNN receives them. The edges are first checked against cv2.Canny on fixed images (a smooth gradient
+with a square, and seeded noise in the range of uint8 images), the check is skipped when opencv is not installed:
+
+    python -m benchmarks.canny --batch_size 4 --height 512 --width 1024
+    python -m benchmarks.canny --check_only
+"""
+import argparse
+import json
+import torch
+from models.gscnn.edges import cv2, canny, opencv_canny, edge_agreement
+from benchmarks.common import time_steps, summarize
+
+
+def check_images():
+    """
+    :return: Tensor of shape (3x3x64x96) - images with edges of every direction, noise and constant areas
+    """
+    rows, cols = torch.meshgrid(torch.arange(64.), torch.arange(96.), indexing='ij')
+    shapes = 40. * ((rows - 32).abs() + (cols - 48).abs() < 20).float() + 2 * cols
+    square = torch.zeros(64, 96)
+    square[16:48, 24:72] = 200.
+    generator = torch.Generator().manual_seed(0)
+    noise = torch.randint(0, 256, (3, 64, 96), generator=generator).float()
+    return torch.stack([shapes.expand(3, -1, -1), square.expand(3, -1, -1), noise])
+
+
+def check(args):
+    """
+    compare the tensor canny with cv2.Canny on check_images
+    :return: dict - agreement of the edges, None if opencv is not installed
+    """
+    if cv2 is None:
+        print('opencv is not installed, skipping the check against cv2.Canny')
+        return None
+    images = check_images()
+    result = edge_agreement(canny(images), opencv_canny(images))
+    print('check against cv2.Canny: agreement {pixel_agreement:.4f}, precision {precision:.4f}, '
+          'recall {recall:.4f}'.format(**result))
+    if result['pixel_agreement'] < args.min_agreement:
+        raise ValueError('Canny edges agree with cv2.Canny on {:.4f} of the pixels, expected at least {}'.format(
+            result['pixel_agreement'], args.min_agreement))
+    return result
+
+
+def main(args):
+    check(args)
+    if args.check_only:
+        return
+    torch.manual_seed(0)
+    device = torch.device(args.device)
+    inp = torch.randn(args.batch_size, 3, args.height, args.width, device=device)
+
+    def sync(fn):
+        def step():
+            fn(inp)
+            if device.type == 'cuda':
+                torch.cuda.synchronize()
+        return step
+
+    results = [summarize('canny', 'opencv', time_steps(sync(opencv_canny), args.steps, args.warmup), args.batch_size),
+               summarize('canny', 'torch', time_steps(sync(canny), args.steps, args.warmup), args.batch_size)]
+    results[1].update(edge_agreement(canny(inp), opencv_canny(inp)))
+
+    print('{:10s} {:>12s} {:>14s} {:>10s} {:>10s} {:>10s}'.format('edges', 'images/sec', 'step time(ms)', 'agreement',
+                                                                 'precision', 'recall'))
+    for result in results:
+        print('{:10s} {:12.2f} {:14.2f} {:>10s} {:>10s} {:>10s}'.format(
+            result['name'], result['samples_per_sec'], result['step_time_ms']['p50'],
+            *['{:.4f}'.format(result[key]) if key in result else '-'
+              for key in ['pixel_agreement', 'precision', 'recall']]))
+    if args.output is not None:
+        with open(args.output, 'w') as handle:
+            json.dump(results, handle, indent=4)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the tensor canny edges of GSCNN against opencv')
+    parser.add_argument('--batch_size', default=4, type=int)
+    parser.add_argument('--height', default=512, type=int)
+    parser.add_argument('--width', default=1024, type=int)
+    parser.add_argument('--steps', default=10, type=int, help='number of measured steps')
+    parser.add_argument('--warmup', default=2, type=int, help='number of steps before measuring')
+    parser.add_argument('--device', default='cpu', type=str)
+    parser.add_argument('--min_agreement', default=0.999, type=float,
+                        help='minimum ratio of pixels with the same edges as cv2.Canny in the check')
+    parser.add_argument('--check_only', action='store_true', help='only check the edges against cv2.Canny')
+    parser.add_argument('--output', default=None, type=str, help='path of json report (default: None)')
+    main(parser.parse_args())
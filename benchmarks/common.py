@@ -0,0 +1,87 @@
+import multiprocessing as mp
+import queue as queue_module
+import resource
+import time
+import traceback
+import numpy as np
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def time_steps(step, steps, warmup):
+    """
+    :param step: callable - one step of the workload
+    :return: list of float - wall time in seconds of each measured step
+    """
+    step_times = []
+    for i in range(warmup + steps):
+        start = time.perf_counter()
+        step()
+        if i >= warmup:
+            step_times.append(time.perf_counter() - start)
+    return step_times
+
+
+def summarize(workload, name, step_times, samples_per_step):
+    """
+    :return: dict - throughput, step time percentiles in milliseconds and peak RSS of the current process
+    """
+    step_ms = 1000 * np.asarray(step_times)
+    return {
+        'workload': workload,
+        'name': name,
+        'steps': len(step_times),
+        'samples_per_sec': samples_per_step * len(step_times) / float(np.sum(step_times)),
+        'step_time_ms': {
+            'mean': float(step_ms.mean()),
+            'p50': float(np.percentile(step_ms, 50)),
+            'p90': float(np.percentile(step_ms, 90)),
+            'p99': float(np.percentile(step_ms, 99)),
+            'max': float(step_ms.max()),
+        },
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def _call(target, args, queue):
+    try:
+        queue.put((True, target(*args)))
+    except BaseException:
+        queue.put((False, traceback.format_exc()))
+
+
+def run_in_process(target, *args, poll_interval=1.):
+    """
+    run target(*args) in a fresh spawned process so that the peak RSS of one workload doesn't leak into the next one
+    :param target: callable - module-level function whose result is picklable
+    :return: result of target
+    :raise RuntimeError: with the traceback of the child if target raises, or its exit code if the child dies
+        without a result (e.g. killed when out of memory)
+    """
+    ctx = mp.get_context('spawn')
+    queue = ctx.Queue()
+    process = ctx.Process(target=_call, args=(target, args, queue))
+    process.start()
+    try:
+        while True:
+            try:
+                succeeded, result = queue.get(timeout=poll_interval)
+                break
+            except queue_module.Empty:
+                if process.is_alive():
+                    continue
+            # the result may have been put right before the child exited
+            try:
+                succeeded, result = queue.get(timeout=poll_interval)
+                break
+            except queue_module.Empty:
+                raise RuntimeError('{} exited with code {} without a result'.format(target.__name__,
+                                                                                   process.exitcode))
+    finally:
+        process.join()
+    if not succeeded:
+        raise RuntimeError('{} failed in a child process:\n{}'.format(target.__name__, result))
+    return result
@@ -0,0 +1,53 @@
+"""
+Synthetic datasets with the on-disk layout or the in-memory format of the real ones so that benchmarks run through the
+real dataset classes without downloading anything
+"""
+import os
+import numpy as np
+from PIL import Image
+from torchvision import datasets
+from data_loader.cityscapes import Cityscapes
+
+# label ids of classes which are evaluated i.e. have a train id
+EVAL_LABEL_IDS = [cls.id for cls in Cityscapes.classes if not cls.ignore_in_eval]
+
+
+def make_fake_cityscapes(root, num_images=8, height=256, width=512, splits=('train', 'val'), city='fakecity',
+                         block_size=32, seed=0):
+    """
+    Write random images and label maps with the directory layout of Cityscapes:
+        root/leftImg8bit/<split>/<city>/<city>_<id>_000019_leftImg8bit.png
+        root/gtFine/<split>/<city>/<city>_<id>_000019_gtFine_labelIds.png
+    :param block_size: int - label maps are made of square regions of this size so that every class has centroids
+    """
+    rng = np.random.RandomState(seed)
+    for split in splits:
+        image_dir = os.path.join(root, 'leftImg8bit', split, city)
+        target_dir = os.path.join(root, 'gtFine', split, city)
+        os.makedirs(image_dir, exist_ok=True)
+        os.makedirs(target_dir, exist_ok=True)
+        for i in range(num_images):
+            prefix = '{}_{:06d}_000019'.format(city, i)
+            image = rng.randint(0, 256, size=(height, width, 3), dtype=np.uint8)
+            coarse = rng.choice(EVAL_LABEL_IDS, size=(-(-height // block_size), -(-width // block_size)))
+            label = np.kron(coarse, np.ones((block_size, block_size), dtype=coarse.dtype))[:height, :width]
+            Image.fromarray(image).save(os.path.join(image_dir, prefix + '_leftImg8bit.png'))
+            Image.fromarray(label.astype(np.uint8)).save(os.path.join(target_dir, prefix + '_gtFine_labelIds.png'))
+    return root
+
+
+class FakeCIFAR10(datasets.CIFAR10):
+    """
+    CIFAR10 filled with random images, __getitem__ and the transforms are the ones of torchvision CIFAR10
+    """
+
+    def __init__(self, num_samples=1024, transform=None, target_transform=None, seed=0):
+        rng = np.random.RandomState(seed)
+        self.root = None
+        self.train = True
+        self.transform = transform
+        self.target_transform = target_transform
+        self.transforms = None
+        self.data = rng.randint(0, 256, size=(num_samples, 32, 32, 3), dtype=np.uint8)
+        self.targets = rng.randint(0, 10, size=num_samples).tolist()
+        self.classes = [str(i) for i in range(10)]
@@ -0,0 +1,105 @@
+"""
+Peak memory and time of the OCR head of HighResolutionNet (gather head and object attention) with the full attention
+against the chunked attention, at the resolution of the OCR features of a full Cityscapes frame (1/4 of 1024x2048).
+The chunked outputs are checked against the full attention at --validate_resolution first.
+
+Every mode runs in a fresh process so that the peak RSS of one mode does not leak into the next one:
+
+    python -m benchmarks.ocr_attention --resolution 256 512 --chunk_sizes 4096 16384
+"""
+import argparse
+import json
+import time
+import torch
+from models.hrnet_ocr.seg_hrnet_ocr import SpatialGather_Module, SpatialOCR_Module
+from benchmarks.common import peak_rss_mb, run_in_process
+
+NUM_CLASSES = 19
+MID_CHANNELS = 512
+KEY_CHANNELS = 256
+
+
+def build_head(chunk_size):
+    torch.manual_seed(0)
+    gather = SpatialGather_Module(NUM_CLASSES, chunk_size=chunk_size)
+    distri = SpatialOCR_Module(MID_CHANNELS, KEY_CHANNELS, MID_CHANNELS, dropout=0.05, chunk_size=chunk_size)
+    return gather.eval(), distri.eval()
+
+
+def run_head(head, feats, probs):
+    gather, distri = head
+    with torch.no_grad():
+        return distri(feats, gather(feats, probs))
+
+
+def inputs(batch_size, height, width):
+    torch.manual_seed(1)
+    return torch.randn(batch_size, MID_CHANNELS, height, width), torch.randn(batch_size, NUM_CLASSES, height, width)
+
+
+def validate(args):
+    feats, probs = inputs(args.batch_size, *args.validate_resolution)
+    reference = run_head(build_head(None), feats, probs)
+    results = []
+    for chunk_size in args.chunk_sizes:
+        output = run_head(build_head(chunk_size), feats, probs)
+        max_abs_diff = float((output - reference).abs().max())
+        results.append({'chunk_size': chunk_size, 'max_abs_diff': max_abs_diff,
+                        'parity': bool(torch.allclose(output, reference, atol=args.atol, rtol=args.rtol))})
+    return results
+
+
+def run_mode(chunk_size, args):
+    torch.set_num_threads(args.threads)
+    head = build_head(chunk_size)
+    feats, probs = inputs(args.batch_size, *args.resolution)
+    resident_mb = peak_rss_mb()
+    times = []
+    for step in range(args.warmup + args.steps):
+        start = time.perf_counter()
+        run_head(head, feats, probs)
+        if step >= args.warmup:
+            times.append(time.perf_counter() - start)
+    return {
+        'chunk_size': chunk_size,
+        'time_ms': 1000 * sum(times) / len(times),
+        'peak_rss_mb': peak_rss_mb(),
+        'attention_mb': peak_rss_mb() - resident_mb,
+    }
+
+
+def main(args):
+    validation = validate(args)
+    for result in validation:
+        print('chunk size {:>8d}: max abs diff {:.2e}, parity {}'.format(result['chunk_size'], result['max_abs_diff'],
+                                                                        result['parity']))
+
+    results = [run_in_process(run_mode, chunk_size, args) for chunk_size in [None] + args.chunk_sizes]
+
+    print('{:>12s} {:>12s} {:>14s} {:>14s}'.format('chunk size', 'time(ms)', 'peak RSS(MB)', 'head peak(MB)'))
+    for result in results:
+        print('{:>12s} {:12.1f} {:14.1f} {:14.1f}'.format(
+            str(result['chunk_size']), result['time_ms'], result['peak_rss_mb'], result['attention_mb']))
+    if args.output is not None:
+        with open(args.output, 'w') as handle:
+            json.dump({'validation': validation, 'modes': results}, handle, indent=4)
+    if not all(result['parity'] for result in validation):
+        raise ValueError('Chunked OCR attention differs from the full attention by more than atol={} rtol={}'.format(
+            args.atol, args.rtol))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the chunked OCR attention of HighResolutionNet on CPU')
+    parser.add_argument('--resolution', default=[256, 512], nargs=2, type=int,
+                        help='height and width of the OCR features (1/4 of the image)')
+    parser.add_argument('--validate_resolution', default=[128, 256], nargs=2, type=int,
+                        help='height and width of the OCR features compared to the full attention')
+    parser.add_argument('--batch_size', default=1, type=int)
+    parser.add_argument('--chunk_sizes', default=[4096, 16384], nargs='+', type=int)
+    parser.add_argument('--steps', default=3, type=int, help='number of measured steps')
+    parser.add_argument('--warmup', default=1, type=int, help='number of steps before measuring')
+    parser.add_argument('--threads', default=torch.get_num_threads(), type=int)
+    parser.add_argument('--atol', default=1e-4, type=float)
+    parser.add_argument('--rtol', default=1e-4, type=float)
+    parser.add_argument('--output', default=None, type=str, help='path of json report (default: None)')
+    main(parser.parse_args())
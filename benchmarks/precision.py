@@ -0,0 +1,80 @@
+"""
+Throughput and peak memory of a distillation step for each precision mode.
+
+Every mode runs in a fresh process so that the peak RSS of one mode does not leak into the next one:
+
+    python -m benchmarks.precision --arch resnet56 --batch_size 64 --steps 20
+"""
+import argparse
+import json
+import time
+import torch
+import models.cifar_models as module_arch
+from models.students import DepthwiseStudent
+from losses import KLDivergenceLoss
+from utils import MixedPrecision
+from benchmarks.common import peak_rss_mb, run_in_process
+
+MODES = [
+    {'dtype': 'fp32', 'channels_last': False},
+    {'dtype': 'fp32', 'channels_last': True},
+    {'dtype': 'bf16', 'channels_last': False},
+    {'dtype': 'bf16', 'channels_last': True},
+]
+
+
+def run_mode(mode, args):
+    torch.manual_seed(0)
+    torch.set_num_threads(args.threads)
+    precision = MixedPrecision(device_type='cpu', **mode)
+    model = DepthwiseStudent(getattr(module_arch, args.arch)(), {'teacher': {}})
+    model.unfreeze_student()
+    model.train()
+    precision.apply_memory_format(model)
+    criterion = KLDivergenceLoss(temperature=4)
+    optimizer = torch.optim.SGD(filter(lambda p: p.requires_grad, model.student.parameters()), lr=0.01)
+    data = torch.randn(args.batch_size, 3, args.resolution, args.resolution)
+
+    step_times = []
+    for step in range(args.warmup + args.steps):
+        start = time.perf_counter()
+        inputs = precision.to_device(data, torch.device('cpu'))
+        with precision.autocast():
+            output_st, output_tc = model(inputs)
+        loss = criterion(output_st, output_tc)
+        loss.backward()
+        optimizer.step()
+        optimizer.zero_grad()
+        if step >= args.warmup:
+            step_times.append(time.perf_counter() - start)
+
+    return {
+        'mode': str(precision),
+        'images_per_sec': args.batch_size * len(step_times) / sum(step_times),
+        'step_time_ms': 1000 * sum(step_times) / len(step_times),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def main(args):
+    results = [run_in_process(run_mode, mode, args) for mode in MODES]
+
+    print('{:25s} {:>12s} {:>14s} {:>14s}'.format('mode', 'images/sec', 'step time(ms)', 'peak RSS(MB)'))
+    for result in results:
+        print('{:25s} {:12.1f} {:14.1f} {:14.1f}'.format(result['mode'], result['images_per_sec'],
+                                                         result['step_time_ms'], result['peak_rss_mb']))
+    if args.output is not None:
+        with open(args.output, 'w') as handle:
+            json.dump(results, handle, indent=4)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark precision modes of distillation on CPU')
+    parser.add_argument('--arch', default='resnet56', type=str, help='teacher architecture in models.cifar_models')
+    parser.add_argument('--batch_size', default=64, type=int)
+    parser.add_argument('--resolution', default=32, type=int)
+    parser.add_argument('--steps', default=20, type=int, help='number of measured steps')
+    parser.add_argument('--warmup', default=3, type=int, help='number of steps before measuring')
+    parser.add_argument('--threads', default=torch.get_num_threads(), type=int)
+    parser.add_argument('--output', default=None, type=str, help='path of json report (default: None)')
+    main(parser.parse_args())
@@ -0,0 +1,155 @@
+"""
+Load generator of the micro-batching inference server: throughput and latency percentiles of a random-weight
+DeepWV3Plus student (or a TorchScript student) served on CPU, for several batching settings.
+
+Every setting runs in a fresh process that starts the server on a free local port and sends requests over TCP,
+either from --concurrency clients waiting for their responses (closed loop) or at --rate requests/sec with Poisson
+arrivals (open loop):
+
+    python -m benchmarks.serving --resolution 256 512 --max_batch_sizes 1 4 8 --concurrency 8 --requests 64
+    python -m benchmarks.serving --port 8765 --rate 20 --requests 200
+
+With --port, the requests go to a running serve.py instead.
+"""
+import argparse
+import asyncio
+import json
+import time
+import numpy as np
+import torch
+from models import DeepWV3Plus
+from utils.serving import SegmentationPredictor, MicroBatcher, InferenceServer, InferenceClient, latency_summary
+from benchmarks.common import peak_rss_mb, run_in_process
+
+NUM_CLASSES = 19
+
+
+async def _send(clients, image, latencies, arrival=None):
+    client = await clients.get()
+    try:
+        # in the open loop, the time spent waiting for a free connection counts as latency
+        start = arrival if arrival is not None else time.perf_counter()
+        await client.predict(image)
+        latencies.append(1000 * (time.perf_counter() - start))
+    finally:
+        clients.put_nowait(client)
+
+
+async def generate_load(host, port, images, args, on_warm=None):
+    """
+    :param on_warm: callable - called after the warmup requests, e.g. to reset the statistics of the server
+    :return: (list of float, float) - latency of each request in milliseconds and wall time of the run in seconds
+    """
+    clients = asyncio.Queue()
+    for _ in range(args.concurrency):
+        clients.put_nowait(await InferenceClient(host, port).connect())
+    # warmup requests are not measured
+    await asyncio.gather(*[_send(clients, images[i % len(images)], []) for i in range(args.warmup)])
+    if on_warm is not None:
+        on_warm()
+
+    latencies = []
+    rng = np.random.RandomState(0)
+    start = time.perf_counter()
+    if args.rate is None:
+        # closed loop, every client sends its next request when it gets a response
+        await asyncio.gather(*[_send(clients, images[i % len(images)], latencies) for i in range(args.requests)])
+    else:
+        tasks = []
+        for i in range(args.requests):
+            tasks.append(asyncio.ensure_future(_send(clients, images[i % len(images)], latencies,
+                                                     time.perf_counter())))
+            await asyncio.sleep(rng.exponential(1 / args.rate))
+        await asyncio.gather(*tasks)
+    duration = time.perf_counter() - start
+
+    while not clients.empty():
+        await clients.get_nowait().close()
+    return latencies, duration
+
+
+def _images(args):
+    rng = np.random.RandomState(0)
+    height, width = args.resolution
+    return [rng.randint(0, 256, (height, width, 3), dtype=np.uint8) for _ in range(8)]
+
+
+def _report(name, latencies, duration):
+    return {
+        'setting': name,
+        'requests': len(latencies),
+        'requests_per_sec': len(latencies) / duration,
+        'latency_ms': latency_summary(latencies),
+    }
+
+
+async def _run_local(setting, args):
+    torch.manual_seed(0)
+    if args.torchscript is not None:
+        model = torch.jit.load(args.torchscript, map_location=torch.device('cpu'))
+    else:
+        model = DeepWV3Plus(NUM_CLASSES)
+    tta = {'scales': args.tta_scales, 'crop_size': args.tta_crop_size} if args.tta_scales is not None else None
+    batcher = MicroBatcher(SegmentationPredictor(model, tta), setting['max_batch_size'], args.max_delay_ms,
+                           args.workers, args.threads)
+    server = InferenceServer(batcher, port=0)
+    await server.start()
+    try:
+        latencies, duration = await generate_load(server.host, server.port, _images(args), args,
+                                                  batcher.reset_stats)
+    finally:
+        await server.stop()
+    result = _report(setting['name'], latencies, duration)
+    result['mean_batch_size'] = batcher.stats()['mean_batch_size']
+    result['server_latency_ms'] = batcher.stats()['latency_ms']
+    result['peak_rss_mb'] = peak_rss_mb()
+    return result
+
+
+def run_setting(setting, args):
+    return asyncio.run(_run_local(setting, args))
+
+
+def main(args):
+    if args.port is not None:
+        latencies, duration = asyncio.run(generate_load(args.host, args.port, _images(args), args))
+        results = [_report('{}:{}'.format(args.host, args.port), latencies, duration)]
+    else:
+        results = [run_in_process(run_setting, {'name': 'max_batch_size={}'.format(max_batch_size),
+                                                'max_batch_size': max_batch_size}, args)
+                   for max_batch_size in args.max_batch_sizes]
+
+    print('{:24s} {:>12s} {:>10s} {:>10s} {:>10s} {:>12s}'.format('setting', 'requests/sec', 'p50(ms)', 'p90(ms)',
+                                                                  'p99(ms)', 'mean batch'))
+    for result in results:
+        latency = result['latency_ms']
+        print('{:24s} {:12.2f} {:10.1f} {:10.1f} {:10.1f} {:>12s}'.format(
+            result['setting'], result['requests_per_sec'], latency['p50'], latency['p90'], latency['p99'],
+            '{:.2f}'.format(result['mean_batch_size']) if 'mean_batch_size' in result else '-'))
+    if args.output is not None:
+        with open(args.output, 'w') as handle:
+            json.dump(results, handle, indent=4)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the micro-batching inference server on CPU')
+    parser.add_argument('--resolution', default=[256, 512], nargs=2, type=int, help='height and width of images')
+    parser.add_argument('--requests', default=64, type=int, help='number of measured requests')
+    parser.add_argument('--warmup', default=4, type=int, help='number of requests before measuring')
+    parser.add_argument('--concurrency', default=8, type=int, help='number of client connections')
+    parser.add_argument('--rate', default=None, type=float,
+                        help='open loop with Poisson arrivals at this rate in requests/sec (default: closed loop)')
+    parser.add_argument('--max_batch_sizes', default=[1, 4, 8], nargs='+', type=int,
+                        help='max batch size of each benchmarked server')
+    parser.add_argument('--max_delay_ms', default=10., type=float)
+    parser.add_argument('--workers', default=1, type=int)
+    parser.add_argument('--threads', default=None, type=int, help='intra-op threads of each worker')
+    parser.add_argument('--torchscript', default=None, type=str,
+                        help='serve this student instead of a random-weight DeepWV3Plus')
+    parser.add_argument('--tta_scales', default=None, nargs='+', type=float)
+    parser.add_argument('--tta_crop_size', default=512, type=int)
+    parser.add_argument('--host', default='127.0.0.1', type=str)
+    parser.add_argument('--port', default=None, type=int,
+                        help='load a running server instead of starting one per setting')
+    parser.add_argument('--output', default=None, type=str, help='path of json report (default: None)')
+    main(parser.parse_args())
@@ -0,0 +1,249 @@
+"""
+End-to-end throughput benchmarks of the training code paths on CPU with synthetic data.
+
+Every workload runs in a fresh process so that the peak RSS of one workload does not leak into the next one:
+
+    python -m benchmarks.suite --output results.json
+    python -m benchmarks.suite --workloads student_step losses --steps 50
+
+Fake Cityscapes data is generated in a temporary directory unless --data_dir points to a Cityscapes-layout root.
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import tempfile
+import types
+from pathlib import Path
+import torch
+from benchmarks.common import time_steps, summarize, run_in_process
+from benchmarks.fake_data import make_fake_cityscapes, FakeCIFAR10
+
+NUM_CLASSES = 19
+
+
+def _transforms_config(args):
+    return {
+        'transforms': {
+            'joint_transforms': {'crop_size': args.crop_size, 'scale_min': 0.5, 'scale_max': 2, 'ignore_label': 255},
+            'extended_transforms': {'color_aug': 0.2, 'blur': 'gaussian'}
+        }
+    }
+
+
+def _loader_rows(workload, loader, batch_size, args):
+    from utils import inf_loop
+    batches = inf_loop(loader)
+    step_times = time_steps(lambda: next(batches), args.steps, args.warmup)
+    return [summarize(workload, type(loader.dataset).__name__, step_times, batch_size)]
+
+
+def cityscapes_loading(args):
+    from data_loader import _create_transform, CityscapesDataloader
+    joint_transform, input_transform, target_transform, _ = _create_transform(_transforms_config(args))
+    loader = CityscapesDataloader(args.data_dir, args.seg_batch_size, shuffle=True, num_workers=args.num_workers,
+                                  split='train', transform=input_transform, transforms=joint_transform,
+                                  target_transform=target_transform)
+    return _loader_rows('cityscapes_loading', loader, args.seg_batch_size, args)
+
+
+def cityscapes_uniform_loading(args):
+    from data_loader import _create_transform, CityscapesUniformDataloader
+    # CityScapesUniform caches the class centroids as json in the working directory
+    os.chdir(args.work_dir)
+    joint_transform, input_transform, target_transform, _ = _create_transform(_transforms_config(args))
+    loader = CityscapesUniformDataloader(args.data_dir, args.seg_batch_size, shuffle=True,
+                                         num_workers=args.num_workers, split='train', transform=input_transform,
+                                         transforms=joint_transform, target_transform=target_transform,
+                                         class_uniform_tile=args.uniform_tile)
+    return _loader_rows('cityscapes_uniform_loading', loader, args.seg_batch_size, args)
+
+
+def cifar_loading(args):
+    from base import BaseDataLoader
+    from data_loader.data_loaders import cifar_transform, CIFAR10_MEAN_STD
+    dataset = FakeCIFAR10(num_samples=args.cifar_samples, transform=cifar_transform(True, CIFAR10_MEAN_STD))
+    loader = BaseDataLoader(dataset, args.batch_size, True, 0.0, args.num_workers)
+    return _loader_rows('cifar_loading', loader, args.batch_size, args)
+
+
+def _build_student(args):
+    import models.cifar_models as module_arch
+    from models.students import DepthwiseStudent
+    model = DepthwiseStudent(getattr(module_arch, args.arch)(), {'teacher': {}})
+    model.replace([{'name': name} for name in args.student_blocks], kernel_size=9, padding=20, dilation=5)
+    model.register_hint_layers(args.student_blocks)
+    model.unfreeze(args.student_blocks)
+    model.train()
+    return model
+
+
+def student_step(args):
+    from losses import MSELoss
+    model = _build_student(args)
+    criterion = MSELoss(num_classes=10)
+    optimizer = torch.optim.SGD(filter(lambda p: p.requires_grad, model.student.parameters()), lr=0.01, momentum=0.9)
+    data = torch.randn(args.batch_size, 3, 32, 32)
+
+    def step():
+        model(data)
+        loss = sum(criterion(st, tc) for st, tc in zip(model.student_hidden_outputs, model.teacher_hidden_outputs))
+        loss.backward()
+        optimizer.step()
+        optimizer.zero_grad()
+
+    step_times = time_steps(step, args.steps, args.warmup)
+    return [summarize('student_step', args.arch, step_times, args.batch_size)]
+
+
+def metrics(args):
+    from utils import CityscapesMetricTracker
+    from models.metric import iou
+    outputs = torch.randn(args.seg_batch_size, NUM_CLASSES, args.crop_size, args.crop_size)
+    labels = torch.randint(0, NUM_CLASSES, (args.seg_batch_size, args.crop_size, args.crop_size))
+    labels[:, :8] = 255
+    tracker = CityscapesMetricTracker()
+    # both metrics overwrite the ignored labels in place
+    rows = [summarize('metrics', 'CityscapesMetricTracker',
+                      time_steps(lambda: tracker.update(outputs, labels.clone()), args.steps, args.warmup),
+                      args.seg_batch_size),
+            summarize('metrics', 'iou',
+                      time_steps(lambda: iou(outputs, labels.clone()), args.steps, args.warmup),
+                      args.seg_batch_size)]
+    return rows
+
+
+def losses(args):
+    import losses as module_loss
+    size = (args.seg_batch_size, NUM_CLASSES, args.crop_size, args.crop_size)
+    output_st = torch.randn(size, requires_grad=True)
+    output_tc = torch.randn(size)
+    target = torch.randint(0, NUM_CLASSES, (args.seg_batch_size, args.crop_size, args.crop_size))
+    hint_size = (args.seg_batch_size, 512, args.crop_size // 8, args.crop_size // 8)
+    hint_st = torch.randn(hint_size, requires_grad=True)
+    hint_tc = torch.randn(hint_size)
+
+    kl, js = module_loss.KLDivergenceLoss(temperature=4), module_loss.JSDivergenceLoss(temperature=4)
+    chunked_kl = module_loss.ChunkedKLDivergenceLoss(temperature=4)
+    chunked_js = module_loss.ChunkedJSDivergenceLoss(temperature=4)
+    ce, mse, topk = module_loss.CrossEntropyLoss2d(), module_loss.MSELoss(), module_loss.TopkHintMSELoss()
+    distillation = module_loss.DistillationLoss(temperature=4)
+    criterions = {
+        'CrossEntropyLoss2d': lambda: ce(output_st, target),
+        'KLDivergenceLoss': lambda: kl(output_st, output_tc),
+        'JSDivergenceLoss': lambda: js(output_st, output_tc),
+        'ChunkedKLDivergenceLoss': lambda: chunked_kl(output_st, output_tc),
+        'ChunkedJSDivergenceLoss': lambda: chunked_js(output_st, output_tc),
+        'MSELoss': lambda: mse(hint_st, hint_tc),
+        'TopkHintMSELoss': lambda: topk(hint_st, hint_tc),
+        'DistillationLoss': lambda: distillation(output_st, output_tc, target, [hint_st], [hint_tc])[0],
+    }
+    rows = []
+    for name, criterion in criterions.items():
+        def step():
+            criterion().backward()
+            output_st.grad, hint_st.grad = None, None
+        rows.append(summarize('losses', name, time_steps(step, args.steps, args.warmup), args.seg_batch_size))
+    return rows
+
+
+def checkpointing(args):
+    from base import BaseTrainer
+    from models import forgiving_state_restore
+    model = _build_student(args)
+    optimizer = torch.optim.SGD(filter(lambda p: p.requires_grad, model.student.parameters()), lr=0.01, momentum=0.9)
+    model(torch.randn(2, 3, 32, 32))
+    sum(st.sum() for st in model.student_hidden_outputs).backward()
+    optimizer.step()
+
+    # the attributes read by BaseTrainer._save_checkpoint
+    logger = logging.getLogger('benchmark')
+    logger.setLevel(logging.WARNING)
+    trainer = types.SimpleNamespace(model=model, optimizer=optimizer, mnt_best=0, config={'name': 'benchmark'},
+                                    checkpoint_dir=Path(args.work_dir), logger=logger)
+    path = os.path.join(args.work_dir, 'checkpoint-epoch1.pth')
+
+    def load():
+        checkpoint = torch.load(path, map_location=torch.device('cpu'))
+        forgiving_state_restore(model, checkpoint['state_dict'])
+        optimizer.load_state_dict(checkpoint['optimizer'])
+
+    return [summarize('checkpointing', 'save',
+                      time_steps(lambda: BaseTrainer._save_checkpoint(trainer, 1), args.steps, args.warmup), 1),
+            summarize('checkpointing', 'load', time_steps(load, args.steps, args.warmup), 1)]
+
+
+WORKLOADS = {
+    'cityscapes_loading': cityscapes_loading,
+    'cityscapes_uniform_loading': cityscapes_uniform_loading,
+    'cifar_loading': cifar_loading,
+    'student_step': student_step,
+    'metrics': metrics,
+    'losses': losses,
+    'checkpointing': checkpointing,
+}
+
+
+def run_workload(name, args):
+    torch.manual_seed(0)
+    torch.set_num_threads(args.threads)
+    return WORKLOADS[name](args)
+
+
+def main(args):
+    generated = args.data_dir is None
+    args.work_dir = tempfile.mkdtemp(prefix='benchmark_')
+    if generated:
+        args.data_dir = make_fake_cityscapes(os.path.join(args.work_dir, 'cityscapes'), args.num_images,
+                                             args.image_height, args.image_width)
+
+    results = []
+    try:
+        for name in args.workloads:
+            results.extend(run_in_process(run_workload, name, args))
+    finally:
+        shutil.rmtree(args.work_dir, ignore_errors=True)
+
+    print('{:28s} {:25s} {:>12s} {:>10s} {:>10s} {:>10s} {:>13s}'.format(
+        'workload', 'name', 'samples/sec', 'p50(ms)', 'p90(ms)', 'p99(ms)', 'peak RSS(MB)'))
+    for result in results:
+        print('{:28s} {:25s} {:12.1f} {:10.2f} {:10.2f} {:10.2f} {:13.1f}'.format(
+            result['workload'], result['name'], result['samples_per_sec'], result['step_time_ms']['p50'],
+            result['step_time_ms']['p90'], result['step_time_ms']['p99'], result['peak_rss_mb']))
+
+    if args.output is not None:
+        report = {
+            'torch_version': torch.__version__,
+            'threads': args.threads,
+            'fake_data': generated,
+            'args': {k: v for k, v in vars(args).items() if k not in ('work_dir', 'data_dir', 'output')},
+            'results': results,
+        }
+        with open(args.output, 'w') as handle:
+            json.dump(report, handle, indent=4)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark data loading, training step, metrics, losses and '
+                                                 'checkpointing on CPU')
+    parser.add_argument('--workloads', default=list(WORKLOADS), nargs='+', choices=list(WORKLOADS))
+    parser.add_argument('--steps', default=20, type=int, help='number of measured steps')
+    parser.add_argument('--warmup', default=3, type=int, help='number of steps before measuring')
+    parser.add_argument('--threads', default=torch.get_num_threads(), type=int)
+    parser.add_argument('--num_workers', default=0, type=int, help='workers of data loaders')
+    parser.add_argument('--data_dir', default=None, type=str,
+                        help='root of Cityscapes-layout data (default: generate fake data)')
+    parser.add_argument('--num_images', default=8, type=int, help='number of fake images per split')
+    parser.add_argument('--image_height', default=256, type=int)
+    parser.add_argument('--image_width', default=512, type=int)
+    parser.add_argument('--crop_size', default=128, type=int, help='training crop of segmentation workloads')
+    parser.add_argument('--uniform_tile', default=128, type=int, help='tile size of class uniform sampling')
+    parser.add_argument('--seg_batch_size', default=2, type=int, help='batch size of segmentation workloads')
+    parser.add_argument('--batch_size', default=64, type=int, help='batch size of CIFAR workloads')
+    parser.add_argument('--cifar_samples', default=1024, type=int)
+    parser.add_argument('--arch', default='resnet56', type=str, help='teacher architecture in models.cifar_models')
+    parser.add_argument('--student_blocks', default=['layer3.0.conv2', 'layer3.1.conv2'], nargs='+',
+                        help='blocks replaced by depthwise separable convolutions')
+    parser.add_argument('--output', default=None, type=str, help='path of json report (default: None)')
+    main(parser.parse_args())
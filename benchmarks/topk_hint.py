@@ -0,0 +1,81 @@
+"""
+Time of TopkHintMSELoss against the previous argsort + per-sample loop implementation for the channel counts of the
+mod4/mod7 hints:
+
+    python -m benchmarks.topk_hint --batch_size 8 --height 64 --width 128
+"""
+import argparse
+import json
+import time
+import torch
+from losses import TopkHintMSELoss
+
+CHANNELS = [512, 1024, 2048, 4096]
+
+
+def loop_topk_hint(inputs, targets, topk):
+    """
+    reference implementation with a full argsort and a mask filled on cpu sample by sample
+    """
+    norm = targets.norm(p=2, dim=(-1, -2))
+    idx_ascending = norm.argsort(dim=-1, descending=True)
+    num_channels = idx_ascending.size(-1)
+    idx_keep = idx_ascending[:, :int(topk * num_channels)]
+    mask = torch.zeros(targets.size(0), num_channels)
+    for x, y in zip(mask, idx_keep):
+        x[y] = 1.0
+    spatial_reduced = ((inputs - targets) ** 2).mean(dim=(-1, -2))
+    return (spatial_reduced * mask.to(inputs.device)).sum() / mask.sum()
+
+
+def time_ms(fn, steps, warmup, device):
+    for _ in range(warmup):
+        fn()
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(steps):
+        fn()
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    return 1000 * (time.perf_counter() - start) / steps
+
+
+def main(args):
+    torch.manual_seed(0)
+    device = torch.device(args.device)
+    criterion = TopkHintMSELoss(topk=args.topk)
+    results = []
+    for channels in CHANNELS:
+        inputs = torch.randn(args.batch_size, channels, args.height, args.width, device=device)
+        targets = torch.randn(args.batch_size, channels, args.height, args.width, device=device)
+        with torch.no_grad():
+            expected = loop_topk_hint(inputs, targets, args.topk)
+            actual = criterion(inputs, targets)
+            results.append({
+                'channels': channels,
+                'loop_ms': time_ms(lambda: loop_topk_hint(inputs, targets, args.topk), args.steps, args.warmup, device),
+                'vectorized_ms': time_ms(lambda: criterion(inputs, targets), args.steps, args.warmup, device),
+                'abs_diff': (expected - actual).abs().item(),
+            })
+
+    print('{:>10s} {:>10s} {:>15s} {:>10s}'.format('channels', 'loop(ms)', 'vectorized(ms)', 'abs diff'))
+    for result in results:
+        print('{:10d} {:10.2f} {:15.2f} {:10.2e}'.format(result['channels'], result['loop_ms'],
+                                                          result['vectorized_ms'], result['abs_diff']))
+    if args.output is not None:
+        with open(args.output, 'w') as handle:
+            json.dump(results, handle, indent=4)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark TopkHintMSELoss over hint channel counts')
+    parser.add_argument('--batch_size', default=8, type=int)
+    parser.add_argument('--height', default=64, type=int)
+    parser.add_argument('--width', default=128, type=int)
+    parser.add_argument('--topk', default=0.5, type=float)
+    parser.add_argument('--steps', default=20, type=int, help='number of measured calls')
+    parser.add_argument('--warmup', default=3, type=int, help='number of calls before measuring')
+    parser.add_argument('--device', default='cpu', type=str)
+    parser.add_argument('--output', default=None, type=str, help='path of json report (default: None)')
+    main(parser.parse_args())
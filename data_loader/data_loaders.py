@@ -5,27 +5,30 @@ from .cityscapes import Cityscapes, CityScapesUniform
 from torch.utils.data import ConcatDataset
 
 
+CIFAR100_MEAN_STD = ((0.4914, 0.4822, 0.4465), (0.2023, 0.1994, 0.2010))
+CIFAR10_MEAN_STD = ([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
+
+
+def cifar_transform(training, mean_std):
+    """
+    :param training: bool - add random crop and flip augmentation
+    :param mean_std: tuple of (mean, std) used for normalization
+    """
+    trsfm = [tfs.RandomCrop(32, padding=4), tfs.RandomHorizontalFlip()] if training else []
+    return tfs.Compose(trsfm + [tfs.ToTensor(), tfs.Normalize(*mean_std)])
+
+
 class Cifar100Dataloader(BaseDataLoader):
     """
     CIFAR100 data loading using BaseDataloder
     """
 
-    def __init__(self, data_dir, batch_size, shuffle=True, validation_split=0.0, num_workers=1, training=True):
-        if training:
-            trsfm = tfs.Compose([
-                tfs.RandomCrop(32, padding=4),
-                tfs.RandomHorizontalFlip(),
-                tfs.ToTensor(),
-                tfs.Normalize((0.4914, 0.4822, 0.4465),(0.2023, 0.1994, 0.2010))
-            ])
-        else:
-            trsfm = tfs.Compose([
-                tfs.ToTensor(),
-                tfs.Normalize((0.4914, 0.4822, 0.4465), (0.2023, 0.1994, 0.2010))
-            ])
+    def __init__(self, data_dir, batch_size, shuffle=True, validation_split=0.0, num_workers=1, training=True,
+                 **kwargs):
+        trsfm = cifar_transform(training, CIFAR100_MEAN_STD)
         self.data_dir = data_dir
         self.dataset = datasets.CIFAR100(self.data_dir, train=training, download=True, transform=trsfm)
-        super().__init__(self.dataset, batch_size, shuffle, validation_split, num_workers)
+        super().__init__(self.dataset, batch_size, shuffle, validation_split, num_workers, **kwargs)
 
 
 class Cifar10Dataloader(BaseDataLoader):
@@ -33,24 +36,12 @@ class Cifar10Dataloader(BaseDataLoader):
     CIFAR10 data loading using BaseDataloder
     """
 
-    def __init__(self, data_dir, batch_size, shuffle=True, validation_split=0.0, num_workers=1, training=True):
-        if training:
-            trsfm = tfs.Compose([
-                tfs.RandomCrop(32, padding=4),
-                tfs.RandomHorizontalFlip(),
-                tfs.ToTensor(),
-                tfs.Normalize(mean=[0.485, 0.456, 0.406],
-                              std=[0.229, 0.224, 0.225])
-            ])
-        else:
-            trsfm = tfs.Compose([
-                tfs.ToTensor(),
-                tfs.Normalize(mean=[0.485, 0.456, 0.406],
-                              std=[0.229, 0.224, 0.225])
-            ])
+    def __init__(self, data_dir, batch_size, shuffle=True, validation_split=0.0, num_workers=1, training=True,
+                 **kwargs):
+        trsfm = cifar_transform(training, CIFAR10_MEAN_STD)
         self.data_dir = data_dir
         self.dataset = datasets.CIFAR10(self.data_dir, train=training, download=True, transform=trsfm)
-        super().__init__(self.dataset, batch_size, shuffle, validation_split, num_workers)
+        super().__init__(self.dataset, batch_size, shuffle, validation_split, num_workers, **kwargs)
 
 
 class CityscapesDataloader(BaseDataLoader):
@@ -60,7 +51,7 @@ class CityscapesDataloader(BaseDataLoader):
 
     def __init__(self, data_dir, batch_size, shuffle=True, validation_split=0.0, num_workers=0, split='train',
                  transform=None, target_transform=None, transforms=None, mode='fine', target_type='semantic',
-                 num_samples=None, return_image_name=False):
+                 num_samples=None, return_image_name=False, **kwargs):
         self.data_dir = data_dir
         if split == 'train_val':
             train_dataset = self.dataset = Cityscapes(root=self.data_dir, transform=transform, transforms=transforms,
@@ -78,12 +69,13 @@ class CityscapesDataloader(BaseDataLoader):
                                       target_type=target_type, num_samples=num_samples,
                                       return_image_name=return_image_name)
 
-        super().__init__(self.dataset, batch_size, shuffle, validation_split, num_workers)
+        super().__init__(self.dataset, batch_size, shuffle, validation_split, num_workers, **kwargs)
 
 class CityscapesUniformDataloader(BaseDataLoader):
     def __init__(self, data_dir, batch_size, shuffle=True, validation_split=0.0, num_workers=0, split='train',
                  transform=None, target_transform=None, transforms=None, mode='fine', target_type='semantic',
-                 class_uniform_pct=0.5, class_uniform_tile = 1024, num_samples=None, return_image_name=False):
+                 class_uniform_pct=0.5, class_uniform_tile = 1024, num_samples=None, return_image_name=False,
+                 **kwargs):
         self.data_dir = data_dir
         if split == 'train_val':
             raise ValueError("Only support train split for Uniform Cityscapes")
@@ -94,5 +86,5 @@ class CityscapesUniformDataloader(BaseDataLoader):
                                              class_uniform_tile=class_uniform_tile, num_samples=num_samples,
                                              return_image_name=return_image_name)
 
-        super().__init__(self.dataset, batch_size, shuffle, validation_split, num_workers)
+        super().__init__(self.dataset, batch_size, shuffle, validation_split, num_workers, **kwargs)
 
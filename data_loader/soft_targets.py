@@ -0,0 +1,107 @@
+import os
+import random
+import numpy as np
+import torch
+from contextlib import contextmanager
+from torch.utils import data
+
+# seeds of different samples would never overlap as long as a dataset has less samples than this
+_SEED_STRIDE = 1000003
+
+
+@contextmanager
+def _fixed_rng(seed):
+    """
+    Seed python, numpy and torch generators for the scope of the context and restore their previous states afterwards
+    so that the augmentation of a sample is reproducible without touching the global randomness
+    """
+    py_state = random.getstate()
+    np_state = np.random.get_state()
+    with torch.random.fork_rng(devices=[]):
+        random.seed(seed)
+        np.random.seed(seed % (2 ** 32))
+        torch.manual_seed(seed)
+        try:
+            yield
+        finally:
+            random.setstate(py_state)
+            np.random.set_state(np_state)
+
+
+class SeededAugmentation(data.Dataset):
+    """
+    Wrap a dataset so that its random augmentation only depends on (sample index, augmentation seed). The same
+    augmented input can then be reproduced offline for computing soft targets and online for training
+    :param dataset: torch.utils.data.Dataset - dataset returning (image, target) with random transforms
+    :param num_seeds: int - number of augmentations per sample, epoch e uses seed (e-1) % num_seeds
+    :param soft_targets: SoftTargetStore - if set, the stored soft target of (sample, seed) is returned as well
+    """
+
+    def __init__(self, dataset, num_seeds, soft_targets=None):
+        self.dataset = dataset
+        self.num_seeds = num_seeds
+        self.soft_targets = soft_targets
+        self.seed = 0
+
+    def set_epoch(self, epoch):
+        self.seed = (epoch - 1) % self.num_seeds
+
+    def __getitem__(self, index):
+        with _fixed_rng(self.seed * _SEED_STRIDE + index):
+            image, target = self.dataset[index]
+        if self.soft_targets is None:
+            return image, target
+        return image, target, self.soft_targets.read(self.seed, index)
+
+    def __len__(self):
+        return len(self.dataset)
+
+
+class SoftTargetStore:
+    """
+    Averaged soft targets of teacher and ensemble members stored as a fp16 memory-mapped .npy file of shape
+    (num_seeds x num_samples x C...). Only the rows that are read are paged in.
+    :param path: str - path of .npy file
+    :param num_seeds: int - number of augmentations per sample
+    :param num_samples: int - number of samples in dataset
+    """
+
+    def __init__(self, path, num_seeds, num_samples):
+        self.path = path
+        self.num_seeds = num_seeds
+        self.num_samples = num_samples
+        self._array = None
+
+    def exists(self):
+        """
+        :return: True if the file was completely written with the same number of seeds and samples
+        """
+        if not os.path.isfile(self.path) or os.path.isfile(self.path + '.partial'):
+            return False
+        array = np.load(self.path, mmap_mode='r')
+        return array.shape[:2] == (self.num_seeds, self.num_samples)
+
+    def create(self, target_shape):
+        # mark the file as incomplete until all the targets are written
+        open(self.path + '.partial', 'w').close()
+        self._array = np.lib.format.open_memmap(self.path, mode='w+', dtype=np.float16,
+                                                shape=(self.num_seeds, self.num_samples, *target_shape))
+
+    def write(self, seed, indices, soft_targets):
+        self._array[seed, indices] = soft_targets.detach().cpu().numpy().astype(np.float16)
+
+    def close(self):
+        self._array.flush()
+        self._array = None
+        os.remove(self.path + '.partial')
+
+    def read(self, seed, index):
+        if self._array is None:
+            # opened lazily so that every data loader worker has its own read-only map
+            self._array = np.load(self.path, mmap_mode='r')
+        return torch.from_numpy(self._array[seed, index].astype(np.float32))
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_array'] = None
+        return state
@@ -0,0 +1,99 @@
+import argparse
+import collections
+import json
+import torch
+import models as module_arch
+import models.cifar_models as module_cifar_arch
+from parse_config import ConfigParser
+from utils.export import EXPORT_FORMATS, rebuild_student, ExportWrapper, export_torchscript, export_onnx, \
+    onnx_session, validate_exports, export_table
+
+
+def main(config, args):
+    logger = config.get_logger('export')
+    torch.manual_seed(args.seed)
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    unknown_formats = set(args.formats) - set(EXPORT_FORMATS)
+    if unknown_formats:
+        raise ValueError('Unknown export formats: {}. Expect some of {}'.format(sorted(unknown_formats),
+                                                                              EXPORT_FORMATS))
+
+    # the teacher's weights are part of the checkpoint, the snapshot doesn't have to be loaded
+    module = module_arch if hasattr(module_arch, config['teacher']['type']) else module_cifar_arch
+    teacher = config.init_obj('teacher', module)
+    checkpoint = torch.load(args.checkpoint, map_location=torch.device('cpu'))
+    student = rebuild_student(checkpoint, teacher.cpu())
+    logger.info('Rebuilt {} student of epoch {} with {} replaced blocks'.format(
+        type(student).__name__, checkpoint['epoch'],
+        len([block for block in checkpoint['config']['pruning']['pruning_plan']
+             if block['epoch'] <= checkpoint['epoch']])))
+
+    wrapper = ExportWrapper(student).eval()
+    if args.resolution is not None:
+        height, width = args.resolution
+    else:
+        height = width = config['transforms']['joint_transforms']['crop_size'] if 'transforms' in config.config \
+            else 32
+    inputs = wrapper.example_inputs(args.batch_size, height, width)
+
+    output_dir = args.output_dir if args.output_dir is not None else str(config.save_dir)
+    runtimes = {}
+    if 'torchscript' in args.formats:
+        path = '{}/student.pt'.format(output_dir)
+        runtimes['torchscript'] = export_torchscript(wrapper, inputs, path, args.script)
+        logger.info('Saved TorchScript student to {}'.format(path))
+    if 'onnx' in args.formats:
+        path = '{}/student.onnx'.format(output_dir)
+        export_onnx(wrapper, inputs, path, args.opset)
+        logger.info('Saved ONNX student to {}'.format(path))
+        runtimes['onnxruntime'] = onnx_session(path, args.threads)
+
+    # parity is checked on other inputs than the ones used for tracing
+    rows = validate_exports(wrapper, runtimes, wrapper.example_inputs(args.batch_size, height, width),
+                            args.atol, args.rtol, args.warmup, args.repeats)
+    logger.info('Input of shape {} on {} threads\n{}'.format(tuple(inputs[0].shape), torch.get_num_threads(),
+                                                              export_table(rows)))
+    report = args.report if args.report is not None else str(config.log_dir / 'export.json')
+    with open(report, 'w') as handle:
+        json.dump(rows, handle, indent=4)
+    logger.info('Saved report to {}'.format(report))
+
+    failed = [row['runtime'] for row in rows if not row['parity']]
+    if failed:
+        raise ValueError('Outputs of {} differ from the student by more than atol={} rtol={}'.format(
+            failed, args.atol, args.rtol))
+
+
+if __name__ == '__main__':
+    args = argparse.ArgumentParser(description='Export a distilled student to TorchScript and ONNX')
+    args.add_argument('-c', '--config', default=None, type=str,
+                      help='config file path (default: None)')
+    args.add_argument('-r', '--resume', default=None, type=str,
+                      help='path to latest checkpoint (default: None)')
+    args.add_argument('-d', '--device', default=None, type=str,
+                      help='indices of GPUs to enable (default: all)')
+    args.add_argument('--checkpoint', required=True, type=str, help='checkpoint of the student saved by the trainer')
+    args.add_argument('--formats', default=EXPORT_FORMATS, nargs='+', type=str,
+                      help='exported formats, torchscript and/or onnx')
+    args.add_argument('--script', action='store_true', help='script the student instead of tracing it')
+    args.add_argument('--opset', default=17, type=int, help='ONNX opset version')
+    args.add_argument('--resolution', default=None, nargs=2, type=int,
+                      help='height and width of the traced input (default: crop size of training)')
+    args.add_argument('--batch_size', default=1, type=int, help='batch size of the traced input')
+    args.add_argument('--atol', default=1e-3, type=float, help='absolute tolerance of the parity check')
+    args.add_argument('--rtol', default=1e-3, type=float, help='relative tolerance of the parity check')
+    args.add_argument('--warmup', default=3, type=int, help='number of calls before measuring latency')
+    args.add_argument('--repeats', default=10, type=int, help='number of measured calls')
+    args.add_argument('--threads', default=None, type=int, help='number of cpu threads (default: torch default)')
+    args.add_argument('--seed', default=123, type=int)
+    args.add_argument('--output_dir', default=None, type=str,
+                      help='directory of the exported models (default: save dir)')
+    args.add_argument('--report', default=None, type=str,
+                      help='path of json report (default: export.json in log dir)')
+
+    # custom cli options to modify configuration from default values given in json file.
+    CustomArgs = collections.namedtuple('CustomArgs', 'flags type target')
+    options = []
+    config = ConfigParser.from_args(args, options)
+    main(config, args.parse_args())
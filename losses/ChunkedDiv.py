@@ -0,0 +1,143 @@
+import math
+import torch
+import torch.nn as nn
+
+
+def _row_chunks(height, chunk_rows):
+    for start in range(0, height, chunk_rows):
+        yield slice(start, min(start + chunk_rows, height))
+
+
+def _log_probs(inputs, targets, temperature):
+    return torch.log_softmax(inputs.float() / temperature, dim=1), torch.log_softmax(targets.float() / temperature, dim=1)
+
+
+def _pixel_divergence(log_p_s, log_p_t, divergence):
+    """
+    :return: Tensor of shape (BxHxW) - KL(p_t || p_s) or KL(p_t || m) + KL(p_s || m) with m = (p_s + p_t) / 2
+    """
+    p_t = log_p_t.exp()
+    if divergence == 'kl':
+        return (p_t * (log_p_t - log_p_s)).sum(dim=1)
+    log_m = torch.logaddexp(log_p_s, log_p_t) - math.log(2)
+    p_s = log_p_s.exp()
+    return (p_t * (log_p_t - log_m) + p_s * (log_p_s - log_m)).sum(dim=1)
+
+
+def _softmax_backward(p, g):
+    """
+    gradient w.r.t the logits of p = softmax(logits) given the gradient g w.r.t p (up to a per-pixel constant)
+    """
+    return p * (g - (p * g).sum(dim=1, keepdim=True))
+
+
+class _ChunkedDivergence(torch.autograd.Function):
+    """
+    Sum over pixels of a divergence between softmax(inputs / T) and softmax(targets / T). The spatial dimension is
+    processed by chunks of rows in forward, and recomputed in backward instead of saving the softmax intermediates,
+    so the memory of temporaries does not depend on the image size
+    """
+
+    @staticmethod
+    def forward(ctx, inputs, targets, valid, temperature, chunk_rows, divergence):
+        ctx.save_for_backward(inputs, targets, valid)
+        ctx.temperature, ctx.chunk_rows, ctx.divergence = temperature, chunk_rows, divergence
+        total = inputs.new_zeros((), dtype=torch.float32)
+        for rows in _row_chunks(inputs.shape[2], chunk_rows):
+            log_p_s, log_p_t = _log_probs(inputs[:, :, rows], targets[:, :, rows], temperature)
+            pixel = _pixel_divergence(log_p_s, log_p_t, divergence)
+            if valid is not None:
+                pixel = pixel * valid[:, rows]
+            total += pixel.sum()
+        return total
+
+    @staticmethod
+    def backward(ctx, grad_output):
+        inputs, targets, valid = ctx.saved_tensors
+        temperature = ctx.temperature
+        grad_inputs = torch.empty_like(inputs) if ctx.needs_input_grad[0] else None
+        grad_targets = torch.empty_like(targets) if ctx.needs_input_grad[1] else None
+
+        for rows in _row_chunks(inputs.shape[2], ctx.chunk_rows):
+            log_p_s, log_p_t = _log_probs(inputs[:, :, rows], targets[:, :, rows], temperature)
+            p_s, p_t = log_p_s.exp(), log_p_t.exp()
+            scale = grad_output / temperature
+            if valid is not None:
+                scale = scale * valid[:, rows].unsqueeze(1)
+            if ctx.divergence == 'kl':
+                if grad_inputs is not None:
+                    grad_inputs[:, :, rows] = scale * (p_s - p_t)
+                if grad_targets is not None:
+                    grad_targets[:, :, rows] = scale * _softmax_backward(p_t, log_p_t - log_p_s)
+            else:
+                log_m = torch.logaddexp(log_p_s, log_p_t) - math.log(2)
+                if grad_inputs is not None:
+                    grad_inputs[:, :, rows] = scale * _softmax_backward(p_s, log_p_s - log_m)
+                if grad_targets is not None:
+                    grad_targets[:, :, rows] = scale * _softmax_backward(p_t, log_p_t - log_m)
+
+        return grad_inputs, grad_targets, None, None, None, None
+
+
+class _ChunkedDivergenceLoss(nn.Module):
+
+    def __init__(self, temperature=1, ignore_index=255, chunk_size=2 ** 18):
+        """
+        :param temperature: float - temperature of softmax
+        :param ignore_index: int - label of pixels that are excluded from the loss when labels are given
+        :param chunk_size: int - maximum number of pixels (over the whole batch) processed at once
+        """
+        super().__init__()
+        self.temperature = temperature
+        self.ignore_index = ignore_index
+        self.chunk_size = chunk_size
+
+    def _divergence(self, inputs, targets, labels, divergence):
+        """
+        :return: tuple of (sum of pixel divergences, number of valid pixels)
+        """
+        if inputs.dim() == 2:
+            # classification, each sample is a single pixel
+            inputs, targets = inputs[:, :, None, None], targets[:, :, None, None]
+            labels = labels[:, None, None] if labels is not None else None
+        batch_size, _, height, width = inputs.shape
+        if labels is None:
+            valid, num_valid = None, batch_size * height * width
+        else:
+            valid = (labels != self.ignore_index).float()
+            num_valid = valid.sum().clamp(min=1)
+        chunk_rows = max(1, self.chunk_size // (batch_size * width))
+        total = _ChunkedDivergence.apply(inputs, targets, valid, self.temperature, chunk_rows, divergence)
+        return total, num_valid
+
+
+class ChunkedKLDivergenceLoss(_ChunkedDivergenceLoss):
+    """
+    Memory-bounded version of KLDivergenceLoss, it returns the same value without materializing the full
+    BxCxHxW softmax/log-softmax tensors
+    input:
+        inputs - torch.Tensor: the predictions of 1 model. The shape of this tensor should be batchsize x C x H x W
+        targets - torch.Tensor: the target of
+        labels - torch.Tensor (optional): ground truth of shape batchsize x H x W, pixels with ignore_index are
+            excluded and the loss is averaged over the remaining pixels
+    """
+
+    def forward(self, inputs, targets, labels=None):
+        total, num_valid = self._divergence(inputs, targets, labels, 'kl')
+        return total / num_valid * (self.temperature ** 2)
+
+
+class ChunkedJSDivergenceLoss(_ChunkedDivergenceLoss):
+    """
+    Memory-bounded version of JSDivergenceLoss, it returns the same value without materializing the full
+    BxCxHxW softmax/log-softmax tensors
+    input:
+        inputs - torch.Tensor: the predictions of 1 model. The shape of this tensor should be batchsize x C x H x W
+        targets - torch.Tensor: the target of
+        labels - torch.Tensor (optional): ground truth of shape batchsize x H x W, pixels with ignore_index are
+            excluded
+    """
+
+    def forward(self, inputs, targets, labels=None):
+        total, _ = self._divergence(inputs, targets, labels, 'js')
+        return self.temperature * self.temperature * 0.5 * total / inputs.shape[0]
@@ -12,4 +12,4 @@ class CrossEntropyLoss2d(nn.Module):
         self.nll_loss = nn.NLLLoss2d(weight, size_average, ignore_index)
 
     def forward(self, inputs, targets):
-        return self.nll_loss(F.log_softmax(inputs), targets)
\ No newline at end of file
+        return self.nll_loss(F.log_softmax(inputs.float()), targets)
\ No newline at end of file
@@ -0,0 +1,58 @@
+import torch.nn.functional as F
+import torch.nn as nn
+import torch
+
+
+class DistillationLoss(nn.Module):
+    """
+    Weighted sum of the supervised, knowledge distillation and hint losses computed in one pass. It gives the same
+    values as CrossEntropyLoss2d, KLDivergenceLoss and MSELoss but the teacher distribution is computed once as
+    log-probabilities, the log-softmax of the student is shared between cross entropy and KL when temperature is 1
+    and the terms whose weight is 0 are computed without building their graph.
+    :param temperature: float - temperature of softmax in KL divergence
+    :param ignore_index: int - label ignored by cross entropy
+    :param num_classes: int - scale of hint loss, same as MSELoss
+    input:
+        output_st - torch.Tensor: logits of student, batchsize x C (x H x W)
+        output_tc - torch.Tensor: logits of teacher, same shape as output_st
+        target - torch.Tensor: ground truth, batchsize (x H x W)
+        hints_st, hints_tc - list of torch.Tensor: hidden outputs of student and teacher
+        alpha, beta, gamma - float: weights of supervised, kd and hint losses e.g. from WeightScheduler
+    output:
+        tuple of (weighted loss, dictionary of detached supervised_loss, kd_loss and hint_loss)
+    """
+
+    def __init__(self, temperature=1, ignore_index=255, num_classes=19):
+        super(DistillationLoss, self).__init__()
+        self.temperature = temperature
+        self.ignore_index = ignore_index
+        self.num_classes = num_classes
+
+    def forward(self, output_st, output_tc, target, hints_st=(), hints_tc=(), alpha=1, beta=1, gamma=1):
+        output_st, output_tc = output_st.float(), output_tc.float()
+        temperature = self.temperature
+
+        with torch.set_grad_enabled(torch.is_grad_enabled() and (alpha != 0 or (beta != 0 and temperature == 1))):
+            log_p_s = F.log_softmax(output_st, dim=1)
+        with torch.set_grad_enabled(torch.is_grad_enabled() and alpha != 0):
+            supervised_loss = F.nll_loss(log_p_s, target, ignore_index=self.ignore_index)
+
+        with torch.set_grad_enabled(torch.is_grad_enabled() and beta != 0):
+            log_p_s_t = log_p_s if temperature == 1 else F.log_softmax(output_st / temperature, dim=1)
+            log_p_t = F.log_softmax(output_tc / temperature, dim=1)
+            # 'mean' of F.kl_div averages over every element, KLDivergenceLoss multiplies it back by C
+            num_pixels = output_st.numel() / output_st.shape[1]
+            kd_loss = F.kl_div(log_p_s_t, log_p_t, reduction='sum', log_target=True) / num_pixels * temperature ** 2
+
+        with torch.set_grad_enabled(torch.is_grad_enabled() and gamma != 0):
+            hint_loss = output_st.new_zeros(())
+            for hint_st, hint_tc in zip(hints_st, hints_tc):
+                hint_loss = hint_loss + F.mse_loss(hint_st.float(), hint_tc.float()) * self.num_classes
+
+        loss = alpha * supervised_loss + beta * kd_loss + gamma * hint_loss
+        components = {
+            'supervised_loss': supervised_loss.detach(),
+            'kd_loss': kd_loss.detach(),
+            'hint_loss': hint_loss.detach(),
+        }
+        return loss, components
@@ -16,6 +16,7 @@ class EnsembleKLDivergenceLoss(nn.Module):
         super(EnsembleKLDivergenceLoss, self).__init__()
 
     def forward(self, inputs, targets):
+        inputs, targets = inputs.float(), targets.float()
         p_s = F.log_softmax(inputs, dim=1)
         p_t = targets
         loss = F.kl_div(p_s, p_t) *targets.shape[1]
@@ -18,6 +18,7 @@ class JSDivergenceLoss(nn.Module):
         self.temperature = temperature
 
     def forward(self, inputs, targets):
+        inputs, targets = inputs.float(), targets.float()
         q = 0.5 * (F.softmax(targets / self.temperature, dim=1) + F.softmax(inputs / self.temperature, dim=1))
 
         return self.temperature * self.temperature * 0.5 * (
@@ -17,6 +17,7 @@ class KLDivergenceLoss(nn.Module):
         self.temperature = temperature
 
     def forward(self, inputs, targets):
+        inputs, targets = inputs.float(), targets.float()
         p_s = F.log_softmax(inputs / self.temperature, dim=1)
         p_t = F.softmax(targets / self.temperature, dim=1)
         loss = F.kl_div(p_s, p_t) * (self.temperature ** 2)*targets.shape[1]
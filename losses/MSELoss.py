@@ -13,4 +13,4 @@ class MSELoss(nn.Module):
 
     def forward(self, inputs, targets):
         # balance this loss vs crossentropy loss since ce loss doesn't divided by num_classes
-        return self.mse_loss(inputs, targets)*self.num_classes
+        return self.mse_loss(inputs.float(), targets.float())*self.num_classes
@@ -10,6 +10,7 @@ class WeightedHintMSELoss(nn.Module):
         self.num_classes = num_classes
 
     def forward(self, inputs, targets, filter_weight):
+        inputs, targets = inputs.float(), targets.float()
         sq_diff = (inputs - targets) ** 2
         spatial_reduced = sq_diff.mean(dim=(-1, -2))
         weighted = (filter_weight*spatial_reduced).sum(dim=-1) / filter_weight.sum(dim=-1)
@@ -25,22 +26,19 @@ class TopkHintMSELoss(nn.Module):
         self.topk = topk
 
     def forward(self, inputs, targets):
+        inputs, targets = inputs.float(), targets.float()
         if len(targets.size()) == 4:
             norm = targets.norm(p=2, dim=(-1, -2))
         else:
             norm = targets
 
-        idx_ascending = norm.argsort(dim=-1, descending=True)
-        num_channels = idx_ascending.size(-1)
+        num_channels = norm.size(-1)
         idx_pivot = int(self.topk*num_channels)
-        mask = torch.zeros(targets.size(0), num_channels)
-        idx_keep = idx_ascending[:, :idx_pivot]
-
-        for x, y in zip(mask, idx_keep):
-            x[y] = 1.0
+        idx_keep = norm.topk(idx_pivot, dim=-1, sorted=False).indices
+        mask = torch.zeros_like(norm).scatter_(-1, idx_keep, 1.0)
 
         sq_diff = (inputs - targets) ** 2
         spatial_reduced = sq_diff.mean(dim=(-1, -2))
-        masked_loss = spatial_reduced*mask.cuda()
+        masked_loss = spatial_reduced*mask
         reduced_loss = masked_loss.sum() / mask.sum()
         return reduced_loss
@@ -4,4 +4,6 @@ from .KLDiv import KLDivergenceLoss
 from .MSELoss import MSELoss
 from .FocalLoss import FocalLoss
 from .WeightedHintMSELoss import WeightedHintMSELoss, TopkHintMSELoss
-from .EnsembleKLDiv import EnsembleKLDivergenceLoss
\ No newline at end of file
+from .EnsembleKLDiv import EnsembleKLDivergenceLoss
+from .ChunkedDiv import ChunkedKLDivergenceLoss, ChunkedJSDivergenceLoss
+from .Distillation import DistillationLoss
@@ -0,0 +1,98 @@
+import math
+import torch
+import torch.nn.functional as F
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+_SOBEL = [[[-1., 0., 1.], [-2., 0., 2.], [-1., 0., 1.]],
+          [[-1., -2., -1.], [0., 0., 0.], [1., 2., 1.]]]
+# fixed-point tan(22.5) and tan(67.5) of opencv's non-maximum suppression
+_TAN_22_5 = 13573 / 2 ** 15
+_TAN_67_5 = _TAN_22_5 + 2
+# number of dilations of the hysteresis between two convergence checks (a sync with the device)
+_HYSTERESIS_STEPS = 8
+
+
+def _as_uint8(inp):
+    # same values as inp.numpy().astype(np.uint8): truncation then wrap around
+    return inp.detach().float().trunc().remainder(256)
+
+
+def _hysteresis(strong, weak):
+    edges = strong.float()
+    weak = weak.float()
+    while True:
+        previous = edges
+        for _ in range(_HYSTERESIS_STEPS):
+            edges = F.max_pool2d(edges, 3, stride=1, padding=1) * weak
+        if torch.equal(edges, previous):
+            return edges
+
+
+def canny(inp, low_threshold=10, high_threshold=100):
+    """
+    Canny edges of a batch computed with tensor operations on the device of inp, following cv2.Canny with
+    aperture 3 and the L1 gradient: sobel gradients of every channel, the channel with the largest magnitude is kept,
+    non-maximum suppression along 4 directions and hysteresis with 8-connectivity by repeated max pooling
+    :param inp: Tensor of shape (BxCxHxW) - images, cast to uint8 as the opencv path does
+    :return: Tensor of shape (Bx1xHxW) - 255 on edges, 0 elsewhere
+    """
+    low_threshold, high_threshold = sorted([math.floor(low_threshold), math.floor(high_threshold)])
+    with torch.no_grad():
+        images = _as_uint8(inp)
+        b, c, h, w = images.shape
+        kernels = torch.tensor(_SOBEL, dtype=images.dtype, device=images.device).unsqueeze(1)
+        padded = F.pad(images.reshape(b * c, 1, h, w), (1, 1, 1, 1), mode='replicate')
+        gradients = F.conv2d(padded, kernels).view(b, c, 2, h, w)
+        dx, dy = gradients[:, :, 0], gradients[:, :, 1]
+        magnitude = dx.abs() + dy.abs()
+        channel = magnitude.argmax(dim=1, keepdim=True)
+        magnitude, dx, dy = magnitude.gather(1, channel), dx.gather(1, channel), dy.gather(1, channel)
+
+        # the magnitude is 0 outside of the image
+        padded = F.pad(magnitude, (1, 1, 1, 1))
+
+        def neighbour(row, col):
+            return padded[:, :, 1 + row: 1 + row + h, 1 + col: 1 + col + w]
+
+        abs_dx, abs_dy = dx.abs(), dy.abs()
+        same_sign = (dx < 0) == (dy < 0)
+        horizontal = (magnitude > neighbour(0, -1)) & (magnitude >= neighbour(0, 1))
+        vertical = (magnitude > neighbour(-1, 0)) & (magnitude >= neighbour(1, 0))
+        diagonal = torch.where(same_sign, (magnitude > neighbour(-1, -1)) & (magnitude > neighbour(1, 1)),
+                               (magnitude > neighbour(-1, 1)) & (magnitude > neighbour(1, -1)))
+        maximum = torch.where(abs_dy < abs_dx * _TAN_22_5, horizontal,
+                              torch.where(abs_dy > abs_dx * _TAN_67_5, vertical, diagonal))
+
+        weak = maximum & (magnitude > low_threshold)
+        strong = weak & (magnitude > high_threshold)
+        return _hysteresis(strong, weak) * 255
+
+
+def opencv_canny(inp, low_threshold=10, high_threshold=100):
+    """
+    reference implementation of canny with cv2.Canny on CPU, one image at a time
+    :param inp: Tensor of shape (BxCxHxW)
+    :return: Tensor of shape (Bx1xHxW) on the device of inp
+    """
+    if cv2 is None:
+        raise ValueError('opencv is not installed, it is needed for the reference canny edges')
+    images = _as_uint8(inp).cpu().numpy().astype('uint8').transpose((0, 2, 3, 1))
+    edges = torch.stack([torch.from_numpy(cv2.Canny(image.copy(), low_threshold, high_threshold)) for image in images])
+    return edges.unsqueeze(1).float().to(inp.device)
+
+
+def edge_agreement(edges, reference):
+    """
+    :return: dict - ratio of pixels with the same value, precision and recall of edges against reference
+    """
+    edges, reference = edges > 0, reference > 0
+    true_positives = (edges & reference).sum().item()
+    return {
+        'pixel_agreement': (edges == reference).float().mean().item(),
+        'precision': true_positives / max(edges.sum().item(), 1),
+        'recall': true_positives / max(reference.sum().item(), 1),
+    }
@@ -37,9 +37,8 @@ from ..common import initialize_weights, Norm2d
 from torch.autograd import Variable
 
 from . import gate_spatial_conv as gsc
+from .edges import canny as batch_canny
 
-import cv2
-import numpy as np
 from torchsummary import summary
 
 class Crop(nn.Module):
@@ -253,8 +252,29 @@ class GSCNN(nn.Module):
         self.sigmoid = nn.Sigmoid()
         initialize_weights(self.final_seg)
 
-    def forward(self, inp, gts=None):
+    @staticmethod
+    def canny_edges(inp):
+        """
+        Canny edges of the input images computed batched on the device of inp (see edges.canny). The hysteresis loop
+        depends on the data, so exported models take the edges as an extra input
+        :param inp: Tensor of shape (Bx3xHxW)
+        :return: Tensor of shape (Bx1xHxW) on the device of inp
+        """
+        return batch_canny(inp)
 
+    def side_inputs(self, inp):
+        """
+        arguments of forward that only depend on the images, DepthwiseStudent computes them once per batch and passes
+        them to both teacher and student
+        :param inp: Tensor of shape (Bx3xHxW)
+        :return: dict
+        """
+        return {'canny': self.canny_edges(inp)}
+
+    def forward(self, inp, gts=None, canny=None):
+        """
+        :param canny: Tensor of shape (Bx1xHxW) - edges of inp, computed by canny_edges if None
+        """
         x_size = inp.size()
 
         # res 1
@@ -281,11 +301,8 @@ class GSCNN(nn.Module):
 
         m1f = F.interpolate(m1, x_size[2:], mode='bilinear', align_corners=True)
 
-        im_arr = inp.cpu().numpy().transpose((0, 2, 3, 1)).astype(np.uint8)
-        canny = np.zeros((x_size[0], 1, x_size[2], x_size[3]))
-        for i in range(x_size[0]):
-            canny[i] = cv2.Canny(im_arr[i], 10, 100)
-        canny = torch.from_numpy(canny).cuda().float()
+        if canny is None:
+            canny = self.canny_edges(inp)
 
         cs = self.res1(m1f)
         cs = F.interpolate(cs, x_size[2:],
@@ -26,7 +26,8 @@ ALIGN_CORNERS = True
 BN_MOMENTUM = 0.1
 logger = logging.getLogger(__name__)
 
-default_config_file = 'models/hrnet_ocr/config_hrnet_ocr.json'
+# resolved next to this file so that the model can be built from any working directory e.g. by export tools
+default_config_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config_hrnet_ocr.json')
 with open(default_config_file, 'r') as df_cfg:
     default_config = json.load(df_cfg)['config']
 
@@ -57,21 +58,49 @@ class SpatialGather_Module(nn.Module):
         Employ the soft-weighted method to aggregate the context.
     """
 
-    def __init__(self, cls_num=0, scale=1):
+    def __init__(self, cls_num=0, scale=1, chunk_size=None):
+        """
+        :param chunk_size: int - number of pixels per step of the online softmax over hw, the whole softmax is
+            materialized if None
+        """
         super(SpatialGather_Module, self).__init__()
         self.cls_num = cls_num
         self.scale = scale
+        self.chunk_size = chunk_size
 
     def forward(self, feats, probs):
         batch_size, c, h, w = probs.size(0), probs.size(1), probs.size(2), probs.size(3)
         probs = probs.view(batch_size, c, -1)
         feats = feats.view(batch_size, feats.size(1), -1)
         feats = feats.permute(0, 2, 1)  # batch x hw x c
+        # the path only depends on the setting so that traced and compiled graphs don't branch on the input size, a
+        # single chunk gives the same result as the full softmax
+        if self.chunk_size is not None:
+            return self._chunked_gather(feats, probs).permute(0, 2, 1).unsqueeze(3)
         probs = F.softmax(self.scale * probs, dim=2)  # batch x k x hw
         ocr_context = torch.matmul(probs, feats) \
             .permute(0, 2, 1).unsqueeze(3)  # batch x k x c
         return ocr_context
 
+    def _chunked_gather(self, feats, probs):
+        """
+        softmax over hw and weighted sum of the features in one pass over chunks of pixels, the running max and sum
+        rescale what was accumulated so far (online softmax)
+        :return: Tensor of shape (batch x k x c)
+        """
+        running_max = probs.new_full((probs.size(0), probs.size(1), 1), float('-inf'))
+        running_sum = probs.new_zeros(probs.size(0), probs.size(1), 1)
+        ocr_context = probs.new_zeros(probs.size(0), probs.size(1), feats.size(2))
+        for start in range(0, probs.size(2), self.chunk_size):
+            logits = self.scale * probs[:, :, start: start + self.chunk_size]
+            new_max = torch.max(running_max, logits.amax(dim=2, keepdim=True))
+            correction = torch.exp(running_max - new_max)
+            weights = torch.exp(logits - new_max)
+            running_sum = running_sum * correction + weights.sum(dim=2, keepdim=True)
+            ocr_context = ocr_context * correction + torch.matmul(weights, feats[:, start: start + self.chunk_size])
+            running_max = new_max
+        return ocr_context / running_sum
+
 
 class _ObjectAttentionBlock(nn.Module):
     '''
@@ -83,6 +112,7 @@ class _ObjectAttentionBlock(nn.Module):
         key_channels      : the dimension after the key/query transform
         scale             : choose the scale to downsample the input feature maps (save memory cost)
         bn_type           : specify the bn type
+        chunk_size        : number of query pixels attending at once, the whole similarity map is built if None
     Return:
         N X C X H X W
     '''
@@ -91,9 +121,11 @@ class _ObjectAttentionBlock(nn.Module):
                  in_channels,
                  key_channels,
                  scale=1,
-                 bn_type=None):
+                 bn_type=None,
+                 chunk_size=None):
         super(_ObjectAttentionBlock, self).__init__()
         self.scale = scale
+        self.chunk_size = chunk_size
         self.in_channels = in_channels
         self.key_channels = key_channels
         self.pool = nn.MaxPool2d(kernel_size=(scale, scale))
@@ -135,12 +167,12 @@ class _ObjectAttentionBlock(nn.Module):
         value = self.f_down(proxy).view(batch_size, self.key_channels, -1)
         value = value.permute(0, 2, 1)
 
-        sim_map = torch.matmul(query, key)
-        sim_map = (self.key_channels ** -.5) * sim_map
-        sim_map = F.softmax(sim_map, dim=-1)
-
-        # add bg context ...
-        context = torch.matmul(sim_map, value)
+        if self.chunk_size is not None:
+            # the softmax is over the objects, each tile of queries gets its exact attention
+            context = torch.cat([self._attention(query_tile, key, value)
+                                 for query_tile in query.split(self.chunk_size, dim=1)], dim=1)
+        else:
+            context = self._attention(query, key, value)
         context = context.permute(0, 2, 1).contiguous()
         context = context.view(batch_size, self.key_channels, *x.size()[2:])
         context = self.f_up(context)
@@ -149,17 +181,27 @@ class _ObjectAttentionBlock(nn.Module):
 
         return context
 
+    def _attention(self, query, key, value):
+        sim_map = torch.matmul(query, key)
+        sim_map = (self.key_channels ** -.5) * sim_map
+        sim_map = F.softmax(sim_map, dim=-1)
+
+        # add bg context ...
+        return torch.matmul(sim_map, value)
+
 
 class ObjectAttentionBlock2D(_ObjectAttentionBlock):
     def __init__(self,
                  in_channels,
                  key_channels,
                  scale=1,
-                 bn_type=None):
+                 bn_type=None,
+                 chunk_size=None):
         super(ObjectAttentionBlock2D, self).__init__(in_channels,
                                                      key_channels,
                                                      scale,
-                                                     bn_type=bn_type)
+                                                     bn_type=bn_type,
+                                                     chunk_size=chunk_size)
 
 
 class SpatialOCR_Module(nn.Module):
@@ -174,12 +216,14 @@ class SpatialOCR_Module(nn.Module):
                  out_channels,
                  scale=1,
                  dropout=0.1,
-                 bn_type=None):
+                 bn_type=None,
+                 chunk_size=None):
         super(SpatialOCR_Module, self).__init__()
         self.object_context_block = ObjectAttentionBlock2D(in_channels,
                                                            key_channels,
                                                            scale,
-                                                           bn_type)
+                                                           bn_type,
+                                                           chunk_size)
         _in_channels = 2 * in_channels
 
         self.conv_bn_dropout = nn.Sequential(
@@ -425,6 +469,11 @@ blocks_dict = {
 class HighResolutionNet(nn.Module):
 
     def __init__(self, config=default_config, **kwargs):
+        """
+        :param config: dict - architecture, see config_hrnet_ocr.json
+        :param kwargs: attention_chunk_size (int) overrides ocr.attention_chunk_size of config, see
+            set_attention_chunk_size
+        """
         global ALIGN_CORNERS
         extra = config['extra']
         super(HighResolutionNet, self).__init__()
@@ -476,7 +525,7 @@ class HighResolutionNet(nn.Module):
         self.stage4, pre_stage_channels = self._make_stage(
             self.stage4_cfg, num_channels, multi_scale_output=True)
 
-        last_inp_channels = np.int(np.sum(pre_stage_channels))
+        last_inp_channels = int(np.sum(pre_stage_channels))
         ocr_mid_channels = config['ocr.mid_channels']
         ocr_key_channels = config['ocr.key_channels']
 
@@ -505,6 +554,19 @@ class HighResolutionNet(nn.Module):
             nn.Conv2d(last_inp_channels, config['num_classes'],
                       kernel_size=1, stride=1, padding=0, bias=True)
         )
+        self.set_attention_chunk_size(kwargs.get('attention_chunk_size', config.get('ocr.attention_chunk_size')))
+
+    def set_attention_chunk_size(self, chunk_size):
+        """
+        Run the OCR attention by chunks of pixels so that its intermediates stay linear in the number of pixels:
+        the gather head uses an online softmax over the pixels and the object attention tiles its queries. The
+        outputs match the full attention up to float rounding
+        :param chunk_size: int - number of pixels per chunk, None for the full attention
+        """
+        if chunk_size is not None and chunk_size < 1:
+            raise ValueError('attention_chunk_size must be at least 1, got {}'.format(chunk_size))
+        self.ocr_gather_head.chunk_size = chunk_size
+        self.ocr_distri_head.object_context_block.chunk_size = chunk_size
 
     def _make_transition_layer(
             self, num_channels_pre_layer, num_channels_cur_layer):
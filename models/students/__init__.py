@@ -1,4 +1,5 @@
 from .depthwise_student import DepthwiseStudent
 from .analysis_student import AnalysisStudent
 from .noisy_student import NoisyStudent
-from .taylor_prune_student import TaylorPruneStudent
\ No newline at end of file
+from .taylor_prune_student import TaylorPruneStudent
+from .ensemble_student import StackedEnsemble
@@ -0,0 +1,81 @@
+import contextlib
+import torch
+from torch import nn, fx
+from torch.utils.checkpoint import checkpoint
+
+# number of checkpointed blocks being recomputed during backward
+_recompute_depth = [0]
+
+
+def is_recomputing():
+    """
+    :return: bool - True while a checkpointed block is recomputed in backward, forward hooks storing outputs (e.g.
+        hints) should ignore those calls
+    """
+    return _recompute_depth[0] > 0
+
+
+@contextlib.contextmanager
+def _recompute(module):
+    """
+    batch norm layers in training mode would update their running stats a second time when the block is recomputed,
+    freeze them for the scope of the recomputation
+    """
+    norms = [m for m in module.modules()
+             if isinstance(m, nn.modules.batchnorm._BatchNorm) and m.training and m.track_running_stats]
+    states = [(m.momentum, m.num_batches_tracked.clone()) for m in norms]
+    for m in norms:
+        m.momentum = 0.
+    _recompute_depth[0] += 1
+    try:
+        yield
+    finally:
+        _recompute_depth[0] -= 1
+        for m, (momentum, num_batches_tracked) in zip(norms, states):
+            m.momentum = momentum
+            m.num_batches_tracked.copy_(num_batches_tracked)
+
+
+def _checkpointed_call(module, x):
+    calls = []
+
+    def run(inp):
+        if not calls:
+            calls.append(True)
+            return module(inp)
+        with _recompute(module):
+            return module(inp)
+
+    return checkpoint(run, x, use_reentrant=False)
+
+
+class CheckpointedSequential(nn.Sequential):
+    """
+    nn.Sequential whose children are run with activation checkpointing: only the input of each child is kept for
+    backward and the activations inside the child are recomputed. Children without trainable parameters whose input
+    doesn't require grad are run normally since autograd keeps nothing for them
+    """
+
+    def forward(self, x):
+        if not torch.is_grad_enabled() or isinstance(x, fx.Proxy):
+            return super().forward(x)
+        for module in self:
+            if x.requires_grad or any(param.requires_grad for param in module.parameters()):
+                x = _checkpointed_call(module, x)
+            else:
+                x = module(x)
+        return x
+
+
+def checkpoint_block(block):
+    """
+    run the children of a sequential block e.g. mod5 of WideResNet38 with activation checkpointing. The class of the
+    block is swapped in place so that its parameters, state dict keys and hooks are unchanged
+    :param block: nn.Sequential
+    """
+    if isinstance(block, CheckpointedSequential):
+        return
+    # subclasses of nn.Sequential may override forward
+    if type(block) is not nn.Sequential:
+        raise ValueError('Only nn.Sequential blocks can be checkpointed, got {}'.format(type(block).__name__))
+    block.__class__ = CheckpointedSequential
@@ -1,36 +1,99 @@
 import copy
+import contextlib
 import torch
 import numpy as np
 import gc
 from collections import namedtuple
 from functools import reduce
 from torch import nn
+from torch.nn.parallel import DistributedDataParallel
+from torch.autograd.profiler import record_function
 from base import BaseModel
 from beautifultable import BeautifulTable
 from .transform_blocks import DepthwiseSeparableBlock
+from .hint_graph import trace_with_hints
+from .checkpointing import checkpoint_block, is_recomputing, CheckpointedSequential
+from .qat import prepare_qat_block
 from utils import *
 
 BLOCKS_LEVEL_SPLIT_CHAR = '.'
 
 
+def shared_deepcopy(module, source):
+    """
+    deep copy a module but keep referencing the parameters of source instead of cloning them
+    :param module: nn.Module - module that would be copied
+    :param source: nn.Module - module whose parameters would be shared with the copy
+    :return: nn.Module
+    """
+    memo = {id(param): param for param in source.parameters()}
+    return copy.deepcopy(module, memo)
+
+
+def _forward_type(module):
+    # checkpointing swaps the class of a block but doesn't change its outputs
+    return nn.Sequential if isinstance(module, CheckpointedSequential) else type(module)
+
+
+def _same_block(block, teacher_block):
+    """
+    :param block: nn.Module - block of student network
+    :param teacher_block: nn.Module - block of teacher network with the same name
+    :return: bool - True if the block has the same submodules as the teacher block, no trainable parameter and
+        parameters and buffers equal to the teacher's
+    """
+    if [(name, _forward_type(m)) for name, m in block.named_modules()] != \
+            [(name, _forward_type(m)) for name, m in teacher_block.named_modules()]:
+        return False
+    if any(param.requires_grad for param in block.parameters()):
+        return False
+    tensors = list(block.named_parameters()) + list(block.named_buffers())
+    teacher_tensors = list(teacher_block.named_parameters()) + list(teacher_block.named_buffers())
+    if [name for name, _ in tensors] != [name for name, _ in teacher_tensors]:
+        return False
+    return all(t is teacher_t or (t.shape == teacher_t.shape and torch.equal(t, teacher_t))
+               for (_, t), (_, teacher_t) in zip(tensors, teacher_tensors))
+
+
+def _same_inputs(inp, recorded_inp):
+    return len(inp) == len(recorded_inp) and all(a is b for a, b in zip(inp, recorded_inp))
+
+
+class _StopForward(Exception):
+    """
+    Raised by a forward hook to stop the forward of a network once all required outputs are computed
+    """
+    pass
+
+
 class DepthwiseStudent(BaseModel):
     def __init__(self, teacher_model, config):
         """
         :param teacher_model: nn.Module object - pretrained model that need to be distilled
+        :param config: config object, set config.teacher.share_memory to true to load the frozen teacher once in
+            shared memory. The student (and ensemble students, sweep workers) would reference those read-only
+            weights instead of copying them until a block is replaced or unfrozen
         """
         super().__init__()
         self.config = config
-        # deep cloning teacher model as we will change it later depends on training purpose
-        self.teacher = copy.deepcopy(teacher_model)
+        self.share_teacher = config['teacher'].get('share_memory', False)
+        if self.share_teacher:
+            # the teacher is never modified, move its weights to shared memory instead of cloning it
+            self.teacher = teacher_model.share_memory()
+        else:
+            # deep cloning teacher model as we will change it later depends on training purpose
+            self.teacher = copy.deepcopy(teacher_model)
         if self.teacher.training:
             self.teacher.eval()
         for param in self.teacher.parameters():
             param.requires_grad = False
         # create student net
-        self.student = copy.deepcopy(self.teacher)
+        self.student = self.copy_teacher_block(self.teacher)
 
         # distillation args contain the distillation information such as block name, ...
         self.replaced_block_names = []
+        # unfrozen student blocks, restored to frozen copies of the teacher's blocks by reset
+        self.unfrozen_block_names = []
         # stored output of intermediate layers when
         self.student_hidden_outputs = list()
         self.teacher_hidden_outputs = list()
@@ -40,9 +103,223 @@ class DepthwiseStudent(BaseModel):
 
         # auxiliary layer
         self.aux_block_names = list()
+        # blocks whose outputs are currently used as hints
+        self.hint_block_names = list()
 
         self.save_hidden = True 
 
+        # compiled graphs of teacher and student, kept in a dict so they are not registered as submodules
+        self._compile_args = None
+        self._graphs = dict()
+        self._teacher_graph_hints = list()
+        # arguments of DistributedDataParallel wrapping the student in distributed training
+        self._ddp_args = None
+        # student blocks run with activation checkpointing
+        self.checkpoint_block_names = list()
+        # top-level student blocks run without autograd while they are frozen and their input doesn't require grad
+        self._no_grad_frozen = False
+        self._no_grad_blocks = dict()
+        # top-level student blocks whose outputs are taken from the teacher's forward, None until computed
+        self._share_prefix = False
+        self._shared_block_names = None
+
+    def distribute(self, **ddp_kwargs):
+        """
+        Synchronize the gradients of the student across the processes of a distributed run. The student (or its
+        compiled graph) is wrapped in DistributedDataParallel, the wrapper is rebuilt when the student changes
+        (replace, unfreeze, new hints) since the set of trainable parameters of DDP is fixed. Rebuilding it
+        broadcasts the weights of rank 0, so that newly replaced blocks are initialized identically on all ranks.
+        The frozen teacher isn't wrapped
+        :param ddp_kwargs: arguments of DistributedDataParallel e.g. device_ids, find_unused_parameters
+        """
+        self._ddp_args = ddp_kwargs
+        self._graphs.pop('student', None)
+
+    def _distribute(self, module):
+        if self._ddp_args is None:
+            return module
+        return DistributedDataParallel(module, **self._ddp_args)
+
+    def side_inputs(self, x):
+        """
+        Auxiliary inputs that only depend on the images (e.g. canny edges of GSCNN), computed once per batch and passed
+        to both teacher and student as keyword arguments. Networks declare them with a side_inputs(x) method
+        returning a dict of arguments of their forward
+        :param x: Tensor of shape (Bx3xHxW)
+        :return: dict
+        """
+        side_inputs = getattr(self.teacher, 'side_inputs', None)
+        if side_inputs is None:
+            return dict()
+        with torch.no_grad():
+            return side_inputs(x)
+
+    def _student_forward(self, x, side_inputs):
+        # the grad mode changed by the hooks of frozen blocks is restored even if the forward is interrupted
+        with torch.set_grad_enabled(torch.is_grad_enabled()):
+            if self._ddp_args is None:
+                return self.student(x, **side_inputs)
+            if 'student' not in self._graphs:
+                self._graphs['student'] = self._distribute(self.student)
+            return self._graphs['student'](x, **side_inputs)
+
+    def enable_checkpointing(self, block_names):
+        """
+        Run the given sequential blocks of the student (e.g. mod5, mod6 of WideResNet38) with activation
+        checkpointing: the activations inside their children are recomputed in backward instead of being kept.
+        Blocks are checkpointed again after they are replaced
+        :param block_names: list of str
+        """
+        self.checkpoint_block_names = list(block_names)
+        self._apply_checkpointing()
+
+    def _apply_checkpointing(self):
+        for block_name in self.checkpoint_block_names:
+            checkpoint_block(self.get_block(block_name, self.student))
+
+    def enable_no_grad_frozen(self):
+        """
+        Run the top-level blocks of the student under no_grad as long as they have no trainable parameter and
+        their input doesn't require grad i.e. the frozen prefix before the first replaced or unfrozen block. Nothing
+        of this prefix would be needed in backward, its autograd graph isn't recorded at all
+        """
+        self._no_grad_frozen = True
+        self._register_no_grad_hooks()
+
+    @staticmethod
+    def _no_grad_hooks():
+        """
+        :return: forward pre-hook and forward hook running a block under no_grad if it has no trainable parameter and
+            its input doesn't require grad
+        """
+        disabled = []
+
+        def pre_handle(m, inp):
+            if torch.is_grad_enabled() and not any(torch.is_tensor(t) and t.requires_grad for t in inp) \
+                    and not any(param.requires_grad for param in m.parameters()):
+                disabled.append(True)
+                torch.set_grad_enabled(False)
+
+        def handle(m, inp, out):
+            if disabled:
+                disabled.pop()
+                torch.set_grad_enabled(True)
+
+        return pre_handle, handle
+
+    def _register_no_grad_hooks(self):
+        for name, block in self.student.named_children():
+            if name in self._no_grad_blocks:
+                registered_block, handlers = self._no_grad_blocks[name]
+                if registered_block is block:
+                    continue
+                for handler in handlers:
+                    handler.remove()
+            pre_handle, handle = self._no_grad_hooks()
+            self._no_grad_blocks[name] = (block, [block.register_forward_pre_hook(pre_handle),
+                                                  block.register_forward_hook(handle)])
+
+    def enable_prefix_sharing(self):
+        """
+        Compute the prefix common to teacher and student once per forward. Until the first top-level block that is
+        replaced, unfrozen, hinted or whose weights differ from the teacher's, the student computes the same
+        activations as the teacher: the outputs of those blocks recorded during the teacher's forward are returned
+        by the student's blocks instead of being computed a second time. The shared blocks run like the teacher's,
+        i.e. in eval mode, so their batch norm running stats are not updated by the student
+        """
+        self._share_prefix = True
+        self._shared_block_names = None
+
+    def _shareable_block_names(self):
+        """
+        :return: set of str - top-level blocks of the student identical to the teacher's, they are checked again after
+            the student changes and at every call of train()
+        """
+        if self._shared_block_names is None:
+            modified = set(block_name.split(BLOCKS_LEVEL_SPLIT_CHAR)[0]
+                           for block_name in self.replaced_block_names + self.hint_block_names)
+            teacher_blocks = dict(self.teacher.named_children())
+            self._shared_block_names = set(name for name, block in self.student.named_children()
+                                           if name not in modified and name in teacher_blocks
+                                           and _same_block(block, teacher_blocks[name]))
+        return self._shared_block_names
+
+    @contextlib.contextmanager
+    def _record_prefix(self, calls):
+        """
+        record (name, input, output) of the top-level blocks of the teacher in call order until the first block that
+        can't be shared with the student
+        :param calls: list - filled with the recorded calls
+        """
+        if not self._share_prefix:
+            yield
+            return
+        shareable = self._shareable_block_names()
+        closed = []
+
+        def record_for(block_name):
+            def handle(m, inp, out):
+                if not closed:
+                    calls.append((block_name, inp, out))
+            return handle
+
+        def close_handle(m, inp):
+            closed.append(True)
+
+        handlers = [block.register_forward_hook(record_for(name)) if name in shareable
+                    else block.register_forward_pre_hook(close_handle)
+                    for name, block in self.teacher.named_children()]
+        try:
+            yield
+        finally:
+            for handler in handlers:
+                handler.remove()
+
+    @contextlib.contextmanager
+    def _replay_prefix(self, calls):
+        """
+        let the top-level blocks of the student return the outputs recorded by _record_prefix as long as they are called
+        in the same order with the same input tensors, blocks are computed normally after the first difference
+        :param calls: list - calls recorded during the teacher's forward
+        """
+        position = [0]
+
+        def replay_for(block_name, block):
+            def forward(*args, **kwargs):
+                if position[0] < len(calls):
+                    recorded_name, recorded_inp, out = calls[position[0]]
+                    if recorded_name == block_name and not kwargs and _same_inputs(args, recorded_inp):
+                        position[0] += 1
+                        return out
+                position[0] = len(calls)
+                return type(block).forward(block, *args, **kwargs)
+            return forward
+
+        recorded_names = set(call[0] for call in calls)
+        blocks = [(name, block) for name, block in self.student.named_children() if name in recorded_names]
+        # the forward hooks of the blocks still run around the replayed forward
+        for name, block in blocks:
+            block.forward = replay_for(name, block)
+        try:
+            yield
+        finally:
+            for _, block in blocks:
+                del block.forward
+
+    def enable_qat(self, block_names=None, backend='x86'):
+        """
+        Insert fake quantization of weights and activations into blocks of the student so that the distillation
+        makes them robust to int8 quantization. Parameters keep their names, hints and optimizers are unchanged
+        :param block_names: list of str - blocks of the student e.g. replaced blocks, the whole student if None
+        :param backend: str - x86 or fbgemm, backend the student would be exported to
+        """
+        blocks = [self.student] if block_names is None else \
+            [self.get_block(block_name, self.student) for block_name in block_names]
+        for block in blocks:
+            prepare_qat_block(block, backend)
+        self._graphs.pop('student', None)
+        self._shared_block_names = None
+
     def register_hint_layers(self, block_names):
         """
         Register auxiliary layers for computing hint loss
@@ -52,6 +329,13 @@ class DepthwiseStudent(BaseModel):
         # remove all added hint layers....
         if len(block_names) > 0:
             self._remove_hooks()
+            self.hint_block_names = list(block_names)
+            self._graphs.pop('student', None)
+            self._shared_block_names = None
+        # compiled graphs return the hints as extra outputs instead of using hooks
+        if self._compile_args is not None:
+            self.aux_block_names.extend(block_names)
+            return
         # add new hint layers
         for block_name in block_names:
             self.aux_block_names.append(block_name)
@@ -60,28 +344,115 @@ class DepthwiseStudent(BaseModel):
             student_block = self.get_block(block_name, self.student)
 
             # teacher's hook
-            def teacher_handle(m, inp, out):
-                if self.save_hidden:
-                    self.teacher_hidden_outputs.append(out)
+            def teacher_handle(m, inp, out, block_name=block_name):
+                with record_function('hint_capture/teacher/' + block_name):
+                    if self.save_hidden and not is_recomputing():
+                        self.teacher_hidden_outputs.append(out)
 
             teacher_handler = teacher_block.register_forward_hook(teacher_handle)
             self._teacher_hook_handlers.append(teacher_handler)
 
             # student's hook
-            def student_handle(m, inp, out):
-                if self.save_hidden:
-                    self.student_hidden_outputs.append(out)
+            def student_handle(m, inp, out, block_name=block_name):
+                with record_function('hint_capture/student/' + block_name):
+                    if self.save_hidden and not is_recomputing():
+                        self.student_hidden_outputs.append(out)
 
             student_handler = student_block.register_forward_hook(student_handle)
             self._student_hook_handlers.append(student_handler)
         gc.collect()
         torch.cuda.empty_cache()
 
+    def copy_teacher_block(self, block):
+        """
+        copy a block of teacher, the frozen weights are shared with teacher if config.teacher.share_memory is set
+        :param block: nn.Module - block of teacher network
+        :return: nn.Module
+        """
+        if self.share_teacher:
+            return shared_deepcopy(block, self.teacher)
+        return copy.deepcopy(block)
+
+    def copy_student(self):
+        """
+        copy the student network, frozen weights which are still shared with teacher are not cloned
+        :return: nn.Module
+        """
+        if self.share_teacher:
+            return shared_deepcopy(self.student, self.teacher)
+        return copy.deepcopy(self.student)
+
+    def _detach_shared_parameters(self, block):
+        """
+        clone parameters of a student block that are still referencing the teacher's (shared) weights so that
+        training them would not modify the teacher
+        :param block: nn.Module - block of student network
+        :return: None
+        """
+        if not self.share_teacher:
+            return
+        teacher_params = set(id(param) for param in self.teacher.parameters())
+        for module in block.modules():
+            for name, param in module._parameters.items():
+                if param is not None and id(param) in teacher_params:
+                    module._parameters[name] = nn.Parameter(param.detach().clone())
+
     def unfreeze(self, block_names):
         for block_name in block_names:
+            self.unfrozen_block_names.append(block_name)
             block = self.get_block(block_name, self.student)
+            self._detach_shared_parameters(block)
             for param in block.parameters():
                 param.requires_grad = True
+        self._graphs.pop('student', None)
+        self._shared_block_names = None
+
+    def unfreeze_student(self):
+        """
+        unfreeze the whole student network
+        """
+        self.unfrozen_block_names.extend(name for name, _ in self.student.named_children())
+        self._detach_shared_parameters(self.student)
+        for param in self.student.parameters():
+            param.requires_grad = True
+        self._graphs.pop('student', None)
+        self._shared_block_names = None
+
+    def enable_compile(self, teacher_hint_names=(), **compile_kwargs):
+        """
+        Run teacher and student as compiled graphs. Hints are captured as extra outputs of the graphs instead of
+        forward hooks. The student is recompiled only when its architecture changes (replace, unfreeze, new hints),
+        the teacher is compiled once with the outputs of all blocks that would be used as hint during the run.
+        Fallback to the traced graphs without compilation if torch.compile is not available
+        :param teacher_hint_names: list of str - name of all blocks that would be used as hint
+        :param compile_kwargs: arguments of torch.compile e.g. mode, backend
+        """
+        self._compile_args = compile_kwargs
+        self._teacher_graph_hints = list(dict.fromkeys(teacher_hint_names))
+        self._graphs = dict()
+        self._remove_hooks()
+
+    def _compile(self, model, block_names):
+        graph = trace_with_hints(model, block_names)
+        if hasattr(torch, 'compile'):
+            return torch.compile(graph, **self._compile_args)
+        return graph
+
+    def _compiled_forward(self, x, side_inputs):
+        if 'teacher' not in self._graphs or not set(self.hint_block_names) <= set(self._teacher_graph_hints):
+            self._teacher_graph_hints = list(dict.fromkeys(self._teacher_graph_hints + self.hint_block_names))
+            self._graphs['teacher'] = self._compile(self.teacher, self._teacher_graph_hints)
+        if 'student' not in self._graphs:
+            self._graphs['student'] = self._distribute(self._compile(self.student, self.hint_block_names))
+
+        with torch.no_grad():
+            teacher_pred, teacher_hints = self._graphs['teacher'](x, **side_inputs)
+        student_pred, student_hints = self._graphs['student'](x, **side_inputs)
+        if self.save_hidden:
+            teacher_hints = dict(zip(self._teacher_graph_hints, teacher_hints))
+            self.teacher_hidden_outputs = [teacher_hints[block_name] for block_name in self.hint_block_names]
+            self.student_hidden_outputs = list(student_hints)
+        return student_pred, teacher_pred
 
     def replace(self, blocks, **kwargs):
         """
@@ -116,7 +487,7 @@ class DepthwiseStudent(BaseModel):
                                                     padding=padding,
                                                     dilation=dilation,
                                                     groups=teacher_block.in_channels,
-                                                    bias=teacher_block.bias).cuda()
+                                                    bias=teacher_block.bias).to(teacher_block.weight.device)
             # replaced that newly created layer to student network
             self._set_block(block_name, replace_block, self.student)
 
@@ -147,6 +518,13 @@ class DepthwiseStudent(BaseModel):
             obj = self.get_block(BLOCKS_LEVEL_SPLIT_CHAR.join(block_name_split[:-1]), model)
             attr = block_name_split[-1]
             setattr(obj, attr, block)
+        # the architecture is changed, compiled graph has to be rebuilt
+        self._graphs.pop('student' if model is self.student else 'teacher', None)
+        self._shared_block_names = None
+        if model is self.student:
+            self._apply_checkpointing()
+            if self._no_grad_frozen:
+                self._register_no_grad_hooks()
 
     def get_block(self, block_name, model):
         """
@@ -169,19 +547,81 @@ class DepthwiseStudent(BaseModel):
         # flush the output of last forward
         self.student_hidden_outputs = []
         self.teacher_hidden_outputs = []
+        side_inputs = self.side_inputs(x)
+        if self._compile_args is not None:
+            return self._compiled_forward(x, side_inputs)
         # in training mode, the network has to forward 2 times, one for computing teacher's prediction \
-        # and another for student's one
-        with torch.no_grad():
-            teacher_pred = self.teacher(x)
-        student_pred = self.student(x)
+        # and another for student's one, the frozen prefix common to both is only computed by the teacher
+        calls = []
+        with torch.no_grad(), self._record_prefix(calls):
+            teacher_pred = self.teacher(x, **side_inputs)
+        with self._replay_prefix(calls):
+            student_pred = self._student_forward(x, side_inputs)
         return student_pred, teacher_pred
 
+    def forward_hints(self, x):
+        """
+        Forward teacher and student only until all hint outputs are computed. Blocks after the top-level block that
+        contains the deepest hint (e.g. aspp, final) are skipped. The top-level block is always completed so that
+        in-place operations of residual blocks on the hint outputs still happen.
+        Only student_hidden_outputs and teacher_hidden_outputs are filled, a full forward is run if no hint is
+        registered, the networks are compiled or the student is distributed (DDP only synchronizes the gradients of
+        forwards that return)
+        :param x: Tensor of shape (Bx3xHxW)
+        """
+        if self._compile_args is not None or not self._student_hook_handlers or self._ddp_args is not None:
+            self.forward(x)
+            return
+        self.student_hidden_outputs = []
+        self.teacher_hidden_outputs = []
+        top_level_names = set(block_name.split(BLOCKS_LEVEL_SPLIT_CHAR)[0] for block_name in self.hint_block_names)
+        side_inputs = self.side_inputs(x)
+        calls = []
+        with torch.no_grad(), self._record_prefix(calls):
+            self._forward_until(self.teacher, top_level_names, x, side_inputs)
+        with self._replay_prefix(calls):
+            self._forward_until(self.student, top_level_names, x, side_inputs)
+
+    def _forward_until(self, model, block_names, x, side_inputs):
+        """
+        forward model until all the given blocks have been run
+        :param model: nn.Module
+        :param block_names: set of str - name of blocks
+        :param x: input of model
+        :param side_inputs: dict - keyword arguments of model, see side_inputs
+        """
+        finished_blocks = set()
+
+        def stop_handle_for(block_name):
+            def stop_handle(m, inp, out):
+                finished_blocks.add(block_name)
+                if finished_blocks == block_names:
+                    raise _StopForward()
+            return stop_handle
+
+        handlers = [self.get_block(block_name, model).register_forward_hook(stop_handle_for(block_name))
+                    for block_name in block_names]
+        try:
+            # the grad mode changed by the hooks of frozen blocks is restored when the forward is stopped
+            with torch.set_grad_enabled(torch.is_grad_enabled()):
+                model(x, **side_inputs)
+        except _StopForward:
+            pass
+        finally:
+            for handler in handlers:
+                handler.remove()
+
     def inference(self, x):
         # flush the output of last forward
         self.student_hidden_outputs = []
         self.teacher_hidden_outputs = []
 
-        student_pred = self.student(x)
+        side_inputs = self.side_inputs(x)
+        if self._compile_args is not None:
+            if 'student' not in self._graphs:
+                self._graphs['student'] = self._distribute(self._compile(self.student, self.hint_block_names))
+            return self._graphs['student'](x, **side_inputs)[0]
+        student_pred = self.student(x, **side_inputs)
         return student_pred
 
     def inference_test(self, data, args):
@@ -262,14 +702,26 @@ class DepthwiseStudent(BaseModel):
         logger = self.config.get_logger('trainer', self.config['trainer']['verbosity'])
         # remove hint layers
         self._remove_hooks()
+        self.hint_block_names = list()
         logger.debug('Removing all hint layers...')
         # remove replaced layers
+        replaced_block_names = list(self.replaced_block_names)
         while self.replaced_block_names:
             block_name = self.replaced_block_names.pop()
             teacher_block  = self.get_block(block_name, self.teacher)
-            student_block = copy.deepcopy(teacher_block)
+            student_block = self.copy_teacher_block(teacher_block)
             self._set_block(block_name, student_block, self.student)
             logger.debug("Replace the layer {} back to teacher's block".format(block_name))
+        # refreeze unfrozen layers, their weights were trained (and cloned from the shared teacher's weights)
+        while self.unfrozen_block_names:
+            block_name = self.unfrozen_block_names.pop()
+            # blocks inside a replaced block were restored with it
+            if any(block_name == name or block_name.startswith(name + BLOCKS_LEVEL_SPLIT_CHAR)
+                   for name in replaced_block_names):
+                continue
+            teacher_block = self.get_block(block_name, self.teacher)
+            self._set_block(block_name, self.copy_teacher_block(teacher_block), self.student)
+            logger.debug("Refreeze the layer {} as teacher's block".format(block_name))
         logger.debug("Reset completed...")
 
     def train(self,mode=True):
@@ -280,5 +732,7 @@ class DepthwiseStudent(BaseModel):
         super().train(mode)
         # teacher will always in eval mode
         self.teacher.eval()
+        # weights may have been loaded since the shared prefix was computed e.g. when resuming
+        self._shared_block_names = None
 
         return self
\ No newline at end of file
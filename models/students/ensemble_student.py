@@ -2,10 +2,17 @@ from .depthwise_student import DepthwiseStudent
 from .transform_blocks import *
 from models.encoders.wider_resnet import bnrelu
 from torch import nn
+import torch.nn.functional as F
 import copy
 import torch 
 import gc 
 
+try:
+    from torch.func import stack_module_state, functional_call, vmap
+except ImportError:
+    # torch < 2.0, members of ensemble would be evaluated one by one
+    stack_module_state = None
+
 
 class EnsembleStudent(DepthwiseStudent):
     """
@@ -14,4 +21,62 @@ class EnsembleStudent(DepthwiseStudent):
     def __init__(self,teacher_model, config):
         super().__init__(teacher_model, config)
         self.studdents = nn.ModuleList()
-    
\ No newline at end of file
+
+
+class StackedEnsemble:
+    """
+        Evaluate frozen models sharing the same architecture in one batched call. The parameters and buffers of all
+        members are stacked and a functional forward of the architecture is vmapped over them, so the cost is closer
+        to one large forward than N small ones.
+        The members must stay frozen and in eval mode, call `restack` if their weights are modified.
+    """
+    def __init__(self, models, vectorize=True):
+        """
+        :param models: list of nn.Module - members of ensemble, all of them have identical architecture
+        :param vectorize: bool - evaluate members in one vmapped call, fallback to a loop if torch.func is missing
+        """
+        self.models = models
+        self.vectorize = vectorize and stack_module_state is not None and len(models) > 0
+        self.restack()
+
+    def restack(self):
+        self.params, self.buffers = None, None
+        if not self.vectorize:
+            return
+        self.params, self.buffers = stack_module_state(self.models)
+        # the architecture is only used as a template for functional_call, its own weights are never touched
+        # frozen members are always evaluated with their running statistics
+        self._base_model = copy.deepcopy(self.models[0]).eval().to('meta')
+
+    def _functional_forward(self, params, buffers, x):
+        return functional_call(self._base_model, (params, buffers), (x,))
+
+    def __call__(self, x):
+        """
+        :param x: Tensor of shape (Bx3xHxW)
+        :return: Tensor of shape (NxBxC) for classification or (NxBxCxHxW) for segmentation, N is number of members
+        """
+        with torch.no_grad():
+            if self.params is None:
+                return torch.stack([model(x) for model in self.models])
+            return vmap(self._functional_forward, in_dims=(0, 0, None))(self.params, self.buffers, x)
+
+    def __len__(self):
+        return len(self.models)
+
+    def soft_targets(self, x, temperature=1, weight=1, teacher_output=None):
+        """
+        :param x: Tensor of shape (Bx3xHxW)
+        :param temperature: float - temperature of softmax
+        :param weight: float - weight of each member's prediction
+        :param teacher_output: Tensor of shape (BxC) or (BxCxHxW) - logits of teacher, averaged with weight 1
+        :return: tuple of the raw outputs of members (NxBxC...) and their ACTIVATED average (BxC...)
+        """
+        outputs = self(x)
+        with torch.no_grad():
+            probs = weight * F.softmax(outputs.float() / temperature, dim=2).sum(dim=0)
+            total_weight = weight * len(self.models)
+            if teacher_output is not None:
+                probs = probs + F.softmax(teacher_output.float() / temperature, dim=1)
+                total_weight += 1
+        return outputs, probs / total_weight
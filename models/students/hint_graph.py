@@ -0,0 +1,34 @@
+from torch import fx
+
+
+class _HintTracer(fx.Tracer):
+    """
+    Symbolic tracer that keeps hinted blocks as leaf modules so that their outputs are explicit nodes of the graph
+    """
+
+    def __init__(self, block_names):
+        super().__init__()
+        self.block_names = set(block_names)
+
+    def is_leaf_module(self, m, module_qualified_name):
+        return module_qualified_name in self.block_names or super().is_leaf_module(m, module_qualified_name)
+
+
+def trace_with_hints(model, block_names):
+    """
+    Trace a model into a graph module whose forward returns (output, tuple of outputs of blocks) instead of relying on
+    forward hooks, the graph module references the submodules of model so they share parameters
+    :param model: nn.Module - model that would be traced
+    :param block_names: list of str - name of blocks e.g. mod4.block2.convs.conv2, outputs are returned in this order
+    :return: fx.GraphModule
+    """
+    tracer = _HintTracer(block_names)
+    graph = tracer.trace(model)
+    block_nodes = {node.target: node for node in graph.nodes if node.op == 'call_module'}
+    missing = [block_name for block_name in block_names if block_name not in block_nodes]
+    if missing:
+        raise ValueError('Blocks {} are not called in forward of {}'.format(missing, type(model).__name__))
+    output = next(node for node in graph.nodes if node.op == 'output')
+    output.args = ((output.args[0], tuple(block_nodes[block_name] for block_name in block_names)),)
+    graph.lint()
+    return fx.GraphModule(model, graph)
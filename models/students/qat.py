@@ -0,0 +1,63 @@
+import copy
+from torch import nn
+from torch.ao.quantization import get_default_qat_qconfig, propagate_qconfig_, prepare, convert
+from torch.ao.quantization.quantize import _remove_qconfig
+from torch.ao.quantization.quantization_mappings import get_default_qat_module_mappings
+import torch.ao.nn.qat as nnqat
+
+
+def has_fake_quant(model):
+    """
+    :return: bool - True if model contains layers prepared by prepare_qat_block
+    """
+    return any(isinstance(m, (nnqat.Conv2d, nnqat.Linear)) for m in model.modules())
+
+
+def prepare_qat_block(block, backend='x86'):
+    """
+    Insert fake quantization into the layers of block: convolutions and linear layers quantize their weights per
+    output channel and layers with a quantized counterpart (conv, linear, batch norm) quantize their outputs, as
+    the int8 model of backend would. The parameters are kept (the same objects under the same names) so that
+    optimizers, hints and unfreezing still find them. Layers of block prepared before are left unchanged
+    :param block: nn.Module
+    :param backend: str - x86 or fbgemm
+    """
+    if getattr(block, 'qconfig', None) is not None:
+        return
+    # an explicit None stops the propagation of qconfig to the layers that already have fake quantization
+    prepared = {m: m.qconfig for m in block.modules() if getattr(m, 'qconfig', None) is not None}
+    for m in prepared:
+        m.qconfig = None
+    mapping = get_default_qat_module_mappings()
+    block.qconfig = get_default_qat_qconfig(backend)
+    propagate_qconfig_(block)
+    convert(block, mapping=mapping, inplace=True, remove_qconfig=False)
+    prepare(block, observer_non_leaf_module_list=set(mapping.values()), inplace=True)
+    for m, qconfig in prepared.items():
+        m.qconfig = qconfig
+
+
+def _float_layer(layer):
+    if isinstance(layer, nnqat.Conv2d):
+        float_layer = nn.Conv2d(layer.in_channels, layer.out_channels, layer.kernel_size, stride=layer.stride,
+                                padding=layer.padding, dilation=layer.dilation, groups=layer.groups,
+                                bias=layer.bias is not None, padding_mode=layer.padding_mode)
+    else:
+        float_layer = nn.Linear(layer.in_features, layer.out_features, bias=layer.bias is not None)
+    float_layer.weight = layer.weight
+    float_layer.bias = layer.bias
+    return float_layer.to(layer.weight.device)
+
+
+def remove_fake_quant(model):
+    """
+    :param model: nn.Module - model whose blocks were prepared by prepare_qat_block
+    :return: nn.Module - float copy of model with the learned weights, ready for post-training quantization
+    """
+    model = copy.deepcopy(model)
+    _remove_qconfig(model)
+    for name, module in list(model.named_modules()):
+        for child_name, child in module.named_children():
+            if isinstance(child, (nnqat.Conv2d, nnqat.Linear)):
+                setattr(module, child_name, _float_layer(child))
+    return model
@@ -42,18 +42,9 @@ class TaylorPruneStudent(DepthwiseStudent):
         torch.cuda.empty_cache()
 
     def reset(self):
-        logger = self.config.get_logger('trainer', self.config['trainer']['verbosity'])
-        # remove hint layers
-        self._remove_hooks()
-        logger.debug('Removing all hint layers...')
-        # remove replaced layers
-        while self.replaced_block_names:
-            block_name = self.replaced_block_names.pop()
-            teacher_block = self.get_block(block_name, self.teacher)
-            student_block = copy.deepcopy(teacher_block)
-            self._set_block(block_name, student_block, self.student)
-            logger.debug("Replace the layer {} back to teacher's block".format(block_name))
-        logger.debug("Reset completed...")
+        super().reset()
+        # the gates were removed with the replaced blocks
+        self.added_gates = dict()
 
     def get_gate_importance(self):
         importance_dict = dict()
@@ -7,6 +7,7 @@ from operator import getitem
 from datetime import datetime
 from logger import setup_logging
 from utils import read_json, write_json
+from utils.distributed import init_distributed, is_main_process, broadcast_object, barrier
 
 class ConfigParser:
     def __init__(self, config, resume=None, modification=None, run_id=None):
@@ -27,20 +28,28 @@ class ConfigParser:
 
         exper_name = self.config['name']
         if run_id is None:  # use timestamp as default run-id
-            run_id = datetime.now().strftime(r'%m%d_%H%M%S')
+            # all processes of a distributed run use the timestamp of rank 0
+            run_id = broadcast_object(datetime.now().strftime(r'%m%d_%H%M%S'))
         self._save_dir = save_dir / 'models' / exper_name / run_id
         self._log_dir = save_dir / 'log' / exper_name / run_id
 
-        # make directory for saving checkpoints and log.
-        exist_ok = run_id == ''
-        self.save_dir.mkdir(parents=True, exist_ok=exist_ok)
-        self.log_dir.mkdir(parents=True, exist_ok=exist_ok)
+        if is_main_process():
+            # make directory for saving checkpoints and log.
+            exist_ok = run_id == ''
+            self.save_dir.mkdir(parents=True, exist_ok=exist_ok)
+            self.log_dir.mkdir(parents=True, exist_ok=exist_ok)
 
-        # save updated config file to the checkpoint dir
-        write_json(self.config, self.save_dir / 'config.json')
+            # save updated config file to the checkpoint dir
+            write_json(self.config, self.save_dir / 'config.json')
+
+            # configure logging module
+            setup_logging(self.log_dir)
+        else:
+            # only rank 0 writes the log file, the other ranks print warnings
+            logging.basicConfig(level=logging.WARNING)
+        # the other ranks wait until the directories of rank 0 exist, e.g. they write profiler traces in log_dir
+        barrier()
 
-        # configure logging module
-        setup_logging(self.log_dir)
         self.log_levels = {
             0: logging.WARNING,
             1: logging.INFO,
@@ -59,6 +68,8 @@ class ConfigParser:
 
         if args.device is not None:
             os.environ["CUDA_VISIBLE_DEVICES"] = args.device
+        # join the process group when launched with torchrun
+        init_distributed(getattr(args, 'dist_backend', None))
         if args.resume is not None:
             resume = Path(args.resume)
             cfg_fname = resume.parent / 'config.json'
@@ -129,7 +140,8 @@ class ConfigParser:
                                                                                        self.log_levels.keys())
         assert verbosity in self.log_levels, msg_verbosity
         logger = logging.getLogger(name)
-        logger.setLevel(self.log_levels[verbosity])
+        # the other ranks of a distributed run only log warnings
+        logger.setLevel(self.log_levels[verbosity] if is_main_process() else logging.WARNING)
         return logger
 
     # setting read-only attributes
@@ -0,0 +1,74 @@
+import argparse
+import collections
+import torch
+import models as module_arch
+from models.students import DepthwiseStudent
+from parse_config import ConfigParser
+from utils.block_profiler import profile_blocks, sort_report, write_report, report_table
+
+
+def main(config, args):
+    logger = config.get_logger('profile')
+    torch.manual_seed(args.seed)
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+
+    # the weights don't change the timing, the snapshot is only loaded if it is asked
+    if args.load_snapshot:
+        teacher = config.restore_snapshot('teacher', module_arch)
+    else:
+        teacher = config.init_obj('teacher', module_arch)
+    model = DepthwiseStudent(teacher.cpu(), config)
+    model.replace(config['pruning']['pruning_plan'], **config['pruning']['args'])
+    model.eval()
+
+    block_names = args.blocks if args.blocks else model.replaced_block_names
+    height, width = args.resolution if args.resolution else [config['transforms']['joint_transforms']['crop_size']] * 2
+    batch_size = args.batch_size if args.batch_size else config['train_data_loader']['args']['batch_size']
+    x = torch.randn(batch_size, 3, height, width)
+    logger.info('Profiling {} blocks with input of shape {} on {} threads'.format(
+        len(block_names), tuple(x.shape), torch.get_num_threads()))
+
+    rows = profile_blocks(model, x, block_names, args.warmup, args.repeats, args.backward)
+    rows = sort_report(rows, args.sort_by, args.descending)
+    logger.info('\n' + report_table(rows))
+
+    output = args.output if args.output is not None else str(config.log_dir / 'block_profile.csv')
+    write_report(rows, output)
+    logger.info('Saved report to {}'.format(output))
+
+
+if __name__ == '__main__':
+    args = argparse.ArgumentParser(description='Profile latency, memory and FLOPs of teacher vs student blocks on CPU')
+    args.add_argument('-c', '--config', default=None, type=str,
+                      help='config file path (default: None)')
+    args.add_argument('-r', '--resume', default=None, type=str,
+                      help='path to latest checkpoint (default: None)')
+    args.add_argument('-d', '--device', default=None, type=str,
+                      help='indices of GPUs to enable (default: all)')
+    args.add_argument('--blocks', default=None, nargs='+', type=str,
+                      help='names of blocks to profile (default: every block of pruning plan)')
+    args.add_argument('--resolution', default=None, nargs=2, type=int,
+                      help='height and width of input (default: crop size of training)')
+    args.add_argument('--batch_size', default=None, type=int,
+                      help='batch size of input (default: batch size of training)')
+    args.add_argument('--warmup', default=3, type=int, help='number of calls before measuring')
+    args.add_argument('--repeats', default=10, type=int, help='number of measured calls')
+    args.add_argument('--backward', action='store_true', help='time forward and backward instead of forward only')
+    args.add_argument('--threads', default=None, type=int, help='number of cpu threads (default: torch default)')
+    args.add_argument('--seed', default=123, type=int)
+    args.add_argument('--load_snapshot', action='store_true', help='load the weights of teacher snapshot')
+    args.add_argument('--sort_by', default='speedup', type=str, help='column used to sort the report')
+    args.add_argument('--descending', action='store_true')
+    args.add_argument('--output', default=None, type=str,
+                      help='path of .csv or .json report (default: block_profile.csv in log dir)')
+
+    # custom cli options to modify configuration from default values given in json file.
+    CustomArgs = collections.namedtuple('CustomArgs', 'flags type target')
+    options = [
+        CustomArgs(['--kernel_size'], type=int, target='pruning;args;kernel_size'),
+        CustomArgs(['--dilation'], type=int, target='pruning;args;dilation'),
+        CustomArgs(['--padding'], type=int, target='pruning;args;padding'),
+    ]
+    config = ConfigParser.from_args(args, options)
+    main(config, args.parse_args())
@@ -0,0 +1,133 @@
+import argparse
+import collections
+import json
+import torch
+import numpy as np
+import data_loader as module_data
+import losses as module_loss
+import models.metric as module_metric
+import models as module_arch
+import models.cifar_models as module_cifar_arch
+import utils.optim as module_optim
+from models.students import DepthwiseStudent
+from models.students.qat import has_fake_quant, remove_fake_quant
+from data_loader import _create_transform
+from parse_config import ConfigParser
+from trainer import LayerwiseTrainer, ClassificationTrainer
+from utils import WeightScheduler
+from utils.quantization import model_inputs, quantization_config, prepare_quantization, calibrate, \
+    convert_quantization, quantization_report, quantization_table, trace_quantized
+
+SEED = 123
+torch.manual_seed(SEED)
+np.random.seed(SEED)
+
+
+def build_student(config):
+    """
+    rebuild the student of the checkpoint given by trainer.resume_path: blocks are replaced as during training and
+    the weights are loaded by the trainer
+    :return: (nn.Module, DataLoader, bool) - float student, validation data loader and whether the task is
+        segmentation
+    """
+    segmentation = config['trainer']['name'] == 'LayerwiseTrainer'
+    if segmentation:
+        train_joint_transform, train_input_transform, target_transform, val_input_transform = \
+            _create_transform(config)
+        train_data_loader = config.init_obj('train_data_loader', module_data, transform=train_input_transform,
+                                            transforms=train_joint_transform, target_transform=target_transform)
+        valid_data_loader = config.init_obj('val_data_loader', module_data, transform=val_input_transform,
+                                            target_transform=target_transform)
+        teacher = config.restore_snapshot('teacher', module_arch)
+    elif config['trainer']['name'] == 'ClassificationTrainer':
+        train_data_loader = config.init_obj('train_data_loader', module_data)
+        valid_data_loader = config.init_obj('test_data_loader', module_data)
+        teacher = config.restore_snapshot('teacher', module_cifar_arch)
+    else:
+        raise NotImplementedError("Supported: Layerwise Trainer, Classification Trainer")
+    student = DepthwiseStudent(teacher.cpu(), config)
+
+    criterions = [config.init_obj('supervised_loss', module_loss), config.init_obj('kd_loss', module_loss),
+                  config.init_obj('hint_loss', module_loss)]
+    metrics = [getattr(module_metric, met) for met in config['metrics']]
+    optimizer = config.init_obj('optimizer', module_optim, student.student.parameters())
+    lr_scheduler = config.init_obj('lr_scheduler', module_optim.lr_scheduler, optimizer)
+    weight_scheduler = WeightScheduler(config['weight_scheduler'])
+    trainer_class = LayerwiseTrainer if segmentation else ClassificationTrainer
+    trainer = trainer_class(student, criterions, metrics, optimizer, config, train_data_loader, valid_data_loader,
+                            lr_scheduler, weight_scheduler)
+    return trainer.model.student.cpu().eval(), valid_data_loader, segmentation
+
+
+def main(config, args):
+    logger = config.get_logger('quantize')
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    if 'resume_path' not in config['trainer']:
+        logger.warning('No student checkpoint is given with --checkpoint, quantizing the initial student')
+
+    model, valid_data_loader, segmentation = build_student(config)
+    if has_fake_quant(model):
+        # student distilled with trainer.qat, its learned weights are exported and the observers recalibrated
+        logger.info('Removing fake quantization of the quantization-aware student')
+        model = remove_fake_quant(model)
+    metrics = [getattr(module_metric, met) for met in config['metrics']]
+    data, _ = next(iter(valid_data_loader))
+    if args.resolution is not None:
+        data = torch.randn(data.shape[0], data.shape[1], *args.resolution)
+    example_inputs = model_inputs(model, data.cpu())
+
+    qconfig_mapping = quantization_config(model, args.backend, args.skip_blocks, args.float_depthwise)
+    prepared = prepare_quantization(model, example_inputs, qconfig_mapping, args.backend)
+    num_images = calibrate(prepared, valid_data_loader, args.calibration_batches, model)
+    logger.info('Calibrated observers on {} images'.format(num_images))
+    quantized = convert_quantization(prepared)
+
+    rows = quantization_report(model, quantized, valid_data_loader, metrics, example_inputs, segmentation,
+                               args.eval_batches, args.warmup, args.repeats)
+    logger.info('Backend {}, latency of input {} on {} threads\n{}'.format(
+        args.backend, tuple(data.shape), torch.get_num_threads(), quantization_table(rows)))
+
+    output = args.output if args.output is not None else str(config.log_dir / 'quantization.json')
+    with open(output, 'w') as handle:
+        json.dump(rows, handle, indent=4)
+    logger.info('Saved report to {}'.format(output))
+
+    save_path = args.save if args.save is not None else str(config.save_dir / 'student_int8.pt')
+    torch.jit.save(trace_quantized(quantized, example_inputs), save_path)
+    logger.info('Saved int8 student to {}'.format(save_path))
+
+
+if __name__ == '__main__':
+    args = argparse.ArgumentParser(description='Post-training int8 quantization of a distilled student on CPU')
+    args.add_argument('-c', '--config', default=None, type=str,
+                      help='config file path (default: None)')
+    args.add_argument('-r', '--resume', default=None, type=str,
+                      help='path to latest checkpoint (default: None)')
+    args.add_argument('-d', '--device', default=None, type=str,
+                      help='indices of GPUs to enable (default: all)')
+    args.add_argument('--backend', default='x86', type=str, help='quantized engine, x86 or fbgemm')
+    args.add_argument('--calibration_batches', default=32, type=int,
+                      help='number of validation batches used to calibrate the observers')
+    args.add_argument('--eval_batches', default=None, type=int,
+                      help='number of validation batches evaluated (default: all)')
+    args.add_argument('--skip_blocks', default=[], nargs='+', type=str, help='names of blocks kept in float')
+    args.add_argument('--float_depthwise', action='store_true',
+                      help='keep the depthwise convolutions of replaced blocks in float')
+    args.add_argument('--resolution', default=None, nargs=2, type=int,
+                      help='height and width of the input timed (default: size of validation images)')
+    args.add_argument('--warmup', default=3, type=int, help='number of calls before measuring latency')
+    args.add_argument('--repeats', default=10, type=int, help='number of measured calls')
+    args.add_argument('--threads', default=None, type=int, help='number of cpu threads (default: torch default)')
+    args.add_argument('--output', default=None, type=str,
+                      help='path of json report (default: quantization.json in log dir)')
+    args.add_argument('--save', default=None, type=str,
+                      help='path of the TorchScript int8 student (default: student_int8.pt in save dir)')
+
+    # custom cli options to modify configuration from default values given in json file.
+    CustomArgs = collections.namedtuple('CustomArgs', 'flags type target')
+    options = [
+        CustomArgs(['--checkpoint'], type=str, target='trainer;resume_path'),
+    ]
+    config = ConfigParser.from_args(args, options)
+    main(config, args.parse_args())
@@ -0,0 +1,96 @@
+import argparse
+import asyncio
+import collections
+import numpy as np
+import torch
+import models as module_arch
+from parse_config import ConfigParser
+from utils.export import rebuild_student
+from utils.serving import SegmentationPredictor, MicroBatcher, InferenceServer, tune_intra_op_threads
+
+
+def build_predictor(config, args, logger):
+    if args.torchscript is not None:
+        model = torch.jit.load(args.torchscript, map_location=torch.device('cpu'))
+        logger.info('Loaded TorchScript student from {}'.format(args.torchscript))
+    else:
+        # the teacher's weights are part of the checkpoint, the snapshot doesn't have to be loaded
+        teacher = config.init_obj('teacher', module_arch)
+        checkpoint = torch.load(args.checkpoint, map_location=torch.device('cpu'))
+        model = rebuild_student(checkpoint, teacher.cpu())
+        logger.info('Rebuilt {} student of epoch {}'.format(type(model).__name__, checkpoint['epoch']))
+    tta = {'scales': args.tta_scales, 'crop_size': args.tta_crop_size} if args.tta_scales is not None else None
+    return SegmentationPredictor(model, tta, edge_input=args.edge_input)
+
+
+async def serve(batcher, args, logger):
+    server = InferenceServer(batcher, args.host, args.port)
+    await server.start()
+    logger.info('Serving on {}:{} with batches of up to {} images, {}ms budget, {} workers x {} threads'.format(
+        server.host, server.port, batcher.max_batch_size, args.max_delay_ms, batcher.num_workers,
+        batcher.intra_op_threads))
+    try:
+        while True:
+            await asyncio.sleep(args.stats_interval)
+            stats = batcher.stats()
+            if stats['requests']:
+                logger.info('{} requests in {} batches (mean size {:.2f}), latency ms p50 {:.1f} p99 {:.1f}'.format(
+                    stats['requests'], stats['batches'], stats['mean_batch_size'], stats['latency_ms']['p50'],
+                    stats['latency_ms']['p99']))
+                batcher.reset_stats()
+    finally:
+        await server.stop()
+
+
+def main(config, args):
+    logger = config.get_logger('serve')
+    if (args.checkpoint is None) == (args.torchscript is None):
+        raise ValueError('Give the student with exactly one of --checkpoint and --torchscript')
+    predictor = build_predictor(config, args, logger)
+
+    num_workers, threads = args.workers, args.threads
+    if args.tune_threads:
+        height, width = args.resolution
+        images = [np.random.randint(0, 256, (height, width, 3), dtype=np.uint8)] * args.max_batch_size
+        threads, num_workers = tune_intra_op_threads(predictor, images)
+    batcher = MicroBatcher(predictor, args.max_batch_size, args.max_delay_ms, num_workers, threads)
+    try:
+        asyncio.run(serve(batcher, args, logger))
+    except KeyboardInterrupt:
+        logger.info('Stopped')
+
+
+if __name__ == '__main__':
+    args = argparse.ArgumentParser(description='Serve a distilled segmentation student on CPU with micro-batching')
+    args.add_argument('-c', '--config', default=None, type=str,
+                      help='config file path (default: None)')
+    args.add_argument('-r', '--resume', default=None, type=str,
+                      help='path to latest checkpoint (default: None)')
+    args.add_argument('-d', '--device', default=None, type=str,
+                      help='indices of GPUs to enable (default: all)')
+    args.add_argument('--checkpoint', default=None, type=str, help='checkpoint of the student saved by the trainer')
+    args.add_argument('--torchscript', default=None, type=str, help='student exported by export.py or quantize.py')
+    args.add_argument('--edge_input', action='store_true',
+                      help='the TorchScript student takes the canny edges as second input (GSCNN)')
+    args.add_argument('--host', default='127.0.0.1', type=str)
+    args.add_argument('--port', default=8765, type=int)
+    args.add_argument('--max_batch_size', default=8, type=int)
+    args.add_argument('--max_delay_ms', default=10., type=float,
+                      help='time spent waiting for more requests before a batch is run')
+    args.add_argument('--workers', default=1, type=int, help='number of batches run concurrently')
+    args.add_argument('--threads', default=None, type=int,
+                      help='intra-op threads of each worker (default: cpus split between the workers)')
+    args.add_argument('--tune_threads', action='store_true',
+                      help='pick the threads and workers with the highest throughput on random images')
+    args.add_argument('--resolution', default=[1024, 2048], nargs=2, type=int,
+                      help='height and width of the images used by --tune_threads')
+    args.add_argument('--tta_scales', default=None, nargs='+', type=float,
+                      help='scales of sliding-window test time augmentation (default: disabled)')
+    args.add_argument('--tta_crop_size', default=512, type=int, help='window size of test time augmentation')
+    args.add_argument('--stats_interval', default=60., type=float, help='seconds between latency logs')
+
+    # custom cli options to modify configuration from default values given in json file.
+    CustomArgs = collections.namedtuple('CustomArgs', 'flags type target')
+    options = []
+    config = ConfigParser.from_args(args, options)
+    main(config, args.parse_args())
@@ -81,6 +81,9 @@ if __name__ == '__main__':
                       help='path to latest checkpoint (default: None)')
     args.add_argument('-d', '--device', default=None, type=str,
                       help='indices of GPUs to enable (default: all)')
+    args.add_argument('--dist_backend', default=None, type=str,
+                      help='backend of torch.distributed when launched with torchrun e.g. gloo, nccl '
+                           '(default: nccl on GPU, gloo otherwise)')
 
     # custom cli options to modify configuration from default values given in json file.
     CustomArgs = collections.namedtuple('CustomArgs', 'flags type target')
@@ -2,6 +2,7 @@ from .layerwise_trainer import LayerwiseTrainer
 from utils.optim.lr_scheduler import MyOneCycleLR, MyReduceLROnPlateau 
 from functools import reduce
 from utils import MetricTracker 
+import losses as module_loss
 import torch 
 
 class ClassificationTrainer(LayerwiseTrainer):
@@ -14,68 +15,105 @@ class ClassificationTrainer(LayerwiseTrainer):
                                            *[m.__name__ for m in self.metric_ftns],
                                            *['teacher_'+m.__name__ for m in self.metric_ftns], writer=self.writer)
         self.test_data_loader = test_data_loader
+        # fused supervised + kd + hint loss weighted by alpha, beta, gamma of weight scheduler, if it isn't set only
+        # kd loss is optimized
+        self.distillation_loss = None
+        if 'distillation_loss' in self.config.config:
+            self.distillation_loss = self.config.init_obj('distillation_loss', module_loss).to(self.device)
 
     def _train_epoch(self, epoch):
         self.prepare_train_epoch(epoch)
 
         self.model.train()
         self._clean_cache()
+        # replaced blocks are created with the default memory format
+        self.precision.apply_memory_format(self.model)
+
+        # synchronize replaces the local totals by the global ones, they mustn't be carried to the next epoch
+        self.train_metrics.reset()
+        self.train_teacher_metrics.reset()
+        self.step_timer.reset()
+        self.prefetcher.reset()
+        for batch_idx, (data, target) in enumerate(self.iterate_train(self.train_data_loader)):
+            with self.step_timer.phase('h2d'):
+                data, target = self.precision.to_device(data, self.device), target.to(self.device)
+
+            with self.step_timer.phase('forward'), self.precision.autocast():
+                output_st, output_tc = self.model(data)
+
+            with self.step_timer.phase('loss'):
+                if self.distillation_loss is not None:
+                    loss, components = self.distillation_loss(output_st, output_tc, target,
+                                                              self.model.student_hidden_outputs,
+                                                              self.model.teacher_hidden_outputs,
+                                                              self.weight_scheduler.alpha,
+                                                              self.weight_scheduler.beta,
+                                                              self.weight_scheduler.gamma)
+                    loss = loss / self.accumulation_steps
+                    supervised_loss, kd_loss, hint_loss = [components[name] / self.accumulation_steps
+                                                           for name in ('supervised_loss', 'kd_loss', 'hint_loss')]
+                    with torch.no_grad():
+                        teacher_loss = self.criterions[0](output_tc, target)  # for comparision
+                else:
+                    supervised_loss = self.criterions[0](output_st, target) / self.accumulation_steps
+                    kd_loss = self.criterions[1](output_st, output_tc) / self.accumulation_steps
+
+                    hint_loss = reduce(lambda acc, elem: acc + self.criterions[2](elem[0], elem[1]),
+                                       zip(self.model.student_hidden_outputs, self.model.teacher_hidden_outputs),
+                                       torch.tensor(0)) / self.accumulation_steps
+                    teacher_loss = self.criterions[0](output_tc, target)  # for comparision
+
+                    # Only use hint loss
+                    loss = kd_loss
+            with self.step_timer.phase('backward'):
+                loss.backward()
+
+            with self.step_timer.phase('optimizer'):
+                if (batch_idx + 1) % self.accumulation_steps == 0:
+                    self.optimizer.step()
+                    self.optimizer.zero_grad()
+
+            with self.step_timer.phase('metrics'):
+                self.writer.set_step((epoch - 1) * self.len_epoch + batch_idx)
+                # update metrics
+                self.train_metrics.update('loss', loss.item() * self.accumulation_steps)
+                self.train_metrics.update('supervised_loss', supervised_loss.item() * self.accumulation_steps)
+                self.train_metrics.update('kd_loss', kd_loss.item() * self.accumulation_steps)
+                self.train_metrics.update('hint_loss', hint_loss.item() * self.accumulation_steps)
+                self.train_metrics.update('teacher_loss', teacher_loss.item())
 
-        for batch_idx, (data, target) in enumerate(self.train_data_loader):
-            data, target = data.to(self.device), target.to(self.device)
-
-            output_st, output_tc = self.model(data)
-
-            supervised_loss = self.criterions[0](output_st, target) / self.accumulation_steps
-            kd_loss = self.criterions[1](output_st, output_tc) / self.accumulation_steps
-
-            hint_loss = reduce(lambda acc, elem: acc + self.criterions[2](elem[0], elem[1]),
-                               zip(self.model.student_hidden_outputs, self.model.teacher_hidden_outputs),
-                               torch.tensor(0)) / self.accumulation_steps
-            teacher_loss = self.criterions[0](output_tc, target)  # for comparision
-
-            # Only use hint loss
-            loss = kd_loss
-            loss.backward()
-            
-            if (batch_idx + 1) % self.accumulation_steps == 0:
-                self.optimizer.step()
-                self.optimizer.zero_grad()
-
-            self.writer.set_step((epoch - 1) * self.len_epoch + batch_idx)
-            # update metrics
-            self.train_metrics.update('loss', loss.item() * self.accumulation_steps)
-            self.train_metrics.update('supervised_loss', supervised_loss.item() * self.accumulation_steps)
-            self.train_metrics.update('kd_loss', kd_loss.item() * self.accumulation_steps)
-            self.train_metrics.update('hint_loss', hint_loss.item() * self.accumulation_steps)
-            self.train_metrics.update('teacher_loss', teacher_loss.item())
-
-            for met in self.metric_ftns:
-                self.train_metrics.update(met.__name__, met(output_st, target), data.shape[0])
+                for met in self.metric_ftns:
+                    self.train_metrics.update(met.__name__, met(output_st, target), data.shape[0])
 
-            for met in self.metric_ftns:
-                self.train_teacher_metrics.update(met.__name__, met(output_tc, target), data.shape[0])
+                for met in self.metric_ftns:
+                    self.train_teacher_metrics.update(met.__name__, met(output_tc, target), data.shape[0])
 
             if batch_idx % self.log_step == 0:
-                # self.writer.add_image('input', make_grid(data.cpu(), nrow=8, normalize=True))
-                self.logger.info(
-                    'Train Epoch: {} [{}]/[{}] acc: {:.6f} teacher_acc: {:.6f} Loss: {:.6f} Supervised Loss: {:.6f} '
-                    'Knowledge Distillation loss: {:.6f} Hint Loss: {:.6f} Teacher Loss: {:.6f}'.format(
-                        epoch,
-                        batch_idx,
-                        self.len_epoch,
-                        self.train_metrics.avg('accuracy'),
-                        self.train_teacher_metrics.avg('accuracy'),
-                        self.train_metrics.avg('loss'),
-                        self.train_metrics.avg('supervised_loss'),
-                        self.train_metrics.avg('kd_loss'),
-                        self.train_metrics.avg('hint_loss'),
-                        self.train_metrics.avg('teacher_loss'),
-                    ))
+                with self.step_timer.phase('logging'):
+                    # self.writer.add_image('input', make_grid(data.cpu(), nrow=8, normalize=True))
+                    self.logger.info(
+                        'Train Epoch: {} [{}]/[{}] acc: {:.6f} teacher_acc: {:.6f} Loss: {:.6f} Supervised Loss: '
+                        '{:.6f} Knowledge Distillation loss: {:.6f} Hint Loss: {:.6f} Teacher Loss: {:.6f}'.format(
+                            epoch,
+                            batch_idx,
+                            self.len_epoch,
+                            self.train_metrics.avg('accuracy'),
+                            self.train_teacher_metrics.avg('accuracy'),
+                            self.train_metrics.avg('loss'),
+                            self.train_metrics.avg('supervised_loss'),
+                            self.train_metrics.avg('kd_loss'),
+                            self.train_metrics.avg('hint_loss'),
+                            self.train_metrics.avg('teacher_loss'),
+                        ))
+                self.step_timer.emit(self.writer, self.logger)
+                self.prefetcher.emit(self.writer, self.logger)
 
             if batch_idx == self.len_epoch:
                 break
 
+        # reduce the metrics over the ranks of a distributed run
+        self.train_metrics.synchronize()
+        self.train_teacher_metrics.synchronize()
         log = self.train_metrics.result()
 
         if self.do_validation and ((epoch % self.do_validation_interval) == 0):
@@ -105,8 +143,9 @@ class ClassificationTrainer(LayerwiseTrainer):
         self.valid_metrics.reset()
         with torch.no_grad():
             for batch_idx, (data, target) in enumerate(self.valid_data_loader):
-                data, target = data.to(self.device), target.to(self.device)
-                output, output_tc = self.model(data)
+                data, target = self.precision.to_device(data, self.device), target.to(self.device)
+                with self.precision.autocast():
+                    output, output_tc = self.model(data)
                 
                 self.writer.set_step((epoch - 1) * len(self.valid_data_loader) + batch_idx, 'valid')
                 for met in self.metric_ftns:
@@ -114,4 +153,6 @@ class ClassificationTrainer(LayerwiseTrainer):
                 for met in self.metric_ftns:
                     self.valid_metrics.update('teacher_'+met.__name__, met(output_tc, target), data.shape[0])
 
+        # reduce the metrics over the ranks of a distributed run
+        self.valid_metrics.synchronize()
         return self.valid_metrics.result()
\ No newline at end of file
@@ -1,8 +1,12 @@
 from .classification_trainer import ClassificationTrainer
 from utils.optim.lr_scheduler import MyOneCycleLR, MyReduceLROnPlateau
 from functools import reduce
-from utils import MetricTracker
+from utils import MetricTracker, inf_loop
 from models import forgiving_state_restore
+from models.students import StackedEnsemble
+from losses import EnsembleKLDivergenceLoss
+from data_loader.soft_targets import SeededAugmentation, SoftTargetStore
+from torch.utils.data import DataLoader
 from torch import nn
 import torch
 import copy
@@ -22,6 +26,12 @@ class EnsembleTrainer(ClassificationTrainer):
             raise ValueError("Cannot find path to checkpoints, please specify them by adding 'resume_paths' in config.trainer")
         self.models = []
         self.resume_ensemble(self.config['trainer']['resume_paths'])
+        # evaluate all ensemble members in one batched call
+        self.ensemble = StackedEnsemble(self.models, self.config['trainer'].get('stacked_ensemble', True))
+        # stream precomputed soft targets of teacher and ensemble instead of evaluating them at every step
+        self.soft_target_dataset = None
+        if 'soft_target_store' in self.config['trainer']:
+            self.setup_soft_target_store(train_data_loader, self.config['trainer']['soft_target_store'])
 
     def resume_ensemble(self, checkpoint_paths):
         for i, checkpoint_path in enumerate(checkpoint_paths):
@@ -39,17 +49,74 @@ class EnsembleTrainer(ClassificationTrainer):
             forgiving_state_restore(self.model, checkpoint['state_dict'])
             self.logger.info("Loaded state dict for model {}".format(i))
             # store the pretrained student model
-            self.models.append(copy.deepcopy(self.model.student))
+            self.models.append(self.model.copy_student())
             # reset the network to default settings
             self.model.reset()
 
         self.logger.info('loaded state dict for all models')
 
+    def setup_soft_target_store(self, train_data_loader, store_config):
+        """
+        Run teacher and ensemble models once per (sample, augmentation seed), store their averaged soft targets and
+        replace the train data loader by one that returns (data, target, soft_target)
+        :param train_data_loader: BaseDataLoader - train data loader whose dataset would be wrapped
+        :param store_config: dictionary with following format:
+            {'path': 'saved/soft_targets.npy', 'num_seeds': 4}
+        """
+        if not isinstance(self.criterions[1], EnsembleKLDivergenceLoss):
+            raise ValueError("Precomputed soft targets are probabilities, please use EnsembleKLDivergenceLoss as "
+                             "kd_loss when 'soft_target_store' is set in config.trainer")
+        dataset = train_data_loader.dataset
+        store = SoftTargetStore(store_config['path'], store_config['num_seeds'], len(dataset))
+        if store.exists():
+            self.logger.info('Loading precomputed soft targets from: {}'.format(store.path))
+        else:
+            self.precompute_soft_targets(SeededAugmentation(dataset, store.num_seeds), store,
+                                         train_data_loader.init_kwargs)
+
+        self.soft_target_dataset = SeededAugmentation(dataset, store.num_seeds, store)
+        loader_kwargs = dict(train_data_loader.init_kwargs, dataset=self.soft_target_dataset)
+        # persistent workers would keep a copy of the dataset with the seed of the first epoch
+        loader_kwargs.pop('persistent_workers', None)
+        # shuffle is only set when DataLoader built the sampler itself, it is mutually exclusive with passing it
+        sampler = None if loader_kwargs['shuffle'] else train_data_loader.sampler
+        soft_target_loader = DataLoader(sampler=sampler, **loader_kwargs)
+        if "len_epoch" in self.config['trainer']:
+            # the seed of the wrapped dataset is changed every epoch, workers mustn't keep a stale copy
+            self.train_data_loader = inf_loop(soft_target_loader, keep_workers=False)
+        else:
+            self.train_data_loader = soft_target_loader
+
+    def precompute_soft_targets(self, dataset, store, loader_kwargs):
+        """
+        :param dataset: SeededAugmentation - dataset without soft targets
+        :param store: SoftTargetStore - file that soft targets would be written to
+        :param loader_kwargs: dict - arguments of train data loader i.e. batch_size, num_workers,...
+        """
+        self.logger.info('Precomputing soft targets for {} seeds to: {} ...'.format(store.num_seeds, store.path))
+        self.model.teacher.eval()
+        for model in self.models:
+            model.eval()
+        loader = DataLoader(dataset, batch_size=loader_kwargs['batch_size'], shuffle=False,
+                            num_workers=loader_kwargs['num_workers'])
+        with torch.no_grad():
+            for seed in range(store.num_seeds):
+                dataset.set_epoch(seed + 1)
+                start = 0
+                for data, _ in loader:
+                    data = data.to(self.device)
+                    _, soft_targets = self.ensemble.soft_targets(data, TEMPERATURE, WEIGHT, self.model.teacher(data))
+                    if seed == 0 and start == 0:
+                        store.create(soft_targets.shape[1:])
+                    store.write(seed, slice(start, start + data.shape[0]), soft_targets)
+                    start += data.shape[0]
+                self.logger.info('Precomputed soft targets of seed {}'.format(seed))
+        store.close()
+
     def prepare_models(self, epoch):
         # freeze the teacher and unfreeze student
         self.logger.debug('Freeze teacher and Unfreeze student networks')
-        for param in self.model.student.parameters():
-            param.requires_grad = True 
+        self.model.unfreeze_student()
         for param in self.model.teacher.parameters():
             param.requires_grad = False 
         for model in self.models:
@@ -67,59 +134,82 @@ class EnsembleTrainer(ClassificationTrainer):
     def _train_epoch(self, epoch):
         self.prepare_models(epoch)
         self.train_metrics.reset()
+        self.train_teacher_metrics.reset()
         self._clean_cache()
+        self.step_timer.reset()
+        self.prefetcher.reset()
+        if self.soft_target_dataset is not None:
+            self.soft_target_dataset.set_epoch(epoch)
+
+        for batch_idx, batch in enumerate(self.iterate_train(self.train_data_loader)):
+            with self.step_timer.phase('h2d'):
+                data, target = self.precision.to_device(batch[0], self.device), batch[1].to(self.device)
 
-        for batch_idx, (data, target) in enumerate(self.train_data_loader):
-            data, target = data.to(self.device), target.to(self.device)
+            with self.step_timer.phase('forward'), self.precision.autocast():
+                if self.soft_target_dataset is None:
+                    output_st, output_tc = self.model(data)
+                    outputs = self.ensemble(data).unbind(0)
+                else:
+                    # teacher and ensemble models were evaluated offline, only the student is run
+                    output_st, output_tc = self.model.inference(data), None
 
-            output_st, output_tc = self.model(data)
-            with torch.no_grad():
-                outputs = []
-                for model in self.models:
-                    outputs += [model(data)]
-            supervised_loss = self.criterions[0](output_st, target) / self.accumulation_steps
-            kd_loss = reduce(lambda acc, elem: acc + WEIGHT*self.criterions[1](output_st, elem), outputs, 0) 
-            kd_loss += self.criterions[1](output_st, output_tc)
-            kd_loss = kd_loss/ (WEIGHT*len(outputs)+1) / (self.accumulation_steps)
-            # Only use hint loss
-            loss = kd_loss+supervised_loss
-            loss.backward()
+            with self.step_timer.phase('loss'):
+                if self.soft_target_dataset is None:
+                    kd_loss = reduce(lambda acc, elem: acc + WEIGHT*self.criterions[1](output_st, elem), outputs, 0) 
+                    kd_loss += self.criterions[1](output_st, output_tc)
+                    kd_loss = kd_loss/ (WEIGHT*len(outputs)+1) / (self.accumulation_steps)
+                else:
+                    kd_loss = self.criterions[1](output_st, batch[2].to(self.device)) / self.accumulation_steps
+                supervised_loss = self.criterions[0](output_st, target) / self.accumulation_steps
+                # Only use hint loss
+                loss = kd_loss+supervised_loss
+            with self.step_timer.phase('backward'):
+                loss.backward()
 
-            if (batch_idx + 1) % self.accumulation_steps == 0:
-                self.optimizer.step()
-                self.optimizer.zero_grad()
+            with self.step_timer.phase('optimizer'):
+                if (batch_idx + 1) % self.accumulation_steps == 0:
+                    self.optimizer.step()
+                    self.optimizer.zero_grad()
 
-            self.writer.set_step((epoch - 1) * self.len_epoch + batch_idx)
+            with self.step_timer.phase('metrics'):
+                self.writer.set_step((epoch - 1) * self.len_epoch + batch_idx)
 
-            # update metrics
-            self.train_metrics.update('loss', loss.item() * self.accumulation_steps)
-            self.train_metrics.update('supervised_loss', supervised_loss.item() * self.accumulation_steps)
-            self.train_metrics.update('kd_loss', kd_loss.item() * self.accumulation_steps)
+                # update metrics
+                self.train_metrics.update('loss', loss.item() * self.accumulation_steps)
+                self.train_metrics.update('supervised_loss', supervised_loss.item() * self.accumulation_steps)
+                self.train_metrics.update('kd_loss', kd_loss.item() * self.accumulation_steps)
 
-            for met in self.metric_ftns:
-                self.train_metrics.update(met.__name__, met(output_st, target))
+                for met in self.metric_ftns:
+                    self.train_metrics.update(met.__name__, met(output_st, target))
 
-            for met in self.metric_ftns:
-                self.train_teacher_metrics.update(met.__name__, met(output_tc, target))
+                if output_tc is not None:
+                    for met in self.metric_ftns:
+                        self.train_teacher_metrics.update(met.__name__, met(output_tc, target))
 
             if batch_idx % self.log_step == 0:
-                # self.writer.add_image('input', make_grid(data.cpu(), nrow=8, normalize=True))
-                self.logger.info(
-                    'Train Epoch: {} [{}]/[{}] acc: {:.6f} teacher_acc: {:.6f} Loss: {:.6f} Supervised Loss: {:.6f} '
-                    'Knowledge Distillation loss: {:.6f}'.format(
-                        epoch,
-                        batch_idx,
-                        self.len_epoch,
-                        self.train_metrics.avg('accuracy'),
-                        self.train_teacher_metrics.avg('accuracy'),
-                        self.train_metrics.avg('loss'),
-                        self.train_metrics.avg('supervised_loss'),
-                        self.train_metrics.avg('kd_loss'),
-                    ))
+                with self.step_timer.phase('logging'):
+                    # self.writer.add_image('input', make_grid(data.cpu(), nrow=8, normalize=True))
+                    self.logger.info(
+                        'Train Epoch: {} [{}]/[{}] acc: {:.6f} teacher_acc: {:.6f} Loss: {:.6f} Supervised Loss: '
+                        '{:.6f} Knowledge Distillation loss: {:.6f}'.format(
+                            epoch,
+                            batch_idx,
+                            self.len_epoch,
+                            self.train_metrics.avg('accuracy'),
+                            self.train_teacher_metrics.avg('accuracy'),
+                            self.train_metrics.avg('loss'),
+                            self.train_metrics.avg('supervised_loss'),
+                            self.train_metrics.avg('kd_loss'),
+                        ))
+                self.step_timer.emit(self.writer, self.logger)
+                self.prefetcher.emit(self.writer, self.logger)
 
             if batch_idx == self.len_epoch:
                 break
 
+        # reduce the metrics over the ranks of a distributed run
+        self.train_metrics.synchronize()
+        self.train_teacher_metrics.synchronize()
         log = self.train_metrics.result()
 
         if self.do_validation and ((epoch % self.do_validation_interval) == 0):
@@ -151,16 +241,11 @@ class EnsembleTrainer(ClassificationTrainer):
         """
         # classification
         # TODO: Only compatible with classification
-        softmax = nn.Softmax(dim=1)
         with torch.no_grad():
             # predict of teacher network
-            output = softmax(self.model.teacher(data)/TEMPERATURE)
-            # enhance the teacher prediction with student networks
-            for model in self.models:
-                tmp = softmax(model(data)/TEMPERATURE)
-                output = output + weight*tmp
-            # normalize 
-            output = output/(1+len(self.models)*weight)
+            output_tc = self.model.teacher(data)
+            # enhance the teacher prediction with student networks, all members are evaluated in one call
+            _, output = self.ensemble.soft_targets(data, TEMPERATURE, weight, output_tc)
         return output 
 
     def _valid_epoch(self, epoch):
@@ -174,13 +259,16 @@ class EnsembleTrainer(ClassificationTrainer):
         self.valid_metrics.reset()
         with torch.no_grad():
             for batch_idx, (data, target) in enumerate(self.valid_data_loader):
-                data, target = data.to(self.device), target.to(self.device)
-                output, _ = self.model(data)
+                data, target = self.precision.to_device(data, self.device), target.to(self.device)
+                with self.precision.autocast():
+                    output, _ = self.model(data)
 
                 self.writer.set_step((epoch - 1) * len(self.valid_data_loader) + batch_idx, 'valid')
                 for met in self.metric_ftns:
                     self.valid_metrics.update(met.__name__, met(output, target))
 
+        # reduce the metrics over the ranks of a distributed run
+        self.valid_metrics.synchronize()
         return self.valid_metrics.result()
 
     def _test_epoch(self, epoch):
@@ -196,10 +284,13 @@ class EnsembleTrainer(ClassificationTrainer):
         
         with torch.no_grad():
             for batch_idx, (data, target) in enumerate(self.valid_data_loader):
-                data, target = data.to(self.device), target.to(self.device)
-                output = self.ensemble_predict(data)
+                data, target = self.precision.to_device(data, self.device), target.to(self.device)
+                with self.precision.autocast():
+                    output = self.ensemble_predict(data)
                 # Update Metrics
                 for met in self.metric_ftns:
                     self.test_metrics.update(met.__name__, met(output, target), data.shape[0])
 
+        # reduce the metrics over the ranks of a distributed run
+        self.test_metrics.synchronize()
         return self.test_metrics.result()
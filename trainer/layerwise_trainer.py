@@ -9,6 +9,7 @@ from models import forgiving_state_restore
 from base import BaseTrainer
 from utils import stat_cuda
 from torch import nn
+from torch.autograd.profiler import record_function
 import numpy as np
 import os
 import gc
@@ -31,6 +32,8 @@ class LayerwiseTrainer(BaseTrainer):
         self.lr_scheduler = lr_scheduler
         self.weight_scheduler = weight_scheduler
         self.log_step = config['trainer']['log_step']
+        # stop forward of teacher and student after the deepest hint block except at log steps
+        self.hint_only_forward = config['trainer'].get('hint_only_forward', False)
         if "len_epoch" in self.config['trainer']:
             # iteration-based training
             self.train_data_loader = inf_loop(train_data_loader)
@@ -65,6 +68,25 @@ class LayerwiseTrainer(BaseTrainer):
             self.criterions = nn.DataParallel(self.criterions)
         del self.criterion
 
+        # Run teacher and student as compiled graphs, e.g. "compile": true or "compile": {"mode": "max-autotune"}
+        if self.config['trainer'].get('compile', False):
+            compile_args = self.config['trainer']['compile']
+            self.model.enable_compile([hint['name'] for hint in self.config['pruning']['hint']],
+                                      **(compile_args if isinstance(compile_args, dict) else {}))
+        # trade compute for memory, e.g. "checkpoint_blocks": ["mod5", "mod6", "mod7"] recomputes the activations of
+        # those stages in backward and "no_grad_frozen": true runs the frozen prefix of the student without autograd
+        if self.config['trainer'].get('checkpoint_blocks'):
+            self.model.enable_checkpointing(self.config['trainer']['checkpoint_blocks'])
+        if self.config['trainer'].get('no_grad_frozen', False):
+            self.model.enable_no_grad_frozen()
+        # compute the frozen blocks common to teacher and student once per step
+        if self.config['trainer'].get('share_frozen_prefix', False):
+            self.model.enable_prefix_sharing()
+        # quantization-aware distillation, e.g. "qat": {"backend": "x86", "student_epoch": 20}
+        if self.config['trainer'].get('qat') is not None and self.precision.enabled:
+            raise ValueError('trainer.qat simulates int8 in fp32, it can not be used with trainer.precision {}'.format(
+                self.precision))
+
         # Resume checkpoint if path is available in config
         if 'resume_path' in self.config['trainer']: 
             self.resume(self.config['trainer']['resume_path'])
@@ -83,6 +105,11 @@ class LayerwiseTrainer(BaseTrainer):
             config = self.config 
         # reset_scheduler
         self.reset_scheduler()
+        # fake quantization of the replaced blocks is extended to the whole student from qat.student_epoch
+        qat = config['trainer'].get('qat')
+        if qat is not None and epoch == qat.get('student_epoch'):
+            self.logger.info('Inserting fake quantization into the whole student')
+            self.model.enable_qat(None, qat.get('backend', 'x86'))
         # there isn't any layer that would be replaced or unfreeze or set as hint then unfreeze 
         # the whole network
         if (epoch == 1) and ((len(config['pruning']['pruning_plan'])+
@@ -90,8 +117,7 @@ class LayerwiseTrainer(BaseTrainer):
                               len(config['pruning']['unfreeze'])) == 0):
             self.logger.debug('Train a student with identical architecture with teacher')
             # unfreeze 
-            for param in self.model.student.parameters():
-                param.requires_grad = True
+            self.model.unfreeze_student()
             # debug
             self.logger.info(self.model.dump_trainable_params())
             # create optimizer for the network 
@@ -137,9 +163,14 @@ class LayerwiseTrainer(BaseTrainer):
             self.logger.warning('Using deprecate checkpoint...')
             kwargs = config['pruning']['pruner']
 
-        self.model.replace(replaced_layers, **kwargs)  # replace those layers with depthwise separable conv
-        self.model.register_hint_layers(hint_layers)  # assign which layers output would be used as hint loss
-        self.model.unfreeze(unfreeze_layers)  # unfreeze chosen layers
+        with record_function('replace_blocks'):
+            self.model.replace(replaced_layers, **kwargs)  # replace those layers with depthwise separable conv
+            if qat is not None:
+                self.model.enable_qat([layer['name'] for layer in replaced_layers], qat.get('backend', 'x86'))
+        with record_function('register_hint_layers'):
+            self.model.register_hint_layers(hint_layers)  # assign which layers output would be used as hint loss
+        with record_function('unfreeze_blocks'):
+            self.model.unfreeze(unfreeze_layers)  # unfreeze chosen layers
 
         if epoch == 1:
             self.create_new_optimizer() # create new optimizer to remove the effect of momentum
@@ -216,67 +247,91 @@ class LayerwiseTrainer(BaseTrainer):
         self.train_iou_metrics.reset()
         self.train_teacher_iou_metrics.reset()
         self._clean_cache()
-
-        for batch_idx, (data, target) in enumerate(self.train_data_loader):
-            data, target = data.to(self.device), target.to(self.device)
-
-            output_st, output_tc = self.model(data)
-
-            supervised_loss = self.criterions[0](output_st, target) / self.accumulation_steps
-            kd_loss = self.criterions[1](output_st, output_tc) / self.accumulation_steps
-            teacher_loss = self.criterions[0](output_tc, target)  # for comparision
-
-            hint_loss = reduce(lambda acc, elem: acc + self.criterions[2](elem[0], elem[1]),
-                               zip(self.model.student_hidden_outputs, self.model.teacher_hidden_outputs),
-                               0) / self.accumulation_steps
+        # replaced blocks are created with the default memory format
+        self.precision.apply_memory_format(self.model)
+
+        self.step_timer.reset()
+        self.prefetcher.reset()
+        for batch_idx, (data, target) in enumerate(self.iterate_train(self.train_data_loader)):
+            with self.step_timer.phase('h2d'):
+                data, target = self.precision.to_device(data, self.device), target.to(self.device)
+
+            # only hint loss is optimized, the diagnostic losses and metrics need the full forward of both networks
+            # which is only run at log steps if hint_only_forward is set
+            full_forward = (not self.hint_only_forward) or (batch_idx % self.log_step == 0)
+            with self.step_timer.phase('forward'), self.precision.autocast():
+                if full_forward:
+                    output_st, output_tc = self.model(data)
+                else:
+                    self.model.forward_hints(data)
+
+            with self.step_timer.phase('loss'):
+                hint_loss = reduce(lambda acc, elem: acc + self.criterions[2](elem[0], elem[1]),
+                                   zip(self.model.student_hidden_outputs, self.model.teacher_hidden_outputs),
+                                   0) / self.accumulation_steps
 
             # Only use hint loss
             loss = hint_loss
-            loss.backward()
-
-            if batch_idx % self.accumulation_steps == 0:
-                self.optimizer.step()
-                self.optimizer.zero_grad()
-
-            self.writer.set_step((epoch - 1) * self.len_epoch + batch_idx)
-
-            # update metrics
-            self.train_metrics.update('loss', loss.item() * self.accumulation_steps)
-            self.train_metrics.update('supervised_loss', supervised_loss.item() * self.accumulation_steps)
-            self.train_metrics.update('kd_loss', kd_loss.item() * self.accumulation_steps)
-            self.train_metrics.update('hint_loss', hint_loss.item() * self.accumulation_steps)
-            self.train_metrics.update('teacher_loss', teacher_loss.item())
-            self.train_iou_metrics.update(output_st.detach().cpu(), target.cpu())
-            self.train_teacher_iou_metrics.update(output_tc.cpu(), target.cpu())
-
-            for met in self.metric_ftns:
-                self.train_metrics.update(met.__name__, met(output_st, target))
+            with self.step_timer.phase('backward'):
+                loss.backward()
+
+            with self.step_timer.phase('optimizer'):
+                if batch_idx % self.accumulation_steps == 0:
+                    self.optimizer.step()
+                    self.optimizer.zero_grad()
+
+            with self.step_timer.phase('metrics'):
+                self.writer.set_step((epoch - 1) * self.len_epoch + batch_idx)
+
+                # update metrics
+                self.train_metrics.update('loss', loss.item() * self.accumulation_steps)
+                self.train_metrics.update('hint_loss', hint_loss.item() * self.accumulation_steps)
+                if full_forward:
+                    with torch.no_grad():
+                        supervised_loss = self.criterions[0](output_st, target)
+                        kd_loss = self.criterions[1](output_st, output_tc)
+                        teacher_loss = self.criterions[0](output_tc, target)  # for comparision
+                    self.train_metrics.update('supervised_loss', supervised_loss.item())
+                    self.train_metrics.update('kd_loss', kd_loss.item())
+                    self.train_metrics.update('teacher_loss', teacher_loss.item())
+                    self.train_iou_metrics.update(output_st.detach().cpu(), target.cpu())
+                    self.train_teacher_iou_metrics.update(output_tc.cpu(), target.cpu())
+
+                    for met in self.metric_ftns:
+                        self.train_metrics.update(met.__name__, met(output_st, target))
 
             if batch_idx % self.log_step == 0:
-                # self.writer.add_image('input', make_grid(data.cpu(), nrow=8, normalize=True))
-                # st_masks = visualize.viz_pred_cityscapes(output_st)
-                # tc_masks = visualize.viz_pred_cityscapes(output_tc)
-                # self.writer.add_image('st_pred', make_grid(st_masks, nrow=8, normalize=False))
-                # self.writer.add_image('tc_pred', make_grid(tc_masks, nrow=8, normalize=False))
-                self.logger.info(
-                    'Train Epoch: {} [{}]/[{}] Loss: {:.6f} mIoU: {:.6f} Teacher mIoU: {:.6f} Supervised Loss: {:.6f} '
-                    'Knowledge Distillation loss: '
-                    '{:.6f} Hint Loss: {:.6f} Teacher Loss: {:.6f}'.format(
-                        epoch,
-                        batch_idx,
-                        self.len_epoch,
-                        self.train_metrics.avg('loss'),
-                        self.train_iou_metrics.get_iou(),
-                        self.train_teacher_iou_metrics.get_iou(),
-                        self.train_metrics.avg('supervised_loss'),
-                        self.train_metrics.avg('kd_loss'),
-                        self.train_metrics.avg('hint_loss'),
-                        self.train_metrics.avg('teacher_loss'),
-                    ))
+                with self.step_timer.phase('logging'):
+                    # self.writer.add_image('input', make_grid(data.cpu(), nrow=8, normalize=True))
+                    # st_masks = visualize.viz_pred_cityscapes(output_st)
+                    # tc_masks = visualize.viz_pred_cityscapes(output_tc)
+                    # self.writer.add_image('st_pred', make_grid(st_masks, nrow=8, normalize=False))
+                    # self.writer.add_image('tc_pred', make_grid(tc_masks, nrow=8, normalize=False))
+                    self.logger.info(
+                        'Train Epoch: {} [{}]/[{}] Loss: {:.6f} mIoU: {:.6f} Teacher mIoU: {:.6f} Supervised Loss: '
+                        '{:.6f} Knowledge Distillation loss: '
+                        '{:.6f} Hint Loss: {:.6f} Teacher Loss: {:.6f}'.format(
+                            epoch,
+                            batch_idx,
+                            self.len_epoch,
+                            self.train_metrics.avg('loss'),
+                            self.train_iou_metrics.get_iou(),
+                            self.train_teacher_iou_metrics.get_iou(),
+                            self.train_metrics.avg('supervised_loss'),
+                            self.train_metrics.avg('kd_loss'),
+                            self.train_metrics.avg('hint_loss'),
+                            self.train_metrics.avg('teacher_loss'),
+                        ))
+                self.step_timer.emit(self.writer, self.logger)
+                self.prefetcher.emit(self.writer, self.logger)
 
             if batch_idx == self.len_epoch:
                 break
 
+        # reduce the metrics over the ranks of a distributed run
+        self.train_metrics.synchronize()
+        self.train_iou_metrics.synchronize()
+        self.train_teacher_iou_metrics.synchronize()
         log = self.train_metrics.result()
         log.update({'train_teacher_mIoU': self.train_teacher_iou_metrics.get_iou()})
         log.update({'train_student_mIoU': self.train_iou_metrics.get_iou()})
@@ -322,8 +377,9 @@ class LayerwiseTrainer(BaseTrainer):
         self.valid_iou_metrics.reset()
         with torch.no_grad():
             for batch_idx, (data, target) in enumerate(self.valid_data_loader):
-                data, target = data.to(self.device), target.to(self.device)
-                output = self.model.inference(data)
+                data, target = self.precision.to_device(data, self.device), target.to(self.device)
+                with self.precision.autocast():
+                    output = self.model.inference(data)
                 supervised_loss = self.criterions[0](output, target)
                 self.writer.set_step((epoch - 1) * len(self.valid_data_loader) + batch_idx, 'valid')
                 self.valid_metrics.update('supervised_loss', supervised_loss.item())
@@ -332,6 +388,9 @@ class LayerwiseTrainer(BaseTrainer):
 
                 for met in self.metric_ftns:
                     self.valid_metrics.update(met.__name__, met(output, target))
+        # reduce the metrics over the ranks of a distributed run
+        self.valid_metrics.synchronize()
+        self.valid_iou_metrics.synchronize()
         result = self.valid_metrics.result()
         result['mIoU'] = self.valid_iou_metrics.get_iou()
 
@@ -370,6 +429,9 @@ class LayerwiseTrainer(BaseTrainer):
                 for met in self.metric_ftns:
                     self.test_metrics.update(met.__name__, met(output, target))
         
+        # reduce the metrics over the ranks of a distributed run
+        self.test_metrics.synchronize()
+        self.test_iou_metrics.synchronize()
         result = self.test_metrics.result()
         result['mIoU'] = self.test_iou_metrics.get_iou()
 
@@ -8,7 +8,9 @@ from models.students import DepthwiseStudent
 from models import forgiving_state_restore
 from base import BaseTrainer
 from utils import stat_cuda
+from utils import is_main_process
 from torch import nn
+from torch.autograd.profiler import record_function
 import numpy as np
 import os
 import gc
@@ -114,7 +116,8 @@ class TaylorPruneTrainer(BaseTrainer):
             self.logger.warning('Using deprecate checkpoint...')
             kwargs = config['pruning']['pruner']
 
-        self.model.replace(replaced_layers, **kwargs)  # replace those layers with depthwise separable conv
+        with record_function('replace_blocks'):
+            self.model.replace(replaced_layers, **kwargs)  # replace those layers with depthwise separable conv
         # initialize importance vector for layer
         self.importance_tracker.update_importance_list(self.model.added_gates)
 
@@ -193,62 +196,74 @@ class TaylorPruneTrainer(BaseTrainer):
         self.train_teacher_iou_metrics.reset()
         self._clean_cache()
 
-        for batch_idx, (data, target) in enumerate(self.train_data_loader):
-            data, target = data.to(self.device), target.to(self.device)
+        self.step_timer.reset()
+        self.prefetcher.reset()
+        for batch_idx, (data, target) in enumerate(self.iterate_train(self.train_data_loader)):
+            with self.step_timer.phase('h2d'):
+                data, target = data.to(self.device), target.to(self.device)
 
-            output_st, output_tc = self.model(data)
+            with self.step_timer.phase('forward'):
+                output_st, output_tc = self.model(data)
 
-            # do not divide accumulation_steps to keep value of gradient
-            supervised_loss = self.criterions[0](output_st, target)
-            teacher_loss = self.criterions[0](output_tc, target)  # for comparision
+            with self.step_timer.phase('loss'):
+                # do not divide accumulation_steps to keep value of gradient
+                supervised_loss = self.criterions[0](output_st, target)
+                teacher_loss = self.criterions[0](output_tc, target)  # for comparision
 
             # Only use supervised loss
             loss = supervised_loss
-            loss.backward()
+            with self.step_timer.phase('backward'):
+                loss.backward()
 
-            # Update tracker to track importance of filter in layer
-            importance_dict = self.model.get_gate_importance()
-            self.importance_tracker.update(importance_dict)
+            with self.step_timer.phase('importance'):
+                # Update tracker to track importance of filter in layer
+                importance_dict = self.model.get_gate_importance()
+                self.importance_tracker.update(importance_dict)
 
-            if batch_idx % self.accumulation_steps == 0:
-                self.optimizer.step()
-                self.optimizer.zero_grad()
+            with self.step_timer.phase('optimizer'):
+                if batch_idx % self.accumulation_steps == 0:
+                    self.optimizer.step()
+                    self.optimizer.zero_grad()
 
-            self.writer.set_step((epoch - 1) * self.len_epoch + batch_idx)
+            with self.step_timer.phase('metrics'):
+                self.writer.set_step((epoch - 1) * self.len_epoch + batch_idx)
 
-            # update metrics
-            self.train_metrics.update('loss', loss.item() * self.accumulation_steps)
-            self.train_metrics.update('supervised_loss', supervised_loss.item() * self.accumulation_steps)
-            self.train_metrics.update('teacher_loss', teacher_loss.item())
-            self.train_iou_metrics.update(output_st.detach().cpu(), target.cpu())
-            self.train_teacher_iou_metrics.update(output_tc.cpu(), target.cpu())
+                # update metrics
+                self.train_metrics.update('loss', loss.item() * self.accumulation_steps)
+                self.train_metrics.update('supervised_loss', supervised_loss.item() * self.accumulation_steps)
+                self.train_metrics.update('teacher_loss', teacher_loss.item())
+                self.train_iou_metrics.update(output_st.detach().cpu(), target.cpu())
+                self.train_teacher_iou_metrics.update(output_tc.cpu(), target.cpu())
 
-            for met in self.metric_ftns:
-                self.train_metrics.update(met.__name__, met(output_st, target))
+                for met in self.metric_ftns:
+                    self.train_metrics.update(met.__name__, met(output_st, target))
 
             if batch_idx % self.log_step == 0:
-                # self.writer.add_image('input', make_grid(data.cpu(), nrow=8, normalize=True))
-                # st_masks = visualize.viz_pred_cityscapes(output_st)
-                # tc_masks = visualize.viz_pred_cityscapes(output_tc)
-                # self.writer.add_image('st_pred', make_grid(st_masks, nrow=8, normalize=False))
-                # self.writer.add_image('tc_pred', make_grid(tc_masks, nrow=8, normalize=False))
-                self.logger.info(
-                    'Train Epoch: {} [{}]/[{}] Loss: {:.6f} mIoU: {:.6f} Teacher mIoU: {:.6f} Supervised Loss: {:.6f} '
-                    'Knowledge Distillation loss: '
-                    '{:.6f} Hint Loss: {:.6f} Teacher Loss: {:.6f}'.format(
-                        epoch,
-                        batch_idx,
-                        self.len_epoch,
-                        self.train_metrics.avg('loss'),
-                        self.train_iou_metrics.get_iou(),
-                        self.train_teacher_iou_metrics.get_iou(),
-                        self.train_metrics.avg('supervised_loss'),
-                        self.train_metrics.avg('kd_loss'),
-                        self.train_metrics.avg('hint_loss'),
-                        self.train_metrics.avg('teacher_loss'),
-                    ))
-
-            if batch_idx % self.importance_log_interval == 0:
+                with self.step_timer.phase('logging'):
+                    # self.writer.add_image('input', make_grid(data.cpu(), nrow=8, normalize=True))
+                    # st_masks = visualize.viz_pred_cityscapes(output_st)
+                    # tc_masks = visualize.viz_pred_cityscapes(output_tc)
+                    # self.writer.add_image('st_pred', make_grid(st_masks, nrow=8, normalize=False))
+                    # self.writer.add_image('tc_pred', make_grid(tc_masks, nrow=8, normalize=False))
+                    self.logger.info(
+                        'Train Epoch: {} [{}]/[{}] Loss: {:.6f} mIoU: {:.6f} Teacher mIoU: {:.6f} Supervised Loss: '
+                        '{:.6f} Knowledge Distillation loss: '
+                        '{:.6f} Hint Loss: {:.6f} Teacher Loss: {:.6f}'.format(
+                            epoch,
+                            batch_idx,
+                            self.len_epoch,
+                            self.train_metrics.avg('loss'),
+                            self.train_iou_metrics.get_iou(),
+                            self.train_teacher_iou_metrics.get_iou(),
+                            self.train_metrics.avg('supervised_loss'),
+                            self.train_metrics.avg('kd_loss'),
+                            self.train_metrics.avg('hint_loss'),
+                            self.train_metrics.avg('teacher_loss'),
+                        ))
+                self.step_timer.emit(self.writer, self.logger)
+                self.prefetcher.emit(self.writer, self.logger)
+
+            if batch_idx % self.importance_log_interval == 0 and is_main_process():
                 importance_hitherto = self.importance_tracker.average()
                 self.logger.info('Importance of filters in layers')
                 for name, vector in importance_hitherto.items():
@@ -260,6 +275,10 @@ class TaylorPruneTrainer(BaseTrainer):
             if batch_idx == self.len_epoch:
                 break
 
+        # reduce the metrics over the ranks of a distributed run
+        self.train_metrics.synchronize()
+        self.train_iou_metrics.synchronize()
+        self.train_teacher_iou_metrics.synchronize()
         log = self.train_metrics.result()
         log.update({'train_teacher_mIoU': self.train_teacher_iou_metrics.get_iou()})
         log.update({'train_student_mIoU': self.train_iou_metrics.get_iou()})
@@ -311,6 +330,9 @@ class TaylorPruneTrainer(BaseTrainer):
 
                 for met in self.metric_ftns:
                     self.valid_metrics.update(met.__name__, met(output, target))
+        # reduce the metrics over the ranks of a distributed run
+        self.valid_metrics.synchronize()
+        self.valid_iou_metrics.synchronize()
         result = self.valid_metrics.result()
         result['mIoU'] = self.valid_iou_metrics.get_iou()
 
@@ -349,6 +371,9 @@ class TaylorPruneTrainer(BaseTrainer):
                 for met in self.metric_ftns:
                     self.test_metrics.update(met.__name__, met(output, target))
 
+        # reduce the metrics over the ranks of a distributed run
+        self.test_metrics.synchronize()
+        self.test_iou_metrics.synchronize()
         result = self.test_metrics.result()
         result['mIoU'] = self.test_iou_metrics.get_iou()
 
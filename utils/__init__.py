@@ -1,4 +1,9 @@
 from .util import *
 #from .visualize import apply_mask
 from .weight_scheduler import WeightScheduler
+from .precision import MixedPrecision
+from .step_timer import StepTimer
+from .profiler import TrainingProfiler
+from .prefetch import DevicePrefetcher
+from .distributed import init_distributed, is_distributed, is_main_process, get_rank, get_world_size
 from .tta_process import *
\ No newline at end of file
@@ -0,0 +1,179 @@
+import csv
+import json
+import time
+import numpy as np
+import torch
+from torch import nn
+from beautifultable import BeautifulTable
+
+REPORT_COLUMNS = ['block', 'teacher_block', 'student_block',
+                  'teacher_params', 'student_params',
+                  'teacher_flops', 'student_flops',
+                  'teacher_activation_mb', 'student_activation_mb',
+                  'teacher_ms', 'student_ms', 'speedup']
+
+
+def _conv_flops(module, inp, out):
+    kernel_ops = module.kernel_size[0] * module.kernel_size[1] * (module.in_channels // module.groups)
+    # one multiply and one add per kernel element
+    return out.numel() * (2 * kernel_ops + (module.bias is not None))
+
+
+def _linear_flops(module, inp, out):
+    return out.numel() * (2 * module.in_features + (module.bias is not None))
+
+
+def _norm_flops(module, inp, out):
+    # normalize then scale and shift
+    return 4 * out.numel()
+
+
+FLOP_COUNTERS = {
+    nn.Conv2d: _conv_flops,
+    nn.Linear: _linear_flops,
+    nn.BatchNorm2d: _norm_flops,
+}
+
+
+def count_flops_and_activations(block, inputs):
+    """
+    Run block once and count the FLOPs of its convolution, linear and batchnorm layers and the size of the outputs of
+    its leaf modules i.e. activations kept for backward in training
+    :param block: nn.Module
+    :param inputs: tuple of torch.Tensor - input of block
+    :return: tuple of (FLOPs, activation memory in MB)
+    """
+    stats = {'flops': 0, 'bytes': 0}
+
+    def hook(module, inp, out):
+        counter = FLOP_COUNTERS.get(type(module))
+        if counter is not None:
+            stats['flops'] += counter(module, inp, out)
+        if isinstance(out, torch.Tensor):
+            stats['bytes'] += out.numel() * out.element_size()
+
+    handles = [module.register_forward_hook(hook) for module in block.modules() if len(list(module.children())) == 0]
+    try:
+        with torch.no_grad():
+            block(*inputs)
+    finally:
+        for handle in handles:
+            handle.remove()
+    return stats['flops'], stats['bytes'] / 2 ** 20
+
+
+def time_block(block, inputs, warmup=3, repeats=10, backward=False):
+    """
+    :param backward: bool - time forward and backward w.r.t the parameters of block instead of forward only
+    :return: float - median wall time of a call in milliseconds
+    """
+    times = []
+    for step in range(warmup + repeats):
+        start = time.perf_counter()
+        if backward:
+            block(*inputs).sum().backward()
+        else:
+            with torch.no_grad():
+                block(*inputs)
+        if step >= warmup:
+            times.append(time.perf_counter() - start)
+    block.zero_grad()
+    return 1000 * float(np.median(times))
+
+
+def capture_block_inputs(model, block_names, x):
+    """
+    :param model: nn.Module - network containing the blocks
+    :param block_names: list of str - names of blocks whose input is captured
+    :param x: torch.Tensor - input of model
+    :return: dict - block name -> tuple of input tensors of that block
+    """
+    captured = dict()
+
+    def capture_handle_for(block_name):
+        def capture_handle(m, inp):
+            captured.setdefault(block_name, tuple(i.detach() for i in inp))
+        return capture_handle
+
+    handles = [model.get_block(block_name, model.teacher).register_forward_pre_hook(capture_handle_for(block_name))
+               for block_name in block_names]
+    try:
+        with torch.no_grad():
+            model.teacher(x)
+    finally:
+        for handle in handles:
+            handle.remove()
+    missing = [block_name for block_name in block_names if block_name not in captured]
+    if missing:
+        raise ValueError('Blocks {} are not called in the forward of teacher'.format(missing))
+    return captured
+
+
+def profile_blocks(model, x, block_names, warmup=3, repeats=10, backward=False):
+    """
+    Profile the teacher and student version of each block on the input it receives in the teacher network
+    :param model: DepthwiseStudent - student with replaced blocks
+    :param x: torch.Tensor - input of the network at training resolution
+    :param block_names: list of str - names of blocks to profile
+    :return: list of dict - one row per block with the columns of REPORT_COLUMNS
+    """
+    block_inputs = capture_block_inputs(model, block_names, x)
+    rows = []
+    for block_name in block_names:
+        inputs = block_inputs[block_name]
+        row = {'block': block_name}
+        for prefix, network in (('teacher', model.teacher), ('student', model.student)):
+            block = model.get_block(block_name, network)
+            requires_grad = [p.requires_grad for p in block.parameters()]
+            for p in block.parameters():
+                p.requires_grad_(backward)
+            flops, activation_mb = count_flops_and_activations(block, inputs)
+            row[prefix + '_block'] = type(block).__name__
+            row[prefix + '_params'] = sum(p.numel() for p in block.parameters())
+            row[prefix + '_flops'] = flops
+            row[prefix + '_activation_mb'] = activation_mb
+            row[prefix + '_ms'] = time_block(block, inputs, warmup, repeats, backward)
+            for p, flag in zip(block.parameters(), requires_grad):
+                p.requires_grad_(flag)
+        row['speedup'] = row['teacher_ms'] / row['student_ms']
+        rows.append(row)
+    return rows
+
+
+def sort_report(rows, sort_by='speedup', descending=False):
+    if sort_by not in REPORT_COLUMNS:
+        raise ValueError('Unknown column: {}. Expect one of {}'.format(sort_by, REPORT_COLUMNS))
+    return sorted(rows, key=lambda row: row[sort_by], reverse=descending)
+
+
+def write_report(rows, path):
+    """
+    write rows as csv or json depending on the extension of path
+    """
+    path = str(path)
+    if path.endswith('.json'):
+        with open(path, 'w') as handle:
+            json.dump(rows, handle, indent=4)
+    elif path.endswith('.csv'):
+        with open(path, 'w', newline='') as handle:
+            writer = csv.DictWriter(handle, fieldnames=REPORT_COLUMNS)
+            writer.writeheader()
+            writer.writerows(rows)
+    else:
+        raise ValueError('Unsupported report format, expect .csv or .json but got: {}'.format(path))
+
+
+def report_table(rows):
+    table = BeautifulTable(max_width=200)
+    table.column_headers = ['Block name', 'old block', 'new block', 'params old/new', 'GFLOPs old/new',
+                            'act. MB old/new', 'ms old/new', 'speedup']
+    for row in rows:
+        table.append_row([row['block'],
+                          row['teacher_block'],
+                          row['student_block'],
+                          '{}/{}'.format(row['teacher_params'], row['student_params']),
+                          '{:.3f}/{:.3f}'.format(row['teacher_flops'] / 1e9, row['student_flops'] / 1e9),
+                          '{:.1f}/{:.1f}'.format(row['teacher_activation_mb'], row['student_activation_mb']),
+                          '{:.2f}/{:.2f}'.format(row['teacher_ms'], row['student_ms']),
+                          '{:.2f}x'.format(row['speedup'])])
+    return str(table)
@@ -0,0 +1,82 @@
+import os
+import random
+import numpy as np
+import torch
+import torch.distributed as dist
+
+
+def init_distributed(backend=None):
+    """
+    Join the process group of a run launched with torchrun, which sets RANK, LOCAL_RANK and WORLD_SIZE. Nothing is
+    done for a single process run
+    :param backend: str - backend of torch.distributed e.g. gloo, nccl (default: nccl if cuda is available else gloo)
+    :return: bool - True if the process is part of a group of several processes
+    """
+    if int(os.environ.get('WORLD_SIZE', 1)) <= 1 or not dist.is_available():
+        return False
+    if dist.is_initialized():
+        return True
+    if backend is None:
+        backend = 'nccl' if torch.cuda.is_available() else 'gloo'
+    if backend == 'nccl':
+        torch.cuda.set_device(get_local_rank())
+    else:
+        # torchrun limits every process to 1 thread, split the cores between the processes of the node instead
+        torch.set_num_threads(max(1, (os.cpu_count() or 1) // int(os.environ.get('LOCAL_WORLD_SIZE', 1))))
+    dist.init_process_group(backend=backend)
+    # augmentations done in the main process (num_workers = 0) differ across ranks, weights are synchronized by DDP
+    random.seed(random.getrandbits(32) + get_rank())
+    np.random.seed((np.random.randint(2 ** 31) + get_rank()) % 2 ** 32)
+    return True
+
+
+def is_distributed():
+    return dist.is_available() and dist.is_initialized() and dist.get_world_size() > 1
+
+
+def get_rank():
+    return dist.get_rank() if is_distributed() else 0
+
+
+def get_local_rank():
+    return int(os.environ.get('LOCAL_RANK', 0))
+
+
+def get_world_size():
+    return dist.get_world_size() if is_distributed() else 1
+
+
+def is_main_process():
+    return get_rank() == 0
+
+
+def barrier():
+    if is_distributed():
+        dist.barrier()
+
+
+def broadcast_object(obj, src=0):
+    """
+    :return: obj of process src, e.g. the run id of rank 0 so that every rank writes in the same directories
+    """
+    if not is_distributed():
+        return obj
+    objects = [obj]
+    dist.broadcast_object_list(objects, src=src)
+    return objects[0]
+
+
+def all_reduce_array(array):
+    """
+    sum a numpy array over all processes
+    :param array: np.ndarray
+    :return: np.ndarray - sum with the dtype of array
+    """
+    if not is_distributed():
+        return array
+    # gloo and nccl don't reduce every numpy dtype, the sum is done in float64
+    tensor = torch.from_numpy(np.asarray(array, dtype=np.float64))
+    if dist.get_backend() == 'nccl':
+        tensor = tensor.cuda()
+    dist.all_reduce(tensor)
+    return tensor.cpu().numpy().astype(np.asarray(array).dtype)
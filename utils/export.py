@@ -0,0 +1,168 @@
+import time
+import numpy as np
+import torch
+from torch import nn
+from beautifultable import BeautifulTable
+import models.students as module_students
+from models import forgiving_state_restore, GSCNN
+from models.students.qat import has_fake_quant, remove_fake_quant
+from utils.block_profiler import time_block
+
+try:
+    import onnxruntime
+except ImportError:
+    onnxruntime = None
+
+EXPORT_FORMATS = ['torchscript', 'onnx']
+
+
+def rebuild_student(checkpoint, teacher):
+    """
+    Rebuild the student of a checkpoint of LayerwiseTrainer (or its subclasses) from its pruning manifest: the blocks
+    of config.pruning.pruning_plan replaced until the epoch of the checkpoint are replaced again and fake
+    quantization is inserted if it was distilled with trainer.qat, then the weights are loaded
+    :param checkpoint: dict - checkpoint saved by the trainer i.e. with arch, epoch, config and state_dict
+    :param teacher: nn.Module - network of config.teacher, its weights are overwritten by those of the checkpoint
+    :return: nn.Module - float student in eval mode on CPU
+    """
+    config = checkpoint['config']
+    model = getattr(module_students, checkpoint['arch'])(teacher, config)
+    plan = [block for block in config['pruning']['pruning_plan'] if block['epoch'] <= checkpoint['epoch']]
+    # Avoid error when loading deprecate checkpoint which don't have 'args' in config.pruning
+    kwargs = config['pruning']['args'] if 'args' in config['pruning'] else config['pruning']['pruner']
+    model.replace(plan, **kwargs)
+    qat = config['trainer'].get('qat')
+    if qat is not None:
+        model.enable_qat([block['name'] for block in plan], qat.get('backend', 'x86'))
+        if qat.get('student_epoch') is not None and qat['student_epoch'] <= checkpoint['epoch']:
+            model.enable_qat(None, qat.get('backend', 'x86'))
+    forgiving_state_restore(model, checkpoint['state_dict'])
+    student = model.student
+    if has_fake_quant(student):
+        student = remove_fake_quant(student)
+    return student.cpu().eval()
+
+
+class ExportWrapper(nn.Module):
+    """
+    Student with tensor inputs only and a single output. The canny edges of GSCNN can't be traced, they are an extra
+    input of the exported model
+    """
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+        self.edge_input = isinstance(model, GSCNN)
+
+    def input_names(self):
+        return ['input', 'edges'] if self.edge_input else ['input']
+
+    def example_inputs(self, batch_size, height, width):
+        x = torch.randn(batch_size, 3, height, width)
+        if self.edge_input:
+            return x, GSCNN.canny_edges(x)
+        return x,
+
+    def forward(self, x, *edges):
+        if self.edge_input:
+            return self.model(x, None, edges[0])
+        return self.model(x)
+
+
+def export_torchscript(wrapper, inputs, path, script=False):
+    """
+    :param script: bool - script the model instead of tracing it, only works for models without dynamic python
+    :return: torch.jit.ScriptModule - exported model loaded back from path
+    """
+    with torch.no_grad():
+        module = torch.jit.script(wrapper) if script else torch.jit.trace(wrapper, inputs)
+        module = torch.jit.freeze(module.eval())
+    torch.jit.save(module, path)
+    return torch.jit.load(path)
+
+
+def export_onnx(wrapper, inputs, path, opset=17):
+    """
+    export with a dynamic batch dimension
+    :return: str - path
+    """
+    input_names = wrapper.input_names()
+    dynamic_axes = {name: {0: 'batch'} for name in input_names + ['output']}
+    with torch.no_grad():
+        torch.onnx.export(wrapper, inputs, path, opset_version=opset, input_names=input_names,
+                          output_names=['output'], dynamic_axes=dynamic_axes, do_constant_folding=True)
+    return path
+
+
+def onnx_session(path, threads=None):
+    """
+    :return: callable - run the ONNX model with onnxruntime on CPU and return a Tensor
+    """
+    if onnxruntime is None:
+        raise ValueError('onnxruntime is not installed, it is needed to validate the ONNX export')
+    options = onnxruntime.SessionOptions()
+    if threads is not None:
+        options.intra_op_num_threads = threads
+    session = onnxruntime.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+    names = [node.name for node in session.get_inputs()]
+
+    def run(*inputs):
+        outputs = session.run(None, {name: tensor.numpy() for name, tensor in zip(names, inputs)})
+        return torch.from_numpy(outputs[0])
+    return run
+
+
+def check_parity(reference, exported, atol=1e-3, rtol=1e-3):
+    """
+    :param reference: Tensor - output of the eager student
+    :param exported: Tensor - output of the exported model on the same inputs
+    :return: dict - max absolute difference, ratio of equal argmax over the class dimension and whether all values
+        match within the tolerances
+    """
+    return {
+        'max_abs_diff': float((reference - exported).abs().max()),
+        'argmax_agreement': float((reference.argmax(dim=1) == exported.argmax(dim=1)).float().mean()),
+        'parity': bool(torch.allclose(reference, exported, atol=atol, rtol=rtol)),
+    }
+
+
+def time_runtime(run, inputs, warmup=3, repeats=10):
+    """
+    :return: float - median wall time of a call in milliseconds
+    """
+    times = []
+    for step in range(warmup + repeats):
+        start = time.perf_counter()
+        run(*inputs)
+        if step >= warmup:
+            times.append(time.perf_counter() - start)
+    return 1000 * float(np.median(times))
+
+
+def validate_exports(wrapper, runtimes, inputs, atol=1e-3, rtol=1e-3, warmup=3, repeats=10):
+    """
+    compare the exported models to the eager student on the same inputs and time all of them
+    :param runtimes: dict - name of runtime (e.g. torchscript, onnxruntime) to callable returning a Tensor
+    :return: list of dict - one row per runtime with parity and latency, the first row is the eager student
+    """
+    with torch.no_grad():
+        reference = wrapper(*inputs)
+        rows = [dict(runtime='eager', **check_parity(reference, reference, atol, rtol),
+                     latency_ms=time_block(wrapper, inputs, warmup, repeats))]
+        for name, run in runtimes.items():
+            row = dict(runtime=name, **check_parity(reference, run(*inputs), atol, rtol))
+            row['latency_ms'] = time_runtime(run, inputs, warmup, repeats)
+            rows.append(row)
+    for row in rows:
+        row['speedup'] = rows[0]['latency_ms'] / row['latency_ms']
+    return rows
+
+
+def export_table(rows):
+    table = BeautifulTable(max_width=200)
+    table.column_headers = ['runtime', 'max abs diff', 'argmax agreement', 'parity', 'latency ms', 'speedup']
+    for row in rows:
+        table.append_row([row['runtime'], '{:.2e}'.format(row['max_abs_diff']),
+                          '{:.4f}'.format(row['argmax_agreement']), str(row['parity']),
+                          '{:.2f}'.format(row['latency_ms']), '{:.2f}x'.format(row['speedup'])])
+    return str(table)
@@ -0,0 +1,60 @@
+import contextlib
+import torch
+
+AUTOCAST_DTYPES = {
+    'fp32': None,
+    'bf16': torch.bfloat16,
+    'fp16': torch.float16
+}
+
+
+class MixedPrecision:
+    """
+    Mixed precision and memory format used by the forward passes of a trainer. The weights are kept in fp32 (master
+    weights), only the forward passes run under autocast. Losses are computed outside of autocast and every loss of
+    losses/ casts its inputs to fp32 first, so bf16 or fp16 predictions and hints never reach a softmax, log or
+    reduction of a loss.
+    """
+
+    def __init__(self, dtype='fp32', channels_last=False, device_type='cpu'):
+        """
+        :param dtype: str - 'fp32', 'bf16' or 'fp16' (cuda only)
+        :param channels_last: bool - store 4D inputs and weights as NHWC
+        :param device_type: str - 'cpu' or 'cuda'
+        """
+        if dtype not in AUTOCAST_DTYPES:
+            raise ValueError('Unsupported precision. Expect one of {} but got: {}'.format(list(AUTOCAST_DTYPES), dtype))
+        self.dtype = dtype
+        self.channels_last = channels_last
+        self.device_type = device_type
+
+    @property
+    def enabled(self):
+        return AUTOCAST_DTYPES[self.dtype] is not None
+
+    def autocast(self):
+        """
+        :return: context manager in which forward passes run with the configured precision
+        """
+        if not self.enabled:
+            return contextlib.nullcontext()
+        return torch.autocast(device_type=self.device_type, dtype=AUTOCAST_DTYPES[self.dtype])
+
+    def to_device(self, tensor, device):
+        """
+        move a batch to device, images are converted to channels last if configured
+        """
+        if self.channels_last and tensor.dim() == 4:
+            return tensor.to(device, memory_format=torch.channels_last)
+        return tensor.to(device)
+
+    def apply_memory_format(self, model):
+        """
+        convert weights of model to the configured memory format, must be called again after blocks are replaced
+        """
+        if self.channels_last:
+            model.to(memory_format=torch.channels_last)
+        return model
+
+    def __str__(self):
+        return '{}{}'.format(self.dtype, ' channels_last' if self.channels_last else '')
@@ -0,0 +1,154 @@
+import queue
+import threading
+import numpy as np
+import torch
+
+# queue items marking the end of the underlying iterable and an exception raised while loading
+_END = object()
+
+
+class _Failure:
+    def __init__(self, exception):
+        self.exception = exception
+
+
+def _map_tensors(batch, fn):
+    if torch.is_tensor(batch):
+        return fn(batch)
+    if isinstance(batch, (list, tuple)):
+        return type(batch)(_map_tensors(elem, fn) for elem in batch)
+    if isinstance(batch, dict):
+        return {key: _map_tensors(value, fn) for key, value in batch.items()}
+    return batch
+
+
+class DevicePrefetcher:
+    """
+    Load the next batches in a background thread while the current step computes. On cuda, batches are pinned and
+    copied with non-blocking copies on a side stream so that the host to device copy of batch i+1 overlaps the compute
+    of batch i. On cpu, the thread prepares the next batches (collation, transforms when num_workers is 0) ahead of
+    the training loop. The number of ready batches at each step is recorded: a queue that is always empty means the
+    run is input-bound.
+    """
+
+    def __init__(self, device, enabled=False, queue_size=2, pin_memory=True):
+        """
+        :param device: torch.device - device batches are copied to
+        :param enabled: bool - if False, batches are returned as they come from the data loader
+        :param queue_size: int - maximum number of batches prepared ahead
+        :param pin_memory: bool - pin batches before copying them to a cuda device
+        """
+        if queue_size < 1:
+            raise ValueError('trainer.prefetch.queue_size must be at least 1, got {}'.format(queue_size))
+        self.enabled = enabled
+        self.device = device
+        self.queue_size = queue_size
+        self.pin_memory = pin_memory and device.type == 'cuda'
+        self._depths = []
+        # batches prepared after the previous pass over an infinite loader was stopped, e.g. by len_epoch
+        self._pending_iterator = None
+        self._pending = []
+
+    def _transfer(self, batch, stream):
+        if stream is None:
+            return batch, None
+
+        def copy(tensor):
+            if self.pin_memory and not tensor.is_pinned():
+                tensor = tensor.pin_memory()
+            return tensor.to(self.device, non_blocking=True)
+
+        with torch.cuda.stream(stream):
+            batch = _map_tensors(batch, copy)
+            event = torch.cuda.Event()
+            event.record(stream)
+        return batch, event
+
+    def _load(self, iterator, ready, stop, leftover):
+        stream = torch.cuda.Stream(self.device) if self.device.type == 'cuda' else None
+        try:
+            for batch in iterator:
+                item = self._transfer(batch, stream)
+                if not self._put(ready, item, stop):
+                    leftover.append(item)
+                    return
+            item = _END
+        except Exception as e:
+            item = _Failure(e)
+        self._put(ready, item, stop)
+
+    @staticmethod
+    def _put(ready, item, stop):
+        # wake up regularly so that the thread exits when the consumer stopped
+        while not stop.is_set():
+            try:
+                ready.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _ready(self, item):
+        batch, event = item
+        if event is not None:
+            stream = torch.cuda.current_stream(self.device)
+            stream.wait_event(event)
+            # the memory of tensors allocated on the side stream mustn't be reused before the step used them
+            _map_tensors(batch, lambda tensor: tensor.record_stream(stream))
+        return batch
+
+    def iterate(self, iterable):
+        """
+        iterate over a data loader with batches prepared in a background thread
+        """
+        if not self.enabled:
+            yield from iterable
+            return
+        iterator = iter(iterable)
+        if iterator is self._pending_iterator:
+            while self._pending:
+                self._depths.append(len(self._pending))
+                yield self._ready(self._pending.pop(0))
+
+        ready = queue.Queue(maxsize=self.queue_size)
+        stop = threading.Event()
+        leftover = []
+        thread = threading.Thread(target=self._load, args=(iterator, ready, stop, leftover), daemon=True)
+        thread.start()
+        try:
+            while True:
+                self._depths.append(ready.qsize())
+                item = ready.get()
+                if item is _END:
+                    break
+                if isinstance(item, _Failure):
+                    raise item.exception
+                yield self._ready(item)
+        finally:
+            stop.set()
+            thread.join()
+            # keep the prepared batches of an iterator that is resumed at the next pass e.g. inf_loop
+            self._pending_iterator, self._pending = None, []
+            if iterator is iterable:
+                self._pending_iterator = iterator
+                while not ready.empty():
+                    item = ready.get_nowait()
+                    if item is not _END and not isinstance(item, _Failure):
+                        self._pending.append(item)
+                self._pending += leftover
+
+    def reset(self):
+        self._depths = []
+
+    def emit(self, writer, logger):
+        """
+        write the average number of ready batches since the last call to writer and reset
+        :param writer: TensorboardWriter
+        :param logger: logging.Logger
+        """
+        if not self.enabled or not self._depths:
+            return
+        depth = float(np.mean(self._depths))
+        writer.add_scalar('prefetch/queue_depth', depth)
+        logger.debug('Prefetch queue depth: {:.2f}/{}'.format(depth, self.queue_size))
+        self.reset()
@@ -0,0 +1,83 @@
+import contextlib
+import os
+import torch
+from .distributed import is_distributed, get_rank
+try:
+    from torch.profiler import profile, schedule, ProfilerActivity
+except ImportError:  # torch < 1.8.1
+    profile = None
+
+
+class TrainingProfiler:
+    """
+    Capture a window of training steps of one epoch with torch.profiler. The profiler is started before the epoch is
+    prepared (block replacement, hint registration) and advances its wait/warmup/active schedule at every step. For
+    each active window, a Chrome trace and a table of the top-k operators are written to log_dir/profile.
+    """
+
+    def __init__(self, log_dir, device, enabled=True, epoch=1, wait=1, warmup=1, active=3, repeat=1,
+                 record_shapes=True, profile_memory=True, with_stack=False, top_k=20, sort_by=None):
+        """
+        :param log_dir: pathlib.Path - log dir of the run
+        :param device: torch.device - cuda activities are recorded if the device is cuda
+        :param epoch: int - epoch which is profiled
+        :param wait, warmup, active, repeat: int - schedule of torch.profiler, the first wait steps are skipped, the
+            next warmup steps are traced but discarded, the next active steps are recorded. The cycle runs repeat times
+        :param top_k: int - number of operators in the table
+        :param sort_by: str - column of the table used for sorting (default: self cpu/cuda time total)
+        """
+        if enabled and profile is None:
+            raise ValueError('trainer.profile requires torch.profiler (torch >= 1.8.1)')
+        self.enabled = enabled
+        self.output_dir = os.path.join(str(log_dir), 'profile')
+        self.device = device
+        self.epoch = epoch
+        self.schedule_args = dict(wait=wait, warmup=warmup, active=active, repeat=repeat)
+        self.record_shapes = record_shapes
+        self.profile_memory = profile_memory
+        self.with_stack = with_stack
+        self.top_k = top_k
+        if sort_by is None:
+            sort_by = 'self_cuda_time_total' if device.type == 'cuda' else 'self_cpu_time_total'
+        self.sort_by = sort_by
+        self._profiler = None
+        self._current_epoch = None
+
+    @contextlib.contextmanager
+    def profile_epoch(self, epoch):
+        """
+        context manager wrapping the training of an epoch, it's a no-op except for the profiled epoch
+        """
+        if not self.enabled or epoch != self.epoch:
+            yield
+            return
+        os.makedirs(self.output_dir, exist_ok=True)
+        activities = [ProfilerActivity.CPU]
+        if self.device.type == 'cuda':
+            activities.append(ProfilerActivity.CUDA)
+        self._current_epoch = epoch
+        with profile(activities=activities, schedule=schedule(**self.schedule_args),
+                     on_trace_ready=self._on_trace_ready, record_shapes=self.record_shapes,
+                     profile_memory=self.profile_memory, with_stack=self.with_stack) as profiler:
+            self._profiler = profiler
+            try:
+                yield
+            finally:
+                self._profiler = None
+
+    def step(self):
+        """
+        signal the end of a training step
+        """
+        if self._profiler is not None:
+            self._profiler.step()
+
+    def _on_trace_ready(self, profiler):
+        name = 'epoch{}_step{}'.format(self._current_epoch, profiler.step_num)
+        if is_distributed():
+            name += '_rank{}'.format(get_rank())
+        profiler.export_chrome_trace(os.path.join(self.output_dir, 'trace_{}.json'.format(name)))
+        table = profiler.key_averages(group_by_input_shape=self.record_shapes).table(sort_by=self.sort_by,
+                                                                                     row_limit=self.top_k)
+        with open(os.path.join(self.output_dir, 'top_ops_{}.txt'.format(name)), 'w') as handle:
+            handle.write(table)
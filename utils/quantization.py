@@ -0,0 +1,183 @@
+import io
+import copy
+import inspect
+import torch
+from torch import fx
+from torch.ao.quantization import get_default_qconfig_mapping
+from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+from beautifultable import BeautifulTable
+from models.students.transform_blocks import DepthwiseSeparableBlock
+from utils.util import MetricTracker, CityscapesMetricTracker
+from utils.block_profiler import time_block
+
+QUANTIZATION_BACKENDS = ['x86', 'fbgemm']
+
+
+def quantization_config(model, backend='x86', skip_blocks=(), float_depthwise=False):
+    """
+    int8 config of the CPU backend: activations are quantized per tensor and weights per output channel, which keeps
+    the depthwise convolutions of DepthwiseSeparableBlock (a single filter per channel) accurate
+    :param model: nn.Module - float model that would be quantized
+    :param backend: str - x86 or fbgemm
+    :param skip_blocks: list of str - name of blocks kept in float e.g. final
+    :param float_depthwise: bool - keep the depthwise convolutions of DepthwiseSeparableBlock in float, only their
+        pointwise convolutions are quantized
+    :return: QConfigMapping
+    """
+    if backend not in QUANTIZATION_BACKENDS:
+        raise ValueError('Unsupported quantization backend: {}. Expect one of {}'.format(backend,
+                                                                                         QUANTIZATION_BACKENDS))
+    mapping = get_default_qconfig_mapping(backend)
+    for block_name in skip_blocks:
+        mapping.set_module_name(block_name, None)
+    if float_depthwise:
+        for name, module in model.named_modules():
+            if isinstance(module, DepthwiseSeparableBlock):
+                mapping.set_module_name(name + '.separable_conv', None)
+    return mapping
+
+
+def model_inputs(model, data):
+    """
+    positional inputs of model for a batch. Inputs that only depend on the images and can't be traced (e.g. the canny
+    edges of GSCNN, see DepthwiseStudent.side_inputs) are computed here with the float model and given explicitly, so
+    that they are placeholders of the traced and int8 graphs
+    :param model: nn.Module - float model
+    :param data: Tensor of shape (Bx3xHxW)
+    :return: tuple - inputs of model and of the graphs prepared from it, arguments before a side input are None
+    """
+    side_inputs = getattr(model, 'side_inputs', None)
+    if side_inputs is None:
+        return data,
+    with torch.no_grad():
+        bound = inspect.signature(model.forward).bind(data, **side_inputs(data))
+    bound.apply_defaults()
+    return bound.args
+
+
+def prepare_quantization(model, example_inputs, qconfig_mapping, backend='x86'):
+    """
+    Trace a copy of model with torch.fx and insert observers. The batch norm layers following a convolution (and the
+    relu after them) are folded into the convolution, including the ones after the pointwise convolution of a
+    DepthwiseSeparableBlock since the graph is traced across module boundaries
+    :param model: nn.Module - float model, it isn't modified
+    :param example_inputs: tuple - inputs given by model_inputs
+    :return: fx.GraphModule - model with observers, to be calibrated
+    """
+    torch.backends.quantized.engine = backend
+    model = copy.deepcopy(model).cpu().eval()
+    try:
+        return prepare_fx(model, qconfig_mapping, example_inputs)
+    except (fx.proxy.TraceError, TypeError) as e:
+        raise ValueError('{} can not be traced by torch.fx, only traceable models can be quantized (inputs computed '
+                         'outside the graph must be declared with side_inputs): {}'.format(type(model).__name__, e))
+
+
+def calibrate(prepared, data_loader, num_batches, float_model):
+    """
+    run the first num_batches batches of data_loader through the observers
+    :param float_model: nn.Module - model prepared is traced from, computes the side inputs of each batch
+    :return: int - number of images seen by the observers
+    """
+    num_images = 0
+    with torch.no_grad():
+        for batch_idx, (data, _) in enumerate(data_loader):
+            if batch_idx >= num_batches:
+                break
+            prepared(*model_inputs(float_model, data.cpu()))
+            num_images += data.shape[0]
+    return num_images
+
+
+def convert_quantization(prepared):
+    """
+    :return: fx.GraphModule - int8 model for CPU inference
+    """
+    return convert_fx(prepared)
+
+
+def evaluate(model, data_loader, metric_ftns, segmentation=False, num_batches=None, float_model=None):
+    """
+    evaluate a model on CPU
+    :param metric_ftns: list of metric functions of models.metric
+    :param segmentation: bool - compute the mIoU over the confusion matrix of all batches as in LayerwiseTrainer
+    :param num_batches: int - number of evaluated batches (default: all)
+    :param float_model: nn.Module - float model computing the side inputs of each batch (default: model)
+    :return: dict - average of each metric, and mIoU for segmentation
+    """
+    float_model = model if float_model is None else float_model
+    metrics = MetricTracker(*[m.__name__ for m in metric_ftns])
+    iou_metrics = CityscapesMetricTracker()
+    with torch.no_grad():
+        for batch_idx, (data, target) in enumerate(data_loader):
+            if num_batches is not None and batch_idx >= num_batches:
+                break
+            output = model(*model_inputs(float_model, data.cpu()))
+            target = target.cpu()
+            for met in metric_ftns:
+                metrics.update(met.__name__, met(output, target), data.shape[0])
+            if segmentation:
+                iou_metrics.update(output, target)
+    result = {key: float(value) for key, value in metrics.result().items()}
+    if segmentation:
+        result['mIoU'] = float(iou_metrics.get_iou())
+    return result
+
+
+def model_size_mb(model):
+    """
+    :return: float - size of the serialized state dict
+    """
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell() / 2 ** 20
+
+
+def quantization_report(float_model, quantized_model, data_loader, metric_ftns, example_inputs, segmentation=False,
+                        num_batches=None, warmup=3, repeats=10):
+    """
+    evaluate the float and the int8 model on the same batches and time both on the same input
+    :param example_inputs: tuple - inputs given by model_inputs
+    :return: list of dict - one row per model with metrics, difference of each metric to the float model, median
+        latency (ms), speedup and size (MB)
+    """
+    rows = []
+    float_model = float_model.cpu().eval()
+    for name, model in [('float', float_model), ('int8', quantized_model)]:
+        row = {'model': name}
+        row.update(evaluate(model, data_loader, metric_ftns, segmentation, num_batches, float_model))
+        row['latency_ms'] = time_block(model, example_inputs, warmup, repeats)
+        row['size_mb'] = model_size_mb(model)
+        rows.append(row)
+    metric_names = [key for key in rows[0] if key not in ('model', 'latency_ms', 'size_mb')]
+    for row in rows:
+        for key in metric_names:
+            row[key + '_delta'] = row[key] - rows[0][key]
+        row['speedup'] = rows[0]['latency_ms'] / row['latency_ms']
+    return rows
+
+
+def trace_quantized(quantized, example_inputs):
+    """
+    :param example_inputs: tuple - inputs given by model_inputs, the ones left to None are not traced
+    :return: torch.jit.ScriptModule - int8 model for deployment
+    """
+    if all(inp is not None for inp in example_inputs):
+        return torch.jit.trace(quantized, example_inputs)
+    names = list(inspect.signature(quantized.forward).parameters)
+    return torch.jit.trace(quantized, example_kwarg_inputs={name: inp for name, inp in zip(names, example_inputs)
+                                                            if inp is not None})
+
+
+def quantization_table(rows):
+    metric_names = [key for key in rows[0] if key not in ('model', 'latency_ms', 'size_mb', 'speedup')
+                    and not key.endswith('_delta')]
+    table = BeautifulTable(max_width=200)
+    table.column_headers = ['model'] + ['{} (delta)'.format(key) for key in metric_names] + \
+        ['latency ms', 'speedup', 'size MB']
+    for row in rows:
+        table.append_row([row['model']] +
+                         ['{:.4f} ({:+.4f})'.format(row[key], row[key + '_delta']) for key in metric_names] +
+                         ['{:.2f}'.format(row['latency_ms']), '{:.2f}x'.format(row['speedup']),
+                          '{:.1f}'.format(row['size_mb'])])
+    return str(table)
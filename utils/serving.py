@@ -0,0 +1,342 @@
+import os
+import json
+import time
+import struct
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import numpy as np
+import torch
+from PIL import Image
+from models import GSCNN
+from utils.tta_process import scale_and_flip_image, get_crops_image, reverse_mapping
+
+MEAN_STD = ([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
+# messages are a 4 bytes big-endian length, a json header of that length and a payload of header['size'] bytes
+_LENGTH = struct.Struct('>I')
+
+
+class SegmentationPredictor:
+    """
+    Turn uint8 RGB images (HxWx3) into label maps (HxW) with a segmentation student. Images of a batch are run in one
+    forward. With tta, each image is cut into overlapping windows at several scales, flipped, and the averaged
+    probabilities are used as in LayerwiseTrainer._test_epoch
+    """
+
+    def __init__(self, model, tta=None, mean_std=MEAN_STD, edge_input=False):
+        """
+        :param model: nn.Module or torch.jit.ScriptModule - returns logits of shape (BxCxHxW)
+        :param tta: dict - sliding-window test time augmentation e.g. {"scales": [0.75, 1.0], "crop_size": 512},
+            disabled if None
+        :param edge_input: bool - the model takes the canny edges as second input, as GSCNN exported by export.py
+        """
+        self.model = model.eval()
+        self.tta = tta
+        self.edge_input = edge_input
+        self.mean_std = mean_std
+        self._mean = torch.tensor(mean_std[0]).view(3, 1, 1)
+        self._std = torch.tensor(mean_std[1]).view(3, 1, 1)
+
+    def _normalize(self, image):
+        tensor = torch.from_numpy(np.ascontiguousarray(image)).permute(2, 0, 1).float().div_(255)
+        return (tensor - self._mean) / self._std
+
+    def _forward(self, x):
+        if self.edge_input:
+            return self.model(x, GSCNN.canny_edges(x))
+        return self.model(x)
+
+    def __call__(self, images):
+        """
+        :param images: list of np.ndarray of shape (HxWx3), all with the same shape if tta is disabled
+        :return: list of np.ndarray of shape (HxW) - uint8 label maps
+        """
+        with torch.no_grad():
+            if self.tta is None:
+                logits = self._forward(torch.stack([self._normalize(image) for image in images]))
+                return list(logits.argmax(dim=1).to(torch.uint8).numpy())
+            return self._predict_tta(images)
+
+    def _predict_tta(self, images):
+        scales = self.tta.get('scales', [1.0])
+        crops = [get_crops_image(scale_and_flip_image(Image.fromarray(image), self.mean_std, scales), scales,
+                                 crop_size=self.tta.get('crop_size', 512)) for image in images]
+        # windows of all images are run in a single forward
+        results = self._forward(torch.cat([tensors for _, _, tensors in crops])).numpy()
+        labels, start = [], 0
+        for ori_size, mapping, tensors in crops:
+            outputs = reverse_mapping(mapping, results[start: start + len(tensors)], ori_size)
+            labels.append(np.mean(outputs, axis=0).argmax(axis=0).astype(np.uint8))
+            start += len(tensors)
+        return labels
+
+
+def latency_summary(latencies_ms):
+    """
+    :return: dict - mean, p50, p90, p99 and max of latencies in milliseconds
+    """
+    latencies_ms = np.asarray(latencies_ms, dtype=np.float64)
+    if len(latencies_ms) == 0:
+        return {}
+    return {
+        'mean': float(latencies_ms.mean()),
+        'p50': float(np.percentile(latencies_ms, 50)),
+        'p90': float(np.percentile(latencies_ms, 90)),
+        'p99': float(np.percentile(latencies_ms, 99)),
+        'max': float(latencies_ms.max()),
+    }
+
+
+def tune_intra_op_threads(predict, images, candidates=None, repeats=3):
+    """
+    Time the predictor with each number of intra-op threads per worker, the cores are split between
+    cpu_count // threads workers running concurrently, and return the setting with the highest throughput
+    :param predict: callable - e.g. SegmentationPredictor
+    :param images: list of np.ndarray - batch predicted by each call
+    :param candidates: list of int - numbers of threads per worker (default: powers of 2 up to the number of cpus)
+    :param repeats: int - number of timed calls per worker
+    :return: (int, int) - threads per worker and number of workers
+    """
+    cpus = os.cpu_count() or 1
+    if candidates is None:
+        candidates = [2 ** i for i in range(cpus.bit_length()) if 2 ** i <= cpus]
+    throughputs = {}
+    for threads in candidates:
+        num_workers = max(1, cpus // threads)
+        with ThreadPoolExecutor(num_workers, initializer=torch.set_num_threads, initargs=(threads,)) as executor:
+            list(executor.map(lambda _: predict(images), range(num_workers)))
+            start = time.perf_counter()
+            list(executor.map(lambda _: predict(images), range(num_workers * repeats)))
+            throughputs[(threads, num_workers)] = num_workers * repeats * len(images) / (time.perf_counter() - start)
+
+    best = max(throughputs, key=throughputs.get)
+    logging.getLogger(__name__).info(
+        'Inference throughput (images/sec) by threads x workers: {}, using {} threads x {} workers'.format(
+            ', '.join('{}x{}: {:.2f}'.format(t, w, throughput) for (t, w), throughput in throughputs.items()),
+            *best))
+    return best
+
+
+class MicroBatcher:
+    """
+    Group concurrent requests into batches run by a pool of worker threads. A batch starts with the oldest waiting
+    request and takes the requests of the same image shape arriving within max_delay_ms after it, up to
+    max_batch_size. While all workers are busy, requests keep queuing so batches grow with the load
+    """
+
+    def __init__(self, predict, max_batch_size=8, max_delay_ms=10., num_workers=1, intra_op_threads=None):
+        """
+        :param predict: callable - list of images to list of results, run in the worker threads
+        :param max_batch_size: int
+        :param max_delay_ms: float - latency budget spent waiting for more requests before a batch is run
+        :param num_workers: int - number of batches run concurrently
+        :param intra_op_threads: int - torch threads of each worker (default: cpus split between the workers)
+        """
+        if max_batch_size < 1 or num_workers < 1:
+            raise ValueError('max_batch_size and num_workers must be at least 1, got {} and {}'.format(
+                max_batch_size, num_workers))
+        self.predict = predict
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay_ms / 1000
+        self.num_workers = num_workers
+        if intra_op_threads is None:
+            intra_op_threads = max(1, (os.cpu_count() or 1) // num_workers)
+        self.intra_op_threads = intra_op_threads
+        self._executor = None
+        self._queue = None
+        self._slots = None
+        self._deferred = []
+        self._task = None
+        self.latencies_ms = []
+        self.batch_sizes = []
+
+    async def start(self):
+        self._executor = ThreadPoolExecutor(self.num_workers, thread_name_prefix='inference',
+                                            initializer=torch.set_num_threads, initargs=(self.intra_op_threads,))
+        self._queue = asyncio.Queue()
+        self._slots = asyncio.Semaphore(self.num_workers)
+        self._task = asyncio.ensure_future(self._collect())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._executor.shutdown(wait=True)
+
+    async def submit(self, image):
+        """
+        :param image: np.ndarray
+        :return: result of predict for this image
+        """
+        future = asyncio.get_event_loop().create_future()
+        await self._queue.put((image, future, time.perf_counter()))
+        return await future
+
+    def _take_deferred(self, shape, batch):
+        for item in list(self._deferred):
+            if len(batch) == self.max_batch_size:
+                return
+            if item[0].shape == shape:
+                self._deferred.remove(item)
+                batch.append(item)
+
+    async def _next_batch(self):
+        first = self._deferred.pop(0) if self._deferred else await self._queue.get()
+        batch = [first]
+        self._take_deferred(first[0].shape, batch)
+        deadline = first[2] + self.max_delay
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            try:
+                # requests already waiting are taken even if the budget is spent
+                item = self._queue.get_nowait() if timeout <= 0 else \
+                    await asyncio.wait_for(self._queue.get(), timeout)
+            except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                break
+            # requests of another shape start one of the next batches
+            if item[0].shape == first[0].shape:
+                batch.append(item)
+            else:
+                self._deferred.append(item)
+        return batch
+
+    async def _collect(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            await self._slots.acquire()
+            batch = await self._next_batch()
+            future = loop.run_in_executor(self._executor, self.predict, [item[0] for item in batch])
+            future.add_done_callback(partial(self._done, batch))
+
+    def _done(self, batch, future):
+        self._slots.release()
+        self.batch_sizes.append(len(batch))
+        end = time.perf_counter()
+        exception = future.exception()
+        for i, (_, request, arrival) in enumerate(batch):
+            # the client may have gone
+            if request.done():
+                continue
+            if exception is not None:
+                request.set_exception(exception)
+            else:
+                request.set_result(future.result()[i])
+                self.latencies_ms.append(1000 * (end - arrival))
+
+    def stats(self):
+        """
+        :return: dict - number of requests and batches, mean batch size and latency percentiles in the server
+        """
+        return {
+            'requests': len(self.latencies_ms),
+            'batches': len(self.batch_sizes),
+            'mean_batch_size': float(np.mean(self.batch_sizes)) if self.batch_sizes else 0.,
+            'latency_ms': latency_summary(self.latencies_ms),
+        }
+
+    def reset_stats(self):
+        self.latencies_ms = []
+        self.batch_sizes = []
+
+
+async def read_message(reader):
+    """
+    :return: (dict, bytes) - header and payload, None at the end of the stream
+    """
+    try:
+        length, = _LENGTH.unpack(await reader.readexactly(_LENGTH.size))
+        header = json.loads((await reader.readexactly(length)).decode())
+        payload = await reader.readexactly(header.get('size', 0))
+    except asyncio.IncompleteReadError:
+        return None
+    return header, payload
+
+
+async def write_message(writer, header, payload=b''):
+    header = json.dumps(dict(header, size=len(payload))).encode()
+    writer.write(_LENGTH.pack(len(header)) + header + payload)
+    await writer.drain()
+
+
+class InferenceServer:
+    """
+    asyncio TCP front end of a MicroBatcher. A request is an uint8 image of shape (height x width x 3) with the header
+    {"height": h, "width": w}, the response is the uint8 label map with the same header or {"error": message}.
+    A connection can send several requests one after the other
+    """
+
+    def __init__(self, batcher, host='127.0.0.1', port=8765):
+        """
+        :param port: int - 0 picks a free port, see self.port after start
+        """
+        self.batcher = batcher
+        self.host = host
+        self.port = port
+        self._server = None
+
+    async def start(self):
+        await self.batcher.start()
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+        await self.batcher.stop()
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                message = await read_message(reader)
+                if message is None:
+                    break
+                header, payload = message
+                try:
+                    image = np.frombuffer(payload, dtype=np.uint8).reshape(header['height'], header['width'], 3)
+                    labels = await self.batcher.submit(image)
+                except Exception as e:
+                    await write_message(writer, {'error': '{}: {}'.format(type(e).__name__, e)})
+                    continue
+                await write_message(writer, {'height': labels.shape[0], 'width': labels.shape[1]},
+                                    np.ascontiguousarray(labels, dtype=np.uint8).tobytes())
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+class InferenceClient:
+    """
+    client of InferenceServer keeping one connection
+    """
+
+    def __init__(self, host='127.0.0.1', port=8765):
+        self.host = host
+        self.port = port
+        self._reader = None
+        self._writer = None
+
+    async def connect(self):
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        return self
+
+    async def predict(self, image):
+        """
+        :param image: np.ndarray of shape (HxWx3) - uint8 RGB image
+        :return: np.ndarray of shape (HxW) - uint8 label map
+        """
+        await write_message(self._writer, {'height': image.shape[0], 'width': image.shape[1]},
+                            np.ascontiguousarray(image, dtype=np.uint8).tobytes())
+        message = await read_message(self._reader)
+        if message is None:
+            raise ConnectionError('Connection closed by the inference server')
+        header, payload = message
+        if 'error' in header:
+            raise RuntimeError(header['error'])
+        return np.frombuffer(payload, dtype=np.uint8).reshape(header['height'], header['width'])
+
+    async def close(self):
+        self._writer.close()
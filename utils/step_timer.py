@@ -0,0 +1,132 @@
+import time
+import contextlib
+from collections import OrderedDict
+import numpy as np
+import torch
+from torch.autograd.profiler import record_function
+
+_NULL_CONTEXT = contextlib.nullcontext()
+
+
+class StepTimer:
+    """
+    Wall time of the phases of training steps e.g. data wait, host to device copy, forward, loss, backward, optimizer
+    step, metric update and logging. Durations are accumulated until emit() writes them as histograms and prints the
+    average time and share of each phase, so that an input-bound run (large data share) can be told apart from a
+    compute-bound one.
+    """
+
+    def __init__(self, enabled=False, synchronize=False, device=None):
+        """
+        :param enabled: bool - if False, every method is a no-op
+        :param synchronize: bool - wait for cuda kernels at the end of each phase so that asynchronous gpu work is
+            accounted to the phase that launched it instead of the next blocking call
+        :param device: torch.device - device to synchronize
+        """
+        self.enabled = enabled
+        # label phases with record_function ranges for torch.profiler, set by the trainer while profiling
+        self.record_functions = False
+        self.synchronize = synchronize and device is not None and device.type == 'cuda'
+        self.device = device
+        self._durations = OrderedDict()
+        # phases measured inside another phase, e.g. teacher forward inside forward, aren't added to the step time
+        self._nested = set()
+        self._starts = dict()
+        self._handles = []
+
+    def _record(self, name, start):
+        if self.synchronize:
+            torch.cuda.synchronize(self.device)
+        self._durations.setdefault(name, []).append(time.perf_counter() - start)
+
+    @contextlib.contextmanager
+    def _phase(self, name):
+        with record_function(name) if self.record_functions else _NULL_CONTEXT:
+            start = time.perf_counter()
+            try:
+                yield
+            finally:
+                if self.enabled:
+                    self._record(name, start)
+
+    def phase(self, name):
+        """
+        :return: context manager measuring the wall time of its body as phase name
+        """
+        if not (self.enabled or self.record_functions):
+            return _NULL_CONTEXT
+        return self._phase(name)
+
+    def iterate(self, iterable, name='data'):
+        """
+        iterate over a data loader and record the time waiting for each batch as phase name
+        """
+        if not self.enabled:
+            yield from iterable
+            return
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                batch = next(iterator)
+            except StopIteration:
+                return
+            self._durations.setdefault(name, []).append(time.perf_counter() - start)
+            yield batch
+
+    def attach(self, module, name):
+        """
+        measure every forward of module as a nested phase. Forwards that are interrupted by an exception e.g. the
+        early exit of DepthwiseStudent.forward_hints are not recorded
+        :param module: nn.Module
+        """
+        if not self.enabled:
+            return
+        self._nested.add(name)
+
+        def start_handle(m, inp):
+            self._starts[name] = time.perf_counter()
+
+        def stop_handle(m, inp, out):
+            if name in self._starts:
+                self._record(name, self._starts.pop(name))
+
+        self._handles += [module.register_forward_pre_hook(start_handle), module.register_forward_hook(stop_handle)]
+
+    def detach(self):
+        while self._handles:
+            self._handles.pop().remove()
+        self._starts.clear()
+
+    def reset(self):
+        self._durations = OrderedDict()
+
+    def summary(self):
+        """
+        :return: OrderedDict - phase name -> (mean time in ms, share of step time)
+        """
+        # shares are computed from total times since some phases e.g. logging don't happen at every step
+        totals = OrderedDict((name, float(np.sum(values))) for name, values in self._durations.items())
+        step_time = sum(total for name, total in totals.items() if name not in self._nested)
+        return OrderedDict((name, (1000 * total / len(self._durations[name]),
+                                   total / step_time if step_time > 0 else 0.))
+                           for name, total in totals.items())
+
+    def emit(self, writer, logger):
+        """
+        write the accumulated durations as histograms and average scalars to writer, print the average time of each
+        phase and reset
+        :param writer: TensorboardWriter
+        :param logger: logging.Logger
+        """
+        if not self.enabled or not self._durations:
+            return
+        for name, values in self._durations.items():
+            values_ms = 1000 * np.asarray(values)
+            writer.add_histogram('step_time_ms/' + name, values_ms)
+            writer.add_scalar('step_time_ms/' + name, float(values_ms.mean()))
+        logger.info('Step time (ms): ' + ' | '.join(
+            '{}: {:.2f} ({:.0%})'.format(name, mean, share) if name not in self._nested
+            else '{}: {:.2f}'.format(name, mean)
+            for name, (mean, share) in self.summary().items()))
+        self.reset()
@@ -40,12 +40,12 @@ def collect_windows_result(w, h, coordinates, windows):
     count_predictions = np.zeros((num_classes, h, w))
     for i, coor in enumerate(coordinates):
         x1, y1, x2, y2 = coor
-        count_predictions[y1:y2, x1:x2] += 1
+        count_predictions[:, y1:y2, x1:x2] += 1
         average = windows[i]
         if full_probs[:, y1: y2, x1: x2].shape != average.shape:
             average = average[:, :y2 - y1, :x2 - x1]
         full_probs[:, y1:y2, x1:x2] += average
-    full_probs = full_probs / count_predictions.astype(np.float)
+    full_probs = full_probs / count_predictions.astype(np.float64)
     return full_probs
 
 
@@ -1,5 +1,6 @@
 import json
 import torch
+from torch.utils.data import DataLoader, IterableDataset
 import pandas as pd
 import numpy as np
 from pathlib import Path
@@ -7,6 +8,7 @@ from itertools import repeat
 from collections import OrderedDict
 from PIL import Image
 from scipy.special import softmax
+from .distributed import all_reduce_array, is_distributed
 
 
 def stat_cuda(msg):
@@ -37,8 +39,33 @@ def write_json(content, fname):
         json.dump(content, handle, indent=4, sort_keys=False)
 
 
-def inf_loop(data_loader):
-    """ wrapper function for endless data loader. """
+class _RepeatBatchSampler:
+    """ batch sampler that starts a new pass over batch_sampler whenever the previous one is exhausted """
+    def __init__(self, batch_sampler):
+        self.batch_sampler = batch_sampler
+
+    def __iter__(self):
+        while True:
+            yield from self.batch_sampler
+
+
+def inf_loop(data_loader, keep_workers=True):
+    """
+    wrapper function for endless data loader. The workers of a multi-process DataLoader are kept alive and keep
+    prefetching across passes instead of being re-spawned at the start of each pass.
+    :param keep_workers: bool - set to False if the dataset is changed between passes e.g. set_epoch(), workers hold
+        their own copy of the dataset
+    """
+    if keep_workers and isinstance(data_loader, DataLoader) and data_loader.num_workers > 0 \
+            and not data_loader.persistent_workers and not isinstance(data_loader.dataset, IterableDataset):
+        data_loader = DataLoader(data_loader.dataset, batch_sampler=_RepeatBatchSampler(data_loader.batch_sampler),
+                                 num_workers=data_loader.num_workers, collate_fn=data_loader.collate_fn,
+                                 pin_memory=data_loader.pin_memory, timeout=data_loader.timeout,
+                                 worker_init_fn=data_loader.worker_init_fn,
+                                 multiprocessing_context=data_loader.multiprocessing_context,
+                                 generator=data_loader.generator, prefetch_factor=data_loader.prefetch_factor)
+        yield from data_loader
+        return
     for loader in repeat(data_loader):
         yield from loader
 
@@ -69,6 +96,19 @@ class MetricTracker:
     def result(self):
         return dict(self._data.average)
 
+    def synchronize(self):
+        """
+        sum totals and counts over the processes of a distributed run so that every rank gets the same averages,
+        must be called once after the last update of an epoch
+        """
+        if not is_distributed():
+            return
+        totals = all_reduce_array(np.asarray(self._data.total.values, dtype=np.float64))
+        counts = all_reduce_array(np.asarray(self._data.counts.values, dtype=np.float64))
+        self._data['total'] = totals
+        self._data['counts'] = counts
+        self._data['average'] = np.divide(totals, counts, out=np.zeros_like(totals), where=counts > 0)
+
 
 class CityscapesMetricTracker:
     class_names = [
@@ -111,6 +151,13 @@ class CityscapesMetricTracker:
         conf = self.confusion_for_batch(outputs.view(-1), labels.view(-1))
         self.conf = self.conf + conf
 
+    def synchronize(self):
+        """
+        sum the confusion matrices of the processes of a distributed run, must be called once after the last update
+        of an epoch
+        """
+        self.conf = all_reduce_array(self.conf)
+
     def get_iou(self):
         if not np.any(self.conf):
             return 1.